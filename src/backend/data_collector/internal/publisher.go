@@ -27,6 +27,7 @@ func StartPublishing(client pulsar.Client, topic string, trades <-chan Trade) {
 		}
 
 		_, err = producer.Send(context.Background(), &pulsar.ProducerMessage{
+			Key:     trade.Symbol,
 			Payload: payload,
 		})
 
@@ -0,0 +1,35 @@
+"""Compare the strict Pydantic and lean msgspec trade decoders.
+
+Run from the service root: python -m benchmarks.decode_trade [--trades N]
+"""
+import argparse
+import time
+
+from benchmarks.synthetic import StreamConfig, make_payloads
+from src.decoding import TRADE_DECODERS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--trades', type=int, default=200_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = make_payloads(StreamConfig(trades=args.trades))
+    for name, decode in TRADE_DECODERS.items():
+        best = min(
+            _time(decode, payloads)
+            for _ in range(args.repeat)
+        )
+        print(f"{name:>10}: {args.trades / best:>12,.0f} trades/s  {best / args.trades * 1e9:>8.0f} ns/trade")
+
+
+def _time(decode, payloads) -> float:
+    started = time.perf_counter()
+    for payload in payloads:
+        decode(payload)
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Differential check of the aggregator engines against OHLCAggregator.
+
+Feeds the same synthetic trade streams (in order, out of order, sparse
+enough to cross day/month/year windows, with and without smooth_gaps)
+through every engine and compares the candles each trade emits, the
+windows left open and a checkpoint restored into a fresh engine.
+
+Run from the service root, exits non-zero on the first difference:
+
+    python -m benchmarks.differential --trades 20000
+
+tests/test_engines.py runs the same comparison on shorter streams.
+"""
+import argparse
+from math import isnan
+import sys
+from typing import Dict, List
+
+from benchmarks.synthetic import StreamConfig, make_payloads
+from src.aggregator import OHLCAggregator
+from src.decoding import decode_trade_tick
+from src.service import AGGREGATOR_ENGINES
+from src.timeframes import TIMEFRAME_CONFIG
+
+# 2023-12-25T00:00:00Z
+SPARSE_START_MS = 1_703_462_400_000
+
+SCENARIOS: Dict[str, dict] = {
+    'dense': dict(symbols=5, rate=50.0),
+    'dense-out-of-order': dict(symbols=5, rate=50.0, skew_ms=5_000),
+    # From a week before New Year, so even short streams close day, month and year windows
+    'sparse': dict(symbols=3, rate=0.002, start_ms=SPARSE_START_MS),
+    'sparse-out-of-order': dict(symbols=3, rate=0.002, skew_ms=3 * 86_400_000, start_ms=SPARSE_START_MS),
+}
+
+
+def _same_rows(left: dict, right: dict, smooth_gaps: bool) -> bool:
+    """Checkpoints hold the same windows, ignoring fields the engine does not read back"""
+    def normalize(windows: dict) -> dict:
+        normalized = {}
+        for symbol, rows in windows.items():
+            normalized[symbol] = []
+            for start, end, open_, high, low, close, last_close in rows:
+                window = (start, end, open_, high, low, close) if start != -1 else None
+                if not smooth_gaps or isnan(last_close):
+                    last_close = None
+                normalized[symbol].append((window, last_close))
+        return normalized
+    return normalize(left) == normalize(right)
+
+
+def _candles(emitted: list) -> list:
+    return [(timeframe.size, timeframe.unit.value, ohlc) for timeframe, ohlc in emitted]
+
+
+def compare(name: str, trades: list, smooth_gaps: bool, split: int) -> List[str]:
+    """Differences between each engine and OHLCAggregator, restoring from a checkpoint at trade split"""
+    failures = []
+    for engine_name, engine in AGGREGATOR_ENGINES.items():
+        if engine is OHLCAggregator:
+            continue
+        label = f"{name} smooth_gaps={smooth_gaps} {engine_name}"
+        reference = OHLCAggregator(timeframes=TIMEFRAME_CONFIG, smooth_gaps=smooth_gaps)
+        candidate = engine(timeframes=TIMEFRAME_CONFIG, smooth_gaps=smooth_gaps)
+
+        for i, trade in enumerate(trades):
+            if i == split:
+                if not _same_rows(reference.export_windows(), candidate.export_windows(), smooth_gaps):
+                    failures.append(f"{label}: checkpoint differs at trade {i}")
+                    break
+                restored = engine(timeframes=TIMEFRAME_CONFIG, smooth_gaps=smooth_gaps)
+                restored.import_windows(candidate.export_windows())
+                candidate = restored
+            expected = _candles(reference.add_trade(trade))
+            actual = _candles(candidate.add_trade(trade))
+            if expected != actual:
+                failures.append(f"{label}: trade {i} emitted {actual}, expected {expected}")
+                break
+        else:
+            symbols = {trade.symbol for trade in trades}
+            if any(reference.get_current_state(symbol) != candidate.get_current_state(symbol) for symbol in symbols):
+                failures.append(f"{label}: open windows differ")
+            elif not _same_rows(reference.export_windows(), candidate.export_windows(), smooth_gaps):
+                failures.append(f"{label}: final checkpoint differs")
+
+        batch_reference = OHLCAggregator(timeframes=TIMEFRAME_CONFIG, smooth_gaps=smooth_gaps)
+        batch_candidate = engine(timeframes=TIMEFRAME_CONFIG, smooth_gaps=smooth_gaps)
+        if batch_reference.add_trades(trades) != batch_candidate.add_trades(trades):
+            failures.append(f"{label}: add_trades differs")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trades', type=int, default=20_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    failures = []
+    for name, overrides in SCENARIOS.items():
+        config = StreamConfig(trades=args.trades, seed=args.seed, **overrides)
+        trades = [decode_trade_tick(payload) for payload in make_payloads(config)]
+        for smooth_gaps in (False, True):
+            scenario_failures = compare(name, trades, smooth_gaps, split=len(trades) // 2)
+            print(f"{name} smooth_gaps={smooth_gaps}: {'FAIL' if scenario_failures else 'ok'}")
+            failures.extend(scenario_failures)
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Throughput and per-trade latency of the aggregation pipeline.
+
+Feeds a synthetic trade stream through trade decoding, OHLCAggregator.add_trade
+and OHLCMessageProcessor (with in-memory Pulsar producer and ClickHouse client)
+and writes the results as JSON so runs can be compared across commits.
+
+Run from the service root:
+
+    python -m benchmarks.pipeline --symbols 50 --rate 2000 --output bench.json
+"""
+import argparse
+import asyncio
+from dataclasses import asdict
+from datetime import datetime, timezone
+import json
+import platform
+import subprocess
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.fakes import FakeMessage, InMemoryClickhouseClient, InMemoryProducer
+from benchmarks.synthetic import StreamConfig, make_payloads
+from src.decoding import TRADE_DECODERS, decode_trade_tick
+from src.processing import OHLCMessageProcessor
+from src.publishers import ClickhousePublisher, WebsocketPublisher
+from src.service import AGGREGATOR_ENGINES, BATCH_ONLY_ENGINES, OHLC_TABLE
+from src.timeframes import TIMEFRAME_CONFIG
+from src.write_buffer import ClickhouseWriteBuffer
+
+
+def summarize(latencies_ns: List[int], elapsed_s: float, trades: int) -> Dict[str, float]:
+    ordered = sorted(latencies_ns)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] / 1000
+
+    return {
+        'trades': trades,
+        'seconds': round(elapsed_s, 4),
+        'trades_per_s': round(trades / elapsed_s, 1),
+        'p50_us': round(percentile(0.50), 2),
+        'p99_us': round(percentile(0.99), 2),
+        'max_us': round(ordered[-1] / 1000, 2),
+    }
+
+
+def time_each(fn: Callable, items: list) -> Dict[str, float]:
+    latencies = []
+    clock = time.perf_counter_ns
+    started = clock()
+    for item in items:
+        t0 = clock()
+        fn(item)
+        latencies.append(clock() - t0)
+    return summarize(latencies, (clock() - started) / 1e9, len(items))
+
+
+def bench_decode(payloads: List[bytes]) -> Dict[str, dict]:
+    return {
+        f'decode/{name}': time_each(decode, payloads)
+        for name, decode in TRADE_DECODERS.items()
+    }
+
+
+def bench_aggregate(payloads: List[bytes], batch_size: int) -> Dict[str, dict]:
+    ticks = [decode_trade_tick(payload) for payload in payloads]
+    results = {}
+    for name, engine in AGGREGATOR_ENGINES.items():
+        results[f'aggregate/{name}'] = time_each(engine(TIMEFRAME_CONFIG).add_trade, ticks)
+
+        aggregator = engine(TIMEFRAME_CONFIG)
+        batches = [ticks[i:i + batch_size] for i in range(0, len(ticks), batch_size)]
+        latencies = []
+        started = time.perf_counter_ns()
+        for batch in batches:
+            t0 = time.perf_counter_ns()
+            aggregator.add_trades(batch)
+            # Spread the batch cost evenly over its trades
+            latencies.extend([(time.perf_counter_ns() - t0) // len(batch)] * len(batch))
+        results[f'aggregate_batch/{name}'] = summarize(latencies, (time.perf_counter_ns() - started) / 1e9, len(ticks))
+    return results
+
+
+async def _bench_processor(payloads: List[bytes], engine: str, decoder: str) -> dict:
+    producer = InMemoryProducer()
+    clickhouse_client = InMemoryClickhouseClient()
+    write_buffer = ClickhouseWriteBuffer(clickhouse_client, OHLC_TABLE)
+    write_buffer.start()
+    websocket_publisher = WebsocketPublisher(producer, TIMEFRAME_CONFIG)
+    processor = OHLCMessageProcessor(
+        AGGREGATOR_ENGINES[engine](timeframes=TIMEFRAME_CONFIG),
+        [websocket_publisher, ClickhousePublisher(clickhouse_client, TIMEFRAME_CONFIG, write_buffer)],
+        TRADE_DECODERS[decoder]
+    )
+    messages = [FakeMessage(payload, i) for i, payload in enumerate(payloads)]
+
+    latencies = []
+    clock = time.perf_counter_ns
+    started = clock()
+    for message in messages:
+        t0 = clock()
+        await processor.process_message(message)
+        latencies.append(clock() - t0)
+    await websocket_publisher.flush()
+    await write_buffer.close()
+    result = summarize(latencies, (clock() - started) / 1e9, len(messages))
+    result['candles_published'] = producer.sent
+    result['clickhouse_inserts'] = clickhouse_client.inserts
+    return result
+
+
+def bench_processor(payloads: List[bytes]) -> Dict[str, dict]:
+    return {
+        f'processor/{engine}/{decoder}': asyncio.run(_bench_processor(payloads, engine, decoder))
+        for engine in AGGREGATOR_ENGINES
+        if engine not in BATCH_ONLY_ENGINES
+        for decoder in TRADE_DECODERS
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trades', type=int, default=100_000)
+    parser.add_argument('--symbols', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=1_000.0, help='trades per second of event time')
+    parser.add_argument('--skew-ms', type=int, default=0, help='max random timestamp jitter')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=1_000, help='trades per add_trades call')
+    parser.add_argument('--only', choices=['decode', 'aggregate', 'processor'], action='append', help='run only these stages')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    stream = StreamConfig(trades=args.trades, symbols=args.symbols, rate=args.rate, skew_ms=args.skew_ms, seed=args.seed)
+    payloads = make_payloads(stream)
+    stages = args.only or ['decode', 'aggregate', 'processor']
+
+    results = {}
+    if 'decode' in stages:
+        results.update(bench_decode(payloads))
+    if 'aggregate' in stages:
+        results.update(bench_aggregate(payloads, args.batch_size))
+    if 'processor' in stages:
+        results.update(bench_processor(payloads))
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'stream': asdict(stream),
+            'batch_size': args.batch_size,
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""Synthetic trade streams for benchmarks."""
+from dataclasses import dataclass
+from json import dumps
+import random
+from typing import List
+from uuid import uuid4
+
+
+@dataclass
+class StreamConfig:
+    trades: int = 100_000
+    symbols: int = 20
+    # Aggregate trades per second of event time across all symbols
+    rate: float = 1_000.0
+    # Maximum random timestamp jitter, produces out-of-order trades when > 0
+    skew_ms: int = 0
+    start_ms: int = 1_700_000_000_000
+    seed: int = 42
+
+
+def make_payloads(config: StreamConfig) -> List[bytes]:
+    """Trade messages as the data collector publishes them"""
+    rng = random.Random(config.seed)
+    symbols = [f"SYM{i:04d}USDT" for i in range(config.symbols)]
+    prices = {symbol: rng.uniform(1, 50_000) for symbol in symbols}
+    trader_id = str(uuid4())
+    spacing_ms = 1000 / config.rate
+
+    payloads = []
+    for i in range(config.trades):
+        symbol = rng.choice(symbols)
+        prices[symbol] *= 1 + rng.gauss(0, 0.0005)
+        timestamp = config.start_ms + int(i * spacing_ms)
+        if config.skew_ms:
+            timestamp += rng.randint(-config.skew_ms, config.skew_ms)
+        payloads.append(dumps({
+            'trade_id': str(i),
+            'trader_id': trader_id,
+            'symbol': symbol,
+            'price': round(prices[symbol], 4),
+            'quantity': 0.01,
+            'volume': round(prices[symbol] * 0.01, 4),
+            'timestamp': timestamp,
+            'side': 'buy' if i % 2 else 'sell',
+        }).encode('utf-8'))
+    return payloads
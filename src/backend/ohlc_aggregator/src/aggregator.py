@@ -1,42 +1,80 @@
-from collections import defaultdict
 from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import DefaultDict, Dict, List, Tuple
+from datetime import timedelta
+from math import isnan
+import sys
+import time
+from typing import Dict, Iterable, List, Tuple
 
-from src.models import Trade, OHLC
+from src.checkpoint import WindowRow
+from src.models import Trade, TradeTick, OHLC
 from src.time_window import TimeWindow
+from src.utils import epoch_seconds
+from src.state_eviction import evict as _evict, state_size as _state_size
 
 
-@dataclass
+@dataclass(slots=True)
 class _WindowState:
-    start: datetime | None = None
+    start: int | None = None
+    end: int | None = None
     open: float | None = None
     high: float | None = None
     low: float | None = None
     close: float | None = None
+    # Close of the last emitted window, only kept with smooth_gaps
+    last_close: float | None = None
+
+
+class _SymbolState:
+    """One window per timeframe, in timeframe order, and when the symbol last traded"""
+
+    __slots__ = ('windows', 'last_trade')
+
+    def __init__(self, size: int):
+        self.windows = [_WindowState() for _ in range(size)]
+        self.last_trade = 0
+
+
+def _sample_state(size: int) -> _SymbolState:
+    """A state with every window open, to size symbols by"""
+    state = _SymbolState(size)
+    for window in state.windows:
+        window.start, window.end = 1 << 40, 1 << 41
+        window.open, window.high, window.low, window.close = 1.5, 2.5, 0.5, 1.25
+    return state
 
 
 class OHLCAggregator:
     def __init__(self, timeframes: List[TimeWindow], smooth_gaps: bool = False):
         self.timeframes = timeframes
         self.smooth_gaps = smooth_gaps
-        self._current_windows: DefaultDict[str, Dict[TimeWindow, _WindowState]] = defaultdict(lambda: defaultdict(_WindowState))
-        self._last_closes = defaultdict(dict)
+        self._states: Dict[str, _SymbolState] = {}
+        self._newest_trade = 0
+        self._symbol_bytes = _state_size(_sample_state(len(timeframes)))
+
+    def _get_state(self, symbol: str) -> _SymbolState:
+        state = self._states.get(symbol)
+        if state is None:
+            state = self._states[sys.intern(symbol)] = _SymbolState(len(self.timeframes))
+        return state
 
-    def add_trade(self, trade: Trade) -> List[Tuple[TimeWindow, OHLC]]:
+    def add_trade(self, trade: Trade | TradeTick) -> List[Tuple[TimeWindow, OHLC]]:
         ohlc_list = []
-        symbol = trade.symbol
+        timestamp = epoch_seconds(trade.timestamp)
+        symbol_state = self._get_state(trade.symbol)
+        if timestamp > symbol_state.last_trade:
+            symbol_state.last_trade = timestamp
+            if timestamp > self._newest_trade:
+                self._newest_trade = timestamp
 
-        for timeframe in self.timeframes:
-            window_start = timeframe.get_window_start(trade.timestamp)
-            state = self._current_windows[symbol][timeframe]
+        for timeframe, state in zip(self.timeframes, symbol_state.windows):
+            window_start, window_end = timeframe.get_window_bounds(timestamp)
 
             if state.start == window_start:
                 state.high = max(state.high, trade.price)
                 state.low = min(state.low, trade.price)
                 state.close = trade.price
             else:
-                if state.start is not None and timeframe.is_window_complete(state.start, trade.timestamp):
+                if state.start is not None and timestamp >= state.end:
                     ohlc = OHLC(
                         time=state.start,
                         open=state.open,
@@ -45,12 +83,14 @@ class OHLCAggregator:
                         close=state.close
                     )
                     ohlc_list.append((timeframe, ohlc))
-                    self._last_closes[symbol][timeframe] = state.close
+                    if self.smooth_gaps:
+                        state.last_close = state.close
 
                 state.start = window_start
+                state.end = window_end
 
-                if self.smooth_gaps and timeframe in self._last_closes.get(symbol, {}):
-                    state.open = self._last_closes[symbol][timeframe]
+                if self.smooth_gaps and state.last_close is not None:
+                    state.open = state.last_close
                 else:
                     state.open = trade.price
 
@@ -60,10 +100,19 @@ class OHLCAggregator:
 
         return ohlc_list
 
+    def add_trades(self, trades: Iterable[Trade | TradeTick]) -> List[Tuple[str, TimeWindow, OHLC]]:
+        return [
+            (trade.symbol, timeframe, ohlc)
+            for trade in trades
+            for timeframe, ohlc in self.add_trade(trade)
+        ]
+
     def get_current_state(self, symbol: str) -> Dict[TimeWindow, OHLC]:
+        symbol_state = self._states.get(symbol)
+        if symbol_state is None:
+            return {}
         current_state = {}
-        for timeframe in self.timeframes:
-            state = self._current_windows[symbol][timeframe]
+        for timeframe, state in zip(self.timeframes, symbol_state.windows):
             if state.start is not None:
                 current_state[timeframe] = OHLC(
                     time=state.start,
@@ -74,10 +123,64 @@ class OHLCAggregator:
                 )
         return current_state
 
+    def window_bounds(self, symbol: str) -> List[Tuple[int, int] | None]:
+        """Start and end of the open window per timeframe, in timeframe order, None where there is none"""
+        symbol_state = self._states.get(symbol)
+        if symbol_state is None:
+            return []
+        return [None if state.start is None else (state.start, state.end) for state in symbol_state.windows]
+
+    def get_window(self, symbol: str, index: int) -> OHLC:
+        """Candle of the open window of the index-th timeframe"""
+        state = self._states[symbol].windows[index]
+        return OHLC(time=state.start, open=state.open, high=state.high, low=state.low, close=state.close)
+
+    def export_windows(self) -> Dict[str, List[WindowRow]]:
+        windows = {}
+        for symbol, symbol_state in self._states.items():
+            rows = []
+            for state in symbol_state.windows:
+                last_close = float('nan') if state.last_close is None else state.last_close
+                if state.start is None:
+                    rows.append((-1, -1, 0.0, 0.0, 0.0, 0.0, last_close))
+                else:
+                    rows.append((state.start, state.end, state.open, state.high, state.low, state.close, last_close))
+            windows[symbol] = rows
+        return windows
+
+    def import_windows(self, windows: Dict[str, List[WindowRow]]) -> None:
+        for symbol, rows in windows.items():
+            symbol_state = self._get_state(symbol)
+            for state, (start, end, open_, high, low, close, last_close) in zip(symbol_state.windows, rows):
+                if start != -1:
+                    state.start, state.end = start, end
+                    state.open, state.high, state.low, state.close = open_, high, low, close
+                    # The shortest window started last, good enough as the last trade time
+                    symbol_state.last_trade = max(symbol_state.last_trade, start)
+                if not isnan(last_close):
+                    state.last_close = last_close
+            self._newest_trade = max(self._newest_trade, symbol_state.last_trade)
+
+    @property
+    def symbol_count(self) -> int:
+        return len(self._states)
+
+    def state_bytes(self) -> int:
+        """Estimated memory held by the window state"""
+        return len(self._states) * self._symbol_bytes
+
+    def evict_symbols(self, max_idle_s: float | None = None, max_bytes: int | None = None) -> List[str]:
+        """Drop symbols idle for max_idle_s, then the least recently traded ones above max_bytes.
+
+        Idle time is measured against the newest trade time seen, in epoch
+        seconds, so replaying a backlog does not make every symbol look idle.
+        Returns the evicted symbols, whose open windows are lost.
+        """
+        return _evict(self._states, self._newest_trade, self._symbol_bytes, max_idle_s, max_bytes)
+
     def cleanup_old_windows(self, max_age: timedelta):
-        cutoff = datetime.now() - max_age
-        for symbol in list(self._current_windows.keys()):
-            for timeframe in list(self._current_windows[symbol].keys()):
-                state = self._current_windows[symbol][timeframe]
-                if state.start and state.start < cutoff:
-                    del self._current_windows[symbol][timeframe]
+        cutoff = int(time.time() - max_age.total_seconds())
+        for symbol_state in self._states.values():
+            for state in symbol_state.windows:
+                if state.start is not None and state.start < cutoff:
+                    state.start = state.end = None
@@ -0,0 +1,226 @@
+"""Rebuild candles from recorded trades and bulk-load them into ClickHouse.
+
+Reads NDJSON files with one trade per line, as published by the data
+collector (optionally gzip-compressed), or Parquet files with at least the
+symbol, price and timestamp columns. Files are processed in the order given,
+and trades for a symbol are expected in time order. Nothing is published to
+Pulsar.
+
+    python -m src.backfill trades-2024-01-01.ndjson.gz [more files...]
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from clickhouse_connect import get_async_client
+
+from src.config import Settings
+from src.decoding import TRADE_DECODERS
+from src.models import OHLC, Trade, TradeTick
+from src.publishers import ClickhousePublisher
+from src.rollups import rebuild_rollups
+from src.service import AGGREGATOR_ENGINES, OHLC_TABLE
+from src.setup import create_table_if_not_exists
+from src.time_window import TimeWindow
+from src.timeframes import TIMEFRAME_CONFIG
+from src.utils import epoch_seconds
+from src.write_buffer import ClickhouseWriteBuffer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+PARQUET_COLUMNS = ['symbol', 'price', 'timestamp']
+
+
+class BackfillStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.trades = 0
+        self.rejected = 0
+        self.candles = 0
+        # Epoch seconds of the earliest and latest trade
+        self.first_trade: int | None = None
+        self.last_trade: int | None = None
+
+    def report(self, prefix: str) -> None:
+        elapsed = time.monotonic() - self.started
+        logger.info(
+            f"{prefix}: {self.trades:,} trades ({self.trades / elapsed:,.0f} trades/s), "
+            f"{self.rejected:,} rejected, {self.candles:,} candles in {elapsed:.1f}s"
+        )
+
+
+def _read_ndjson(path: str, batch_size: int, decode: Callable, stats: BackfillStats) -> Iterator[List]:
+    opener = gzip.open if path.endswith('.gz') else open
+    batch = []
+    with opener(path, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                batch.append(decode(line))
+            except Exception as e:
+                stats.rejected += 1
+                if stats.rejected <= 10:
+                    logger.warning(f"Skipping invalid trade in {path}: {e}")
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _read_parquet(path: str, batch_size: int, stats: BackfillStats) -> Iterator[List[TradeTick]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Reading Parquet files requires pyarrow (pip install pyarrow)") from e
+
+    for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=PARQUET_COLUMNS):
+        columns = record_batch.to_pydict()
+        batch = [
+            TradeTick(symbol=symbol, price=price, timestamp=timestamp)
+            for symbol, price, timestamp in zip(columns['symbol'], columns['price'], columns['timestamp'])
+            if price is not None and price > 0
+        ]
+        stats.rejected += record_batch.num_rows - len(batch)
+        yield batch
+
+
+def iter_trade_batches(
+    paths: Iterable[str],
+    batch_size: int,
+    decode: Callable[[bytes], Trade | TradeTick],
+    stats: BackfillStats
+) -> Iterator[List[Trade | TradeTick]]:
+    for path in paths:
+        logger.info(f"Reading {path}")
+        if path.endswith('.parquet'):
+            yield from _read_parquet(path, batch_size, stats)
+        else:
+            yield from _read_ndjson(path, batch_size, decode, stats)
+
+
+async def publish_batch(publisher: ClickhousePublisher, candles: List[Tuple[str, TimeWindow, OHLC]]) -> None:
+    """Hand a batch's candles to the write buffer with one call per symbol"""
+    by_symbol: Dict[str, List[Tuple[TimeWindow, OHLC]]] = {}
+    for symbol, timeframe, ohlc in candles:
+        by_symbol.setdefault(symbol, []).append((timeframe, ohlc))
+    for symbol, symbol_candles in by_symbol.items():
+        await publisher.publish_many(symbol, symbol_candles)
+
+
+async def backfill(args: argparse.Namespace, settings: Settings | None) -> None:
+    aggregator = AGGREGATOR_ENGINES[args.engine](timeframes=TIMEFRAME_CONFIG, smooth_gaps=False)
+    stats = BackfillStats()
+
+    clickhouse_client = None
+    write_buffer = None
+    publisher = None
+    if settings is not None:
+        clickhouse_client = await get_async_client(
+            host=settings.clickhouse_host,
+            port=settings.clickhouse_port,
+            username=settings.clickhouse_username,
+            password=settings.clickhouse_password,
+            database=settings.clickhouse_db,
+        )
+        # Same schema and retention the service sets up, the backfill may run before it ever started
+        await create_table_if_not_exists(clickhouse_client, settings.retention_days)
+        write_buffer = ClickhouseWriteBuffer(
+            clickhouse_client,
+            OHLC_TABLE,
+            max_rows=args.flush_rows,
+            max_bytes=64 * 1024 * 1024,
+            max_age_ms=10_000,
+            capacity_rows=4 * args.flush_rows
+        )
+        write_buffer.start()
+        publisher = ClickhousePublisher(clickhouse_client, TIMEFRAME_CONFIG, write_buffer)
+
+    symbols = set()
+    last_report = time.monotonic()
+    try:
+        for trades in iter_trade_batches(args.files, args.batch_size, TRADE_DECODERS[args.decoder], stats):
+            candles = aggregator.add_trades(trades)
+            symbols.update(trade.symbol for trade in trades)
+            stats.trades += len(trades)
+            if trades:
+                stamps = [epoch_seconds(trade.timestamp) for trade in trades]
+                first, last = min(stamps), max(stamps)
+                stats.first_trade = first if stats.first_trade is None else min(stats.first_trade, first)
+                stats.last_trade = last if stats.last_trade is None else max(stats.last_trade, last)
+            stats.candles += len(candles)
+            if publisher is not None:
+                await publish_batch(publisher, candles)
+
+            if time.monotonic() - last_report >= args.report_interval:
+                stats.report("Progress")
+                last_report = time.monotonic()
+
+        if args.close_open_windows and stats.last_trade is not None:
+            # Windows running past the input are partial and would replace the
+            # complete candles already written for them under the same key
+            closed, skipped = [], 0
+            for symbol in symbols:
+                for index, bounds in enumerate(aggregator.window_bounds(symbol)):
+                    if bounds is None:
+                        continue
+                    if bounds[1] > stats.last_trade + 1:
+                        skipped += 1
+                        continue
+                    closed.append((symbol, aggregator.timeframes[index], aggregator.get_window(symbol, index)))
+            logger.info(f"Closing {len(closed):,} open windows, skipped {skipped:,} that extend past the input")
+            stats.candles += len(closed)
+            if publisher is not None:
+                await publish_batch(publisher, closed)
+
+        if write_buffer is not None and stats.first_trade is not None:
+            await write_buffer.close()
+            # The rollup views only add to their buckets, rewritten candles need them rebuilt
+            await rebuild_rollups(
+                clickhouse_client, sorted(symbols), stats.first_trade, stats.last_trade + 1, settings.retention_days
+            )
+    finally:
+        if write_buffer is not None:
+            await write_buffer.close()
+            logger.info(
+                f"Wrote {write_buffer.metrics.flushed_rows:,} rows in {write_buffer.metrics.flushes} inserts "
+                f"(slowest {write_buffer.metrics.max_flush_latency_s * 1000:.0f} ms), "
+                f"dropped {write_buffer.metrics.dropped_rows:,} rejected rows"
+            )
+        if clickhouse_client is not None:
+            await asyncio.to_thread(clickhouse_client.close)
+
+    stats.report("Done")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help='NDJSON (.ndjson, .jsonl, .gz) or .parquet trade files')
+    parser.add_argument('--batch-size', type=int, default=50_000, help='trades aggregated per batch')
+    parser.add_argument('--flush-rows', type=int, default=200_000, help='candle rows per ClickHouse insert')
+    parser.add_argument('--engine', choices=sorted(AGGREGATOR_ENGINES), default='columnar')
+    parser.add_argument('--decoder', choices=sorted(TRADE_DECODERS), default='lean')
+    parser.add_argument(
+        '--close-open-windows',
+        action='store_true',
+        help='also write the windows left open at the end of the input that ended by its last trade; '
+             'windows extending past it are skipped since they are incomplete'
+    )
+    parser.add_argument('--report-interval', type=float, default=5.0, help='seconds between progress reports')
+    parser.add_argument('--dry-run', action='store_true', help='aggregate without writing to ClickHouse')
+    args = parser.parse_args()
+
+    asyncio.run(backfill(args, None if args.dry_run else Settings()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+from datetime import timedelta
+from math import isnan
+import sys
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from src.checkpoint import WindowRow
+from src.models import Trade, TradeTick, OHLC
+from src.state_eviction import evict, state_size
+from src.time_window import FIXED_LAYOUT, TimeUnit, TimeWindow
+from src.utils import epoch_seconds
+
+_EMPTY = -1
+_CALENDAR_UNITS = (TimeUnit.MONTH, TimeUnit.YEAR)
+
+# open, high, low, close
+Prices = Tuple[float, float, float, float]
+
+
+def _nests(fine: TimeWindow, coarse: TimeWindow) -> bool:
+    """Whether every window start of coarse is also a window start of fine"""
+    if coarse.unit in _CALENDAR_UNITS:
+        if fine.unit in _CALENDAR_UNITS:
+            return fine.unit == TimeUnit.MONTH or coarse.unit == TimeUnit.YEAR
+        # Calendar windows start at UTC midnight
+        period, step, offset = FIXED_LAYOUT[fine.unit](fine.size)
+        return 86400 % period == 0 and offset % period % step == 0
+    if fine.unit in _CALENDAR_UNITS:
+        return False
+
+    fine_period, fine_step, fine_offset = FIXED_LAYOUT[fine.unit](fine.size)
+    period, step, offset = FIXED_LAYOUT[coarse.unit](coarse.size)
+    if period % fine_period:
+        return False
+    # Starts repeat every period, which the fine period divides
+    return all(
+        ((start - offset) % period + fine_offset) % fine_period % fine_step == 0
+        for start in range(0, period, step)
+    )
+
+
+def _fold(earlier: Prices | None, later: Prices | None) -> Prices | None:
+    if earlier is None:
+        return later
+    if later is None:
+        return earlier
+    return (earlier[0], max(earlier[1], later[1]), min(earlier[2], later[2]), later[3])
+
+
+class _SymbolState:
+    """Per timeframe: the window, the prices folded in from closed windows of its
+    source timeframe (for a root, the trades themselves) and the smooth_gaps open"""
+
+    __slots__ = ('starts', 'ends', 'folded', 'opens', 'last_closes', 'last_trade')
+
+    def __init__(self, size: int):
+        self.starts = [_EMPTY] * size
+        self.ends = [_EMPTY] * size
+        self.folded: List[Prices | None] = [None] * size
+        self.opens: List[float | None] = [None] * size
+        self.last_closes: List[float | None] = [None] * size
+        self.last_trade = 0
+
+
+class CascadingOHLCAggregator:
+    """OHLC aggregator deriving coarser timeframes from closed windows of finer ones.
+
+    Timeframes form a DAG built from their window starts: each one is fed by
+    the coarsest finer timeframe whose windows start wherever its own do
+    (1s -> 5s -> 15s -> 1m ..., 1d -> 1w, 1d -> 1M -> 1Y). A trade only updates
+    the root timeframes; when a window closes, its candle is folded into the
+    timeframes fed by it, and only those whose window changed as well are
+    visited further. Emits exactly the candles OHLCAggregator emits, in the
+    same order, including for out-of-order trades.
+    """
+
+    def __init__(self, timeframes: List[TimeWindow], smooth_gaps: bool = False):
+        self.timeframes = timeframes
+        self.smooth_gaps = smooth_gaps
+        self._states: Dict[str, _SymbolState] = {}
+        self._newest_trade = 0
+
+        lengths = [end - start for start, end in (timeframe.get_window_bounds(0) for timeframe in timeframes)]
+        self._order = sorted(range(len(timeframes)), key=lambda i: (lengths[i], i))
+        self._sources: List[int | None] = [None] * len(timeframes)
+        self._feeds: List[List[int]] = [[] for _ in timeframes]
+        for position, i in enumerate(self._order):
+            for j in reversed(self._order[:position]):
+                if _nests(timeframes[j], timeframes[i]):
+                    self._sources[i] = j
+                    self._feeds[j].append(i)
+                    break
+        self._roots = [i for i in self._order if self._sources[i] is None]
+        self._symbol_bytes = state_size(_SymbolState(len(timeframes))) + len(timeframes) * sys.getsizeof((0.0, 0.0, 0.0, 0.0))
+
+    def _get_state(self, symbol: str) -> _SymbolState:
+        state = self._states.get(symbol)
+        if state is None:
+            state = self._states[sys.intern(symbol)] = _SymbolState(len(self.timeframes))
+        return state
+
+    def add_trade(self, trade: Trade | TradeTick) -> List[Tuple[TimeWindow, OHLC]]:
+        timestamp = epoch_seconds(trade.timestamp)
+        price = trade.price
+        state = self._get_state(trade.symbol)
+        if timestamp > state.last_trade:
+            state.last_trade = timestamp
+            if timestamp > self._newest_trade:
+                self._newest_trade = timestamp
+
+        emitted: List[Tuple[int, OHLC]] = []
+        for root in self._roots:
+            start, end = self.timeframes[root].get_window_bounds(timestamp)
+            if state.starts[root] == start:
+                open_, high, low, _ = state.folded[root]
+                state.folded[root] = (open_, max(high, price), min(low, price), price)
+            else:
+                self._roll(state, root, start, end, timestamp, None, emitted)
+                state.folded[root] = (price, price, price, price)
+
+        if len(emitted) > 1:
+            emitted.sort(key=lambda item: item[0])
+        return [(self.timeframes[i], ohlc) for i, ohlc in emitted]
+
+    def _roll(
+        self,
+        state: _SymbolState,
+        i: int,
+        start: int,
+        end: int,
+        timestamp: int,
+        source_prices: Prices | None,
+        emitted: List[Tuple[int, OHLC]]
+    ) -> None:
+        """Move timeframe i to the window of timestamp, given the final prices of its source's previous window"""
+        prices = _fold(state.folded[i], source_prices)
+        if state.starts[i] == start:
+            # Only the source window changed, keep what it collected
+            state.folded[i] = prices
+            return
+
+        if state.starts[i] != _EMPTY and timestamp >= state.ends[i]:
+            emitted.append((i, self._to_ohlc(state, i, prices)))
+            if self.smooth_gaps:
+                state.last_closes[i] = prices[3]
+        state.starts[i] = start
+        state.ends[i] = end
+        state.folded[i] = None
+        state.opens[i] = state.last_closes[i] if self.smooth_gaps else None
+
+        for fed in self._feeds[i]:
+            fed_start, fed_end = self.timeframes[fed].get_window_bounds(timestamp)
+            self._roll(state, fed, fed_start, fed_end, timestamp, prices, emitted)
+
+    def _to_ohlc(self, state: _SymbolState, i: int, prices: Prices) -> OHLC:
+        open_, high, low, close = prices
+        if state.opens[i] is not None:
+            open_ = state.opens[i]
+        return OHLC(time=state.starts[i], open=open_, high=high, low=low, close=close)
+
+    def _current_prices(self, state: _SymbolState) -> List[Prices | None]:
+        prices: List[Prices | None] = [None] * len(self.timeframes)
+        for i in self._order:
+            source = self._sources[i]
+            prices[i] = state.folded[i] if source is None else _fold(state.folded[i], prices[source])
+        return prices
+
+    def _prices_of(self, state: _SymbolState, i: int) -> Prices | None:
+        """The prices of timeframe i alone, folding in only its own chain of sources"""
+        source = self._sources[i]
+        return state.folded[i] if source is None else _fold(state.folded[i], self._prices_of(state, source))
+
+    def add_trades(self, trades: Iterable[Trade | TradeTick]) -> List[Tuple[str, TimeWindow, OHLC]]:
+        return [
+            (trade.symbol, timeframe, ohlc)
+            for trade in trades
+            for timeframe, ohlc in self.add_trade(trade)
+        ]
+
+    def get_current_state(self, symbol: str) -> Dict[TimeWindow, OHLC]:
+        state = self._states.get(symbol)
+        if state is None:
+            return {}
+        prices = self._current_prices(state)
+        return {
+            timeframe: self._to_ohlc(state, i, prices[i])
+            for i, timeframe in enumerate(self.timeframes)
+            if state.starts[i] != _EMPTY
+        }
+
+    def window_bounds(self, symbol: str) -> List[Tuple[int, int] | None]:
+        """Same as OHLCAggregator.window_bounds"""
+        state = self._states.get(symbol)
+        if state is None:
+            return []
+        return [None if start == _EMPTY else (start, end) for start, end in zip(state.starts, state.ends)]
+
+    def get_window(self, symbol: str, index: int) -> OHLC:
+        state = self._states[symbol]
+        return self._to_ohlc(state, index, self._prices_of(state, index))
+
+    def export_windows(self) -> Dict[str, List[WindowRow]]:
+        windows = {}
+        for symbol, state in self._states.items():
+            prices = self._current_prices(state)
+            rows = []
+            for i in range(len(self.timeframes)):
+                last_close = float('nan') if state.last_closes[i] is None else state.last_closes[i]
+                if state.starts[i] == _EMPTY:
+                    rows.append((-1, -1, 0.0, 0.0, 0.0, 0.0, last_close))
+                else:
+                    ohlc = self._to_ohlc(state, i, prices[i])
+                    rows.append((state.starts[i], state.ends[i], ohlc.open, ohlc.high, ohlc.low, ohlc.close, last_close))
+            windows[symbol] = rows
+        return windows
+
+    def import_windows(self, windows: Dict[str, List[WindowRow]]) -> None:
+        for symbol, rows in windows.items():
+            state = self._get_state(symbol)
+            for i, (start, end, open_, high, low, close, last_close) in enumerate(rows):
+                if start != -1:
+                    state.starts[i], state.ends[i] = start, end
+                    # Folding the source window in again later changes nothing: its
+                    # high and low are within these and its close is the same
+                    state.folded[i] = (open_, high, low, close)
+                    state.opens[i] = None
+                    state.last_trade = max(state.last_trade, start)
+                if not isnan(last_close):
+                    state.last_closes[i] = last_close
+            self._newest_trade = max(self._newest_trade, state.last_trade)
+
+    @property
+    def symbol_count(self) -> int:
+        return len(self._states)
+
+    def state_bytes(self) -> int:
+        """Estimated memory held by the window state"""
+        return len(self._states) * self._symbol_bytes
+
+    def evict_symbols(self, max_idle_s: float | None = None, max_bytes: int | None = None) -> List[str]:
+        """Same as OHLCAggregator.evict_symbols"""
+        return evict(self._states, self._newest_trade, self._symbol_bytes, max_idle_s, max_bytes)
+
+    def cleanup_old_windows(self, max_age: timedelta):
+        # Coarser windows are derived from finer ones, so only symbols whose
+        # windows are all stale are dropped, as a whole
+        cutoff = int(time.time() - max_age.total_seconds())
+        for symbol in [symbol for symbol, state in self._states.items() if max(state.starts) < cutoff]:
+            del self._states[symbol]
@@ -0,0 +1,163 @@
+import logging
+import os
+import struct
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from pulsar import MessageId
+
+from src.time_window import TimeUnit, TimeWindow
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# start, end, open, high, low, close, last emitted close (NaN if none); start -1 means empty
+WindowRow = Tuple[int, int, float, float, float, float, float]
+# Start of the last window the close timer emitted per symbol/timeframe
+ClosedWindows = Dict[Tuple[str, TimeWindow], int]
+
+_MAGIC = b'OHLC'
+_VERSION = 2
+# Version 1 snapshots have no closed windows section
+_READABLE_VERSIONS = (1, 2)
+_HEADER = struct.Struct('<4sHH')
+_TIMEFRAME = struct.Struct('<IB')
+_LENGTH = struct.Struct('<H')
+_COUNT = struct.Struct('<I')
+_ROW = struct.Struct('<qqddddd')
+_CLOSED = struct.Struct('<Hq')
+_UNITS = list(TimeUnit)
+
+
+def encode_snapshot(
+    message_id: MessageId,
+    timeframes: List[TimeWindow],
+    windows: Dict[str, List[WindowRow]],
+    closed: ClosedWindows | None = None
+) -> bytes:
+    message_id_bytes = message_id.serialize()
+    parts = [
+        _HEADER.pack(_MAGIC, _VERSION, len(timeframes)),
+        *(_TIMEFRAME.pack(timeframe.size, _UNITS.index(timeframe.unit)) for timeframe in timeframes),
+        _LENGTH.pack(len(message_id_bytes)),
+        message_id_bytes,
+        _COUNT.pack(len(windows)),
+    ]
+    for symbol, rows in windows.items():
+        symbol_bytes = symbol.encode('utf-8')
+        parts.append(_LENGTH.pack(len(symbol_bytes)))
+        parts.append(symbol_bytes)
+        parts.extend(_ROW.pack(*row) for row in rows)
+
+    closed = closed or {}
+    parts.append(_COUNT.pack(len(closed)))
+    for (symbol, timeframe), start in closed.items():
+        symbol_bytes = symbol.encode('utf-8')
+        parts.append(_LENGTH.pack(len(symbol_bytes)))
+        parts.append(symbol_bytes)
+        parts.append(_CLOSED.pack(timeframes.index(timeframe), start))
+    return b''.join(parts)
+
+
+def decode_snapshot(data: bytes, timeframes: List[TimeWindow]) -> Tuple[MessageId, Dict[str, List[WindowRow]], ClosedWindows]:
+    magic, version, timeframe_count = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or version not in _READABLE_VERSIONS:
+        raise ValueError(f"Unsupported snapshot format: {magic!r} v{version}")
+    offset = _HEADER.size
+
+    stored = []
+    for _ in range(timeframe_count):
+        size, unit = _TIMEFRAME.unpack_from(data, offset)
+        stored.append(TimeWindow(size, _UNITS[unit]))
+        offset += _TIMEFRAME.size
+    if stored != timeframes:
+        raise ValueError("Snapshot was taken with a different timeframe configuration")
+
+    (length,) = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    message_id = MessageId.deserialize(data[offset:offset + length])
+    offset += length
+
+    (symbol_count,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    windows = {}
+    for _ in range(symbol_count):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        symbol = data[offset:offset + length].decode('utf-8')
+        offset += length
+        rows = []
+        for _ in range(timeframe_count):
+            rows.append(_ROW.unpack_from(data, offset))
+            offset += _ROW.size
+        windows[symbol] = rows
+
+    closed = {}
+    if version >= 2:
+        (closed_count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        for _ in range(closed_count):
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            symbol = data[offset:offset + length].decode('utf-8')
+            offset += length
+            index, start = _CLOSED.unpack_from(data, offset)
+            offset += _CLOSED.size
+            closed[(symbol, timeframes[index])] = start
+
+    return message_id, windows, closed
+
+
+class Checkpointer:
+    """Periodically persists aggregator window state together with the last processed message ID.
+
+    Snapshots are written to a temporary file and renamed over the previous
+    one, so a crash mid-write never leaves a truncated snapshot behind.
+    """
+
+    def __init__(self, path: str, interval_s: float = 5.0):
+        self.path = path
+        self.interval_s = interval_s
+        self._last_saved = time.monotonic()
+
+    def is_due(self) -> bool:
+        return time.monotonic() - self._last_saved >= self.interval_s
+
+    def load(self, timeframes: List[TimeWindow]) -> Tuple[MessageId, Dict[str, List[WindowRow]], ClosedWindows] | None:
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            return decode_snapshot(data, timeframes)
+        except (ValueError, struct.error) as e:
+            logger.warning(f"Ignoring unusable snapshot {self.path}: {e}")
+            return None
+
+    def save(self, data: bytes) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        self._last_saved = time.monotonic()
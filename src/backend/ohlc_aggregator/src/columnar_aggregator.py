@@ -0,0 +1,334 @@
+from datetime import timedelta
+import sys
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from src.checkpoint import WindowRow
+from src.models import Trade, TradeTick, OHLC
+from src.time_window import FIXED_LAYOUT, UNIT_SECONDS, TimeUnit, TimeWindow
+from src.state_eviction import evict, state_size
+from src.utils import epoch_seconds
+
+_EMPTY = -1
+
+
+class _SymbolState:
+    __slots__ = ('starts', 'ends', 'opens', 'highs', 'lows', 'closes', 'last_closes', 'last_trade')
+
+    def __init__(self, size: int):
+        self.starts = np.full(size, _EMPTY, dtype=np.int64)
+        self.ends = np.full(size, _EMPTY, dtype=np.int64)
+        self.opens = np.zeros(size, dtype=np.float64)
+        self.highs = np.zeros(size, dtype=np.float64)
+        self.lows = np.zeros(size, dtype=np.float64)
+        self.closes = np.zeros(size, dtype=np.float64)
+        self.last_closes = np.full(size, np.nan, dtype=np.float64)
+        self.last_trade = 0
+
+
+class ColumnarOHLCAggregator:
+    """OHLC aggregator keeping per-symbol window state in NumPy arrays.
+
+    Every symbol owns one row per timeframe and window boundaries are computed
+    in integer epoch seconds for all timeframes at once. Emits the same candles
+    as OHLCAggregator and additionally accepts whole batches of trades.
+    """
+
+    def __init__(self, timeframes: List[TimeWindow], smooth_gaps: bool = False):
+        self.timeframes = timeframes
+        self.smooth_gaps = smooth_gaps
+        self._states: Dict[str, _SymbolState] = {}
+        self._newest_trade = 0
+        self._symbol_bytes = state_size(_SymbolState(len(timeframes)))
+
+        fixed, months, years = [], [], []
+        for index, timeframe in enumerate(timeframes):
+            if timeframe.unit in FIXED_LAYOUT:
+                period, step, offset = FIXED_LAYOUT[timeframe.unit](timeframe.size)
+                length = timeframe.size * UNIT_SECONDS[timeframe.unit]
+                fixed.append((index, period, step, offset, length))
+            elif timeframe.unit == TimeUnit.MONTH:
+                months.append((index, timeframe.size))
+            elif timeframe.unit == TimeUnit.YEAR:
+                years.append((index, timeframe.size))
+            else:
+                raise ValueError(f"Unknown time unit: {timeframe.unit}")
+
+        self._fixed_cols = np.array([c[0] for c in fixed], dtype=np.intp)
+        self._fixed_period = np.array([c[1] for c in fixed], dtype=np.int64)
+        self._fixed_step = np.array([c[2] for c in fixed], dtype=np.int64)
+        self._fixed_offset = np.array([c[3] for c in fixed], dtype=np.int64)
+        self._fixed_length = np.array([c[4] for c in fixed], dtype=np.int64)
+        self._month_cols = np.array([c[0] for c in months], dtype=np.intp)
+        self._month_sizes = np.array([c[1] for c in months], dtype=np.int64)
+        self._year_cols = np.array([c[0] for c in years], dtype=np.intp)
+        self._year_sizes = np.array([c[1] for c in years], dtype=np.int64)
+
+    def _boundaries(self, timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Window starts and ends (epoch seconds) shaped (trades, timeframes)"""
+        shape = (timestamps.shape[0], len(self.timeframes))
+        starts = np.empty(shape, dtype=np.int64)
+        ends = np.empty(shape, dtype=np.int64)
+        ts = timestamps[:, None]
+
+        if self._fixed_cols.size:
+            fixed_starts = ts - ((ts + self._fixed_offset) % self._fixed_period) % self._fixed_step
+            starts[:, self._fixed_cols] = fixed_starts
+            ends[:, self._fixed_cols] = fixed_starts + self._fixed_length
+
+        if self._month_cols.size or self._year_cols.size:
+            seconds = timestamps.astype('datetime64[s]')
+            if self._month_cols.size:
+                month = seconds.astype('datetime64[M]')[:, None]
+                starts[:, self._month_cols] = month.astype('datetime64[s]').astype(np.int64)
+                ends[:, self._month_cols] = (month + self._month_sizes).astype('datetime64[s]').astype(np.int64)
+            if self._year_cols.size:
+                year = seconds.astype('datetime64[Y]')[:, None]
+                starts[:, self._year_cols] = year.astype('datetime64[s]').astype(np.int64)
+                ends[:, self._year_cols] = (year + self._year_sizes).astype('datetime64[s]').astype(np.int64)
+
+        return starts, ends
+
+    def _get_state(self, symbol: str) -> _SymbolState:
+        state = self._states.get(symbol)
+        if state is None:
+            state = self._states[sys.intern(symbol)] = _SymbolState(len(self.timeframes))
+        return state
+
+    def _seen(self, state: _SymbolState, timestamp: int) -> None:
+        if timestamp > state.last_trade:
+            state.last_trade = timestamp
+            if timestamp > self._newest_trade:
+                self._newest_trade = timestamp
+
+    def _to_ohlc(self, start, open_, high, low, close) -> OHLC:
+        return OHLC.model_construct(
+            time=int(start),
+            open=float(open_),
+            high=float(high),
+            low=float(low),
+            close=float(close)
+        )
+
+    def add_trade(self, trade: Trade | TradeTick) -> List[Tuple[TimeWindow, OHLC]]:
+        timestamp = epoch_seconds(trade.timestamp)
+        price = trade.price
+        state = self._get_state(trade.symbol)
+        self._seen(state, timestamp)
+
+        starts, ends = self._boundaries(np.array([timestamp], dtype=np.int64))
+        starts, ends = starts[0], ends[0]
+
+        same = starts == state.starts
+        if same.all():
+            np.maximum(state.highs, price, out=state.highs)
+            np.minimum(state.lows, price, out=state.lows)
+            state.closes.fill(price)
+            return []
+
+        changed = ~same
+        closed = changed & (state.starts != _EMPTY) & (timestamp >= state.ends)
+
+        ohlc_list = [
+            (
+                self.timeframes[i],
+                self._to_ohlc(state.starts[i], state.opens[i], state.highs[i], state.lows[i], state.closes[i])
+            )
+            for i in np.flatnonzero(closed)
+        ]
+
+        state.last_closes[closed] = state.closes[closed]
+        state.highs[same] = np.maximum(state.highs[same], price)
+        state.lows[same] = np.minimum(state.lows[same], price)
+
+        state.starts[changed] = starts[changed]
+        state.ends[changed] = ends[changed]
+        if self.smooth_gaps:
+            last = state.last_closes[changed]
+            state.opens[changed] = np.where(np.isnan(last), price, last)
+        else:
+            state.opens[changed] = price
+        state.highs[changed] = price
+        state.lows[changed] = price
+        state.closes.fill(price)
+
+        return ohlc_list
+
+    def add_trades(self, trades: Iterable[Trade | TradeTick]) -> List[Tuple[str, TimeWindow, OHLC]]:
+        """Aggregate a batch of trades, returning every candle closed by it.
+
+        Candles are returned in the order the equivalent sequence of add_trade
+        calls would emit them.
+        """
+        by_symbol: Dict[str, Tuple[List[int], List[int], List[float]]] = {}
+        for position, trade in enumerate(trades):
+            indices, timestamps, prices = by_symbol.setdefault(trade.symbol, ([], [], []))
+            indices.append(position)
+            timestamps.append(epoch_seconds(trade.timestamp))
+            prices.append(trade.price)
+
+        emitted = []
+        for symbol, (indices, timestamps, prices) in by_symbol.items():
+            positions = np.array(indices, dtype=np.int64)
+            for row, col, ohlc in self._add_symbol_batch(
+                symbol,
+                np.array(timestamps, dtype=np.int64),
+                np.array(prices, dtype=np.float64)
+            ):
+                emitted.append((positions[row], col, symbol, ohlc))
+
+        emitted.sort(key=lambda item: (item[0], item[1]))
+        return [(symbol, self.timeframes[col], ohlc) for _, col, symbol, ohlc in emitted]
+
+    def _add_symbol_batch(self, symbol: str, timestamps: np.ndarray, prices: np.ndarray) -> List[Tuple[int, int, OHLC]]:
+        state = self._get_state(symbol)
+        self._seen(state, int(timestamps.max()))
+        n, width = timestamps.shape[0], len(self.timeframes)
+        starts, ends = self._boundaries(timestamps)
+        starts, ends = starts.T, ends.T
+
+        # Consecutive runs of equal window starts form a segment; segments
+        # never cross timeframe columns.
+        new_segment = np.ones((width, n), dtype=bool)
+        new_segment[:, 1:] = starts[:, 1:] != starts[:, :-1]
+        seg_idx = np.flatnonzero(new_segment.ravel())
+        seg_col = seg_idx // n
+        seg_row = seg_idx % n
+        seg_last = np.append(seg_idx[1:], width * n) - 1
+
+        flat_prices = np.tile(prices, width)
+        seg_start = starts.ravel()[seg_idx]
+        seg_end = ends.ravel()[seg_idx]
+        seg_open = flat_prices[seg_idx]
+        seg_high = np.maximum.reduceat(flat_prices, seg_idx)
+        seg_low = np.minimum.reduceat(flat_prices, seg_idx)
+        seg_close = flat_prices[seg_last]
+
+        first = seg_row == 0
+        first_cols = seg_col[first]
+        merged = np.zeros(seg_idx.shape[0], dtype=bool)
+        merged[first] = seg_start[first] == state.starts[first_cols]
+
+        # Segment k closes the window before it when its first trade passes
+        # that window's end; the first segment of a column closes the window
+        # carried over in the symbol state.
+        closes_prev = np.zeros(seg_idx.shape[0], dtype=bool)
+        inner = np.flatnonzero(~first)
+        closes_prev[inner] = timestamps[seg_row[inner]] >= seg_end[inner - 1]
+        fresh = first & ~merged
+        closes_prev[fresh] = (state.starts[seg_col[fresh]] != _EMPTY) & (timestamps[0] >= state.ends[seg_col[fresh]])
+
+        if self.smooth_gaps:
+            last_close = np.full(seg_idx.shape[0], np.nan)
+            last_close[inner] = np.where(closes_prev[inner], seg_close[inner - 1], np.nan)
+            last_close[first] = np.where(closes_prev[first], state.closes[first_cols], state.last_closes[first_cols])
+            source = np.where(first | ~np.isnan(last_close), np.arange(seg_idx.shape[0]), 0)
+            last_close = last_close[np.maximum.accumulate(source)]
+            seg_open = np.where(np.isnan(last_close), seg_open, last_close)
+
+        merged_cols = seg_col[merged]
+        seg_open[merged] = state.opens[merged_cols]
+        seg_high[merged] = np.maximum(seg_high[merged], state.highs[merged_cols])
+        seg_low[merged] = np.minimum(seg_low[merged], state.lows[merged_cols])
+
+        emitted = []
+        for k in np.flatnonzero(closes_prev):
+            col = seg_col[k]
+            if first[k]:
+                ohlc = self._to_ohlc(
+                    state.starts[col], state.opens[col], state.highs[col], state.lows[col], state.closes[col]
+                )
+            else:
+                ohlc = self._to_ohlc(seg_start[k - 1], seg_open[k - 1], seg_high[k - 1], seg_low[k - 1], seg_close[k - 1])
+            emitted.append((int(seg_row[k]), int(col), ohlc))
+
+        tail = np.append(np.flatnonzero(first)[1:], seg_idx.shape[0]) - 1
+        tail_cols = seg_col[tail]
+        if self.smooth_gaps:
+            state.last_closes[tail_cols] = last_close[tail]
+        state.starts[tail_cols] = seg_start[tail]
+        state.ends[tail_cols] = seg_end[tail]
+        state.opens[tail_cols] = seg_open[tail]
+        state.highs[tail_cols] = seg_high[tail]
+        state.lows[tail_cols] = seg_low[tail]
+        state.closes[tail_cols] = seg_close[tail]
+
+        return emitted
+
+    def get_current_state(self, symbol: str) -> Dict[TimeWindow, OHLC]:
+        state = self._states.get(symbol)
+        if state is None:
+            return {}
+        return {
+            self.timeframes[i]: self._to_ohlc(
+                state.starts[i], state.opens[i], state.highs[i], state.lows[i], state.closes[i]
+            )
+            for i in np.flatnonzero(state.starts != _EMPTY)
+        }
+
+    def window_bounds(self, symbol: str) -> List[Tuple[int, int] | None]:
+        """Same as OHLCAggregator.window_bounds"""
+        state = self._states.get(symbol)
+        if state is None:
+            return []
+        return [
+            None if start == _EMPTY else (start, end)
+            for start, end in zip(state.starts.tolist(), state.ends.tolist())
+        ]
+
+    def get_window(self, symbol: str, index: int) -> OHLC:
+        state = self._states[symbol]
+        return self._to_ohlc(state.starts[index], state.opens[index], state.highs[index], state.lows[index], state.closes[index])
+
+    def export_windows(self) -> Dict[str, List[WindowRow]]:
+        return {
+            symbol: list(zip(
+                state.starts.tolist(),
+                state.ends.tolist(),
+                state.opens.tolist(),
+                state.highs.tolist(),
+                state.lows.tolist(),
+                state.closes.tolist(),
+                state.last_closes.tolist()
+            ))
+            for symbol, state in self._states.items()
+        }
+
+    def import_windows(self, windows: Dict[str, List[WindowRow]]) -> None:
+        for symbol, rows in windows.items():
+            state = self._get_state(symbol)
+            columns = np.array(rows, dtype=np.float64).T
+            state.starts[:] = [row[0] for row in rows]
+            state.ends[:] = [row[1] for row in rows]
+            state.opens[:] = columns[2]
+            state.highs[:] = columns[3]
+            state.lows[:] = columns[4]
+            state.closes[:] = columns[5]
+            state.last_closes[:] = columns[6]
+            # The shortest window started last, good enough as the last trade time
+            state.last_trade = max(state.last_trade, int(state.starts.max()))
+            self._newest_trade = max(self._newest_trade, state.last_trade)
+
+    @property
+    def symbol_count(self) -> int:
+        return len(self._states)
+
+    def state_bytes(self) -> int:
+        """Estimated memory held by the window state"""
+        return len(self._states) * self._symbol_bytes
+
+    def evict_symbols(self, max_idle_s: float | None = None, max_bytes: int | None = None) -> List[str]:
+        """Same as OHLCAggregator.evict_symbols"""
+        return evict(self._states, self._newest_trade, self._symbol_bytes, max_idle_s, max_bytes)
+
+    def cleanup_old_windows(self, max_age: timedelta):
+        cutoff = int(time.time() - max_age.total_seconds())
+        for symbol in list(self._states.keys()):
+            state = self._states[symbol]
+            stale = (state.starts != _EMPTY) & (state.starts < cutoff)
+            state.starts[stale] = _EMPTY
+            state.ends[stale] = _EMPTY
+            if (state.starts == _EMPTY).all():
+                del self._states[symbol]
@@ -1,3 +1,5 @@
+from typing import Dict, Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -12,5 +14,59 @@ class Settings(BaseSettings):
     clickhouse_password: str
     clickhouse_db: str = "ohlc_db"
     log_level: str = "INFO"
+    # columnar is only accepted with batch_receive_enabled
+    aggregator_engine: Literal["python", "columnar", "cascading"] = "python"
+    trade_decoder: Literal["pydantic", "lean"] = "pydantic"
+    shard_count: int = 1
+    shard_report_interval_s: float = 10.0
+    checkpoint_path: str | None = None
+    checkpoint_interval_s: float = 5.0
+    batch_receive_enabled: bool = False
+    batch_max_messages: int = 1000
+    batch_max_latency_ms: int = 50
+    batch_ack_mode: Literal["cumulative", "individual"] = "cumulative"
+    clickhouse_buffer_enabled: bool = True
+    clickhouse_flush_max_rows: int = 10_000
+    clickhouse_flush_max_bytes: int = 4 * 1024 * 1024
+    clickhouse_flush_interval_ms: int = 1000
+    clickhouse_buffer_capacity: int = 100_000
+    producer_batching_enabled: bool = True
+    producer_batching_max_messages: int = 1000
+    producer_batching_max_publish_delay_ms: int = 10
+    producer_compression_type: Literal["NONE", "LZ4", "ZLib", "ZSTD", "SNAPPY"] = "LZ4"
+    producer_max_in_flight: int = 1000
+    # Websocket sends of a message's candles not handed to the producer within this are dropped,
+    # 0 waits indefinitely. ClickHouse is deliberately left unbounded: once its write buffer is
+    # full (clickhouse_buffer_capacity) a slow ClickHouse blocks the message loop rather than
+    # losing candles from the store the chart's history is read from
+    publish_timeout_ms: int = 5000
+    output_topic_mode: Literal["single", "symbol", "timeframe"] = "single"
+    forming_candles_enabled: bool = False
+    forming_candles_interval_ms: int = 250
+    # Emit candles when their window ends rather than on the symbol's next trade
+    window_close_timer_enabled: bool = False
+    window_allowed_lateness_ms: int = 2000
+    # Symbols without trades for this long lose their window state, 0 keeps them
+    symbol_idle_eviction_s: float = 86400.0
+    # Least recently traded symbols are evicted above this estimated state size, 0 for no cap
+    aggregator_max_state_mb: int = 1024
+    metrics_enabled: bool = True
+    metrics_port: int = 9100
+    # Days kept per rollup tier, 0 keeps it forever (1s only expires the 1-second rows of ohlc_table).
+    # Applied as table TTLs at every start, which the chart reads back to pick its tier; lowering
+    # one deletes the existing history past it
+    retention_1s_days: int = 7
+    retention_1m_days: int = 90
+    retention_1h_days: int = 1825
+    retention_1d_days: int = 0
+
+    @property
+    def retention_days(self) -> Dict[str, int]:
+        return {
+            '1s': self.retention_1s_days,
+            '1m': self.retention_1m_days,
+            '1h': self.retention_1h_days,
+            '1d': self.retention_1d_days,
+        }
 
     model_config = SettingsConfigDict(env_file=".env.ohlc_aggregator")
@@ -0,0 +1,21 @@
+from typing import Callable, Dict
+
+import msgspec
+
+from src.models import Trade, TradeTick
+
+_trade_tick_decoder = msgspec.json.Decoder(TradeTick)
+
+
+def decode_trade(data: bytes) -> Trade:
+    return Trade.model_validate_json(data)
+
+
+def decode_trade_tick(data: bytes) -> TradeTick:
+    return _trade_tick_decoder.decode(data)
+
+
+TRADE_DECODERS: Dict[str, Callable[[bytes], Trade | TradeTick]] = {
+    'pydantic': decode_trade,
+    'lean': decode_trade_tick,
+}
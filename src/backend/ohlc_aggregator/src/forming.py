@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, Set, Tuple
+
+from src.aggregator import OHLCAggregator
+from src.models import OHLC
+from src.publishers import WebsocketPublisher
+from src.time_window import TimeWindow
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class FormingCandleStream:
+    """Publishes the in-progress candles of recently traded symbols as partial updates.
+
+    Symbols are marked dirty as their trades are processed and flushed every
+    interval_ms, so each symbol/timeframe gets at most one update per interval
+    and only when its candle actually changed.
+    """
+
+    def __init__(self, aggregator: OHLCAggregator, publisher: WebsocketPublisher, interval_ms: int = 250):
+        self.aggregator = aggregator
+        self.publisher = publisher
+        self.interval_ms = interval_ms
+        self._dirty: Set[str] = set()
+        self._published: Dict[Tuple[str, TimeWindow], OHLC] = {}
+        self._task: asyncio.Task | None = None
+
+    def touch(self, symbols: Iterable[str]) -> None:
+        self._dirty.update(symbols)
+
+    def forget(self, symbols: Iterable[str]) -> None:
+        symbols = set(symbols)
+        self._dirty -= symbols
+        for key in [key for key in self._published if key[0] in symbols]:
+            del self._published[key]
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def flush(self) -> None:
+        symbols, self._dirty = self._dirty, set()
+        for symbol in symbols:
+            for timeframe, ohlc in self.aggregator.get_current_state(symbol).items():
+                if self._published.get((symbol, timeframe)) == ohlc:
+                    continue
+                self._published[(symbol, timeframe)] = ohlc
+                await self.publisher.publish(symbol, timeframe, ohlc, partial=True)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_ms / 1000)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error publishing forming candles: {e}", exc_info=True)
@@ -1,12 +1,17 @@
 import asyncio
 import logging
+from multiprocessing.sharedctypes import SynchronizedArray
 from signal import SIGTERM, SIGINT
+import sys
 
 from clickhouse_connect import get_async_client
-from pulsar import ConsumerType, Client
+from pulsar import CompressionType, ConsumerType, Client
 
+from src.checkpoint import Checkpointer
+from src.metrics import Gauge, start_metrics_server
 from src.setup import create_table_if_not_exists
 from src.service import OHLCMessageService
+from src.sharding import run_sharded, shard_key_shared_policy
 from src.config import Settings
 
 logging.basicConfig(
@@ -18,16 +23,49 @@ logger = logging.getLogger(__name__)
 settings = Settings()
 
 
-async def main():
-    pulsar_client = Client(settings.pulsar_service_url)
-    clickhouse_client = await get_async_client(
+async def create_clickhouse_client():
+    return await get_async_client(
         host=settings.clickhouse_host,
         port=settings.clickhouse_port,
         username=settings.clickhouse_username,
         password=settings.clickhouse_password,
         database=settings.clickhouse_db,
     )
-    await create_table_if_not_exists(clickhouse_client)
+
+
+async def setup_tables():
+    clickhouse_client = await create_clickhouse_client()
+    try:
+        await create_table_if_not_exists(clickhouse_client, settings.retention_days)
+    finally:
+        await asyncio.to_thread(clickhouse_client.close)
+
+
+async def report_processed(service: OHLCMessageService, counters: SynchronizedArray, shard: int):
+    while True:
+        counters[shard] = service.processed_messages
+        await asyncio.sleep(1)
+
+
+async def main(shard: int | None = None, counters: SynchronizedArray | None = None):
+    pulsar_client = Client(settings.pulsar_service_url)
+    clickhouse_client = await create_clickhouse_client()
+
+    checkpointer = None
+    if shard is None:
+        await create_table_if_not_exists(clickhouse_client, settings.retention_days)
+        consumer_type, key_shared_policy = ConsumerType.Failover, None
+        batch_ack_mode = settings.batch_ack_mode
+        if settings.checkpoint_path:
+            checkpointer = Checkpointer(settings.checkpoint_path, settings.checkpoint_interval_s)
+    else:
+        if settings.checkpoint_path:
+            # Seeking a Key_Shared subscription would rewind every shard
+            logger.warning("Checkpointing is not supported in sharded mode, ignoring CHECKPOINT_PATH")
+        consumer_type = ConsumerType.KeyShared
+        key_shared_policy = shard_key_shared_policy(shard, settings.shard_count)
+        # Key_Shared subscriptions do not support cumulative acknowledgement
+        batch_ack_mode = 'individual'
 
     try:
         async with OHLCMessageService(
@@ -36,13 +74,68 @@ async def main():
             settings.input_topic,
             settings.output_topic,
             settings.subscription_name,
-            ConsumerType.Failover
-        ):
+            consumer_type,
+            key_shared_policy=key_shared_policy,
+            aggregator_engine=settings.aggregator_engine,
+            trade_decoder=settings.trade_decoder,
+            batch_receive_enabled=settings.batch_receive_enabled,
+            batch_max_messages=settings.batch_max_messages,
+            batch_max_latency_ms=settings.batch_max_latency_ms,
+            batch_ack_mode=batch_ack_mode,
+            write_buffer_options={
+                'max_rows': settings.clickhouse_flush_max_rows,
+                'max_bytes': settings.clickhouse_flush_max_bytes,
+                'max_age_ms': settings.clickhouse_flush_interval_ms,
+                'capacity_rows': settings.clickhouse_buffer_capacity,
+            } if settings.clickhouse_buffer_enabled else None,
+            producer_options={
+                'batching_enabled': settings.producer_batching_enabled,
+                'batching_max_messages': settings.producer_batching_max_messages,
+                'batching_max_publish_delay_ms': settings.producer_batching_max_publish_delay_ms,
+                'compression_type': getattr(CompressionType, settings.producer_compression_type),
+            },
+            producer_max_in_flight=settings.producer_max_in_flight,
+            publish_timeout_s=settings.publish_timeout_ms / 1000 or None,
+            output_topic_mode=settings.output_topic_mode,
+            forming_candle_interval_ms=settings.forming_candles_interval_ms if settings.forming_candles_enabled else None,
+            window_allowed_lateness_ms=settings.window_allowed_lateness_ms if settings.window_close_timer_enabled else None,
+            max_symbol_idle_s=settings.symbol_idle_eviction_s or None,
+            max_state_bytes=settings.aggregator_max_state_mb * 1024 * 1024 or None,
+            checkpointer=checkpointer
+        ) as service:
             shutdown_event = asyncio.Event()
             loop = asyncio.get_running_loop()
             for sig in (SIGTERM, SIGINT):
                 loop.add_signal_handler(sig, shutdown_event.set)
+
+            reporter = None
+            if counters is not None:
+                reporter = asyncio.create_task(report_processed(service, counters, shard))
+
+            stop_metrics_server = None
+            if settings.metrics_enabled:
+                if service.write_buffer is not None:
+                    Gauge(
+                        'ohlc_aggregator_clickhouse_buffered_rows',
+                        'Candle rows waiting to be written to ClickHouse'
+                    ).set_function(lambda: service.write_buffer.metrics.buffered_rows)
+                aggregator = service.processor.aggregator
+                Gauge(
+                    'ohlc_aggregator_state_symbols',
+                    'Symbols with window state'
+                ).set_function(lambda: aggregator.symbol_count)
+                Gauge(
+                    'ohlc_aggregator_state_bytes',
+                    'Estimated memory held by the window state'
+                ).set_function(aggregator.state_bytes)
+                # Every shard process serves its own metrics
+                stop_metrics_server = start_metrics_server(settings.metrics_port + (shard or 0))
+
             await shutdown_event.wait()
+            if reporter is not None:
+                reporter.cancel()
+            if stop_metrics_server is not None:
+                stop_metrics_server()
     finally:
         await asyncio.to_thread(pulsar_client.close)
         logger.info("Pulsar client closed")
@@ -50,5 +143,12 @@ async def main():
         logger.info("Clickhouse client closed")
 
 
+def run_shard(shard: int, counters: SynchronizedArray):
+    asyncio.run(main(shard, counters))
+
+
 if __name__ == "__main__":
+    if settings.shard_count > 1:
+        asyncio.run(setup_tables())
+        sys.exit(run_sharded(settings.shard_count, run_shard, settings.shard_report_interval_s))
     asyncio.run(main())
@@ -0,0 +1,74 @@
+"""Prometheus metrics of the service, served by prometheus_client.
+
+Labelled series used on the per-message path are resolved once up front,
+so updating one is a single locked addition. Callback gauges are only
+evaluated when the endpoint is scraped, from its own thread.
+"""
+import logging
+from typing import Callable
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def start_metrics_server(port: int, host: str = '0.0.0.0') -> Callable[[], None]:
+    """Serve the default registry at :port/metrics from a background thread, returns its shutdown function"""
+    server, _ = start_http_server(port, host)
+    logger.info(f"Serving metrics on :{port}/metrics")
+    return server.shutdown
+
+
+class LogSampler:
+    """Lets every n-th occurrence of a hot-path log message through"""
+
+    def __init__(self, every: int = 1000):
+        self.every = every
+        self.count = 0
+
+    def __call__(self) -> bool:
+        self.count += 1
+        return self.count % self.every == 1 or self.every == 1
+
+
+MESSAGES_RECEIVED = Counter(
+    'ohlc_aggregator_messages_received_total', 'Trade messages received from Pulsar')
+MESSAGES_FAILED = Counter(
+    'ohlc_aggregator_messages_failed_total', 'Trade messages negatively acknowledged')
+RECEIVE_TO_ACK = Histogram(
+    'ohlc_aggregator_receive_to_ack_seconds', 'Time from receiving a message (or batch) to acknowledging it', buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram(
+    'ohlc_aggregator_stage_seconds', 'Processing time per message (or batch) by stage', ['stage'], buckets=LATENCY_BUCKETS)
+CANDLES_EMITTED = Counter(
+    'ohlc_aggregator_candles_emitted_total', 'Closed candles emitted', ['timeframe'])
+TRADE_TO_PUBLISH = Histogram(
+    'ohlc_aggregator_trade_to_publish_seconds', 'Time from trade timestamp to publishing the candles it closed', buckets=LAG_BUCKETS)
+CONSUMER_LAG = Gauge(
+    'ohlc_aggregator_consumer_lag_seconds', 'Age of the last received message at receive time')
+CONSUMER_BACKLOG = Gauge(
+    'ohlc_aggregator_consumer_backlog_messages', 'Messages published after the last processed one (NaN if unknown)')
+PUBLISH_TIMEOUTS = Counter(
+    'ohlc_aggregator_publish_timeouts_total', 'Candle batches dropped by a lossy sink after the publish timeout', ['sink'])
+CLICKHOUSE_FLUSH_SECONDS = Histogram(
+    'ohlc_aggregator_clickhouse_flush_seconds', 'Duration of each successful ClickHouse insert, its count is the number of flushes', buckets=LATENCY_BUCKETS)
+CLICKHOUSE_ROWS_WRITTEN = Counter(
+    'ohlc_aggregator_clickhouse_rows_written_total', 'Candle rows inserted into ClickHouse')
+CLICKHOUSE_FLUSHES_FAILED = Counter(
+    'ohlc_aggregator_clickhouse_flushes_failed_total', 'ClickHouse inserts that failed and were retried or split')
+CLICKHOUSE_ROWS_DROPPED = Counter(
+    'ohlc_aggregator_clickhouse_rows_dropped_total', 'Candle rows ClickHouse kept rejecting, dropped from the write buffer')
+CLICKHOUSE_BACKPRESSURE_WAITS = Counter(
+    'ohlc_aggregator_clickhouse_backpressure_waits_total', 'Writes that waited for the full ClickHouse write buffer')
+SYMBOLS_EVICTED = Counter(
+    'ohlc_aggregator_symbols_evicted_total', 'Symbols whose window state was evicted as idle or over the memory cap')
+
+STAGE_DECODE = STAGE_SECONDS.labels('decode')
+STAGE_AGGREGATE = STAGE_SECONDS.labels('aggregate')
+STAGE_PUBLISH = STAGE_SECONDS.labels('publish')
@@ -0,0 +1,159 @@
+"""Versioned ClickHouse schema migrations, applied in order at startup.
+
+Applied versions are recorded in ohlc_db.schema_migrations. Every migration
+checks the state it leaves behind before changing anything, so one that
+failed halfway is safe to run again.
+"""
+import logging
+from typing import Awaitable, Callable, List, NamedTuple
+
+from src.rollups import create_rollups
+from src.timeframes import TIMEFRAME_CONFIG
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+DATABASE = 'ohlc_db'
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[..., Awaitable[None]]
+
+
+async def _column_type(client, table: str, column: str) -> str | None:
+    result = await client.query(
+        'SELECT type FROM system.columns WHERE database = {database:String} AND table = {table:String} AND name = {column:String}',
+        parameters={'database': DATABASE, 'table': table, 'column': column}
+    )
+    return result.result_rows[0][0] if result.result_rows else None
+
+
+async def _row_count(client, table: str) -> int:
+    result = await client.query(f'SELECT count() FROM {DATABASE}.{table}')
+    return result.result_rows[0][0]
+
+
+async def _create_ohlc_table(client) -> None:
+    await client.command(
+        """
+        CREATE TABLE IF NOT EXISTS ohlc_db.ohlc_table
+        (
+            symbol String,
+            timeframe_size UInt32,
+            timeframe_unit String,
+            time UInt64,
+            open Float64,
+            high Float64,
+            low Float64,
+            close Float64
+        )
+        ENGINE = MergeTree()
+        ORDER BY (symbol, time);
+        """
+    )
+
+
+async def _optimize_ohlc_table(client) -> None:
+    """Rebuild ohlc_table for the chart queries.
+
+    The sort key leads with what the chart filters on, so a query reads one
+    symbol/timeframe instead of every timeframe of the symbol. Replays and
+    duplicate inserts of a candle collapse into the last one written.
+    """
+    time_type = await _column_type(client, 'ohlc_table', 'time')
+    if time_type == 'DateTime':
+        return
+
+    await client.command(
+        """
+        CREATE TABLE IF NOT EXISTS ohlc_db.ohlc_table_v2
+        (
+            symbol LowCardinality(String),
+            timeframe_size UInt32,
+            timeframe_unit LowCardinality(String),
+            time DateTime CODEC(DoubleDelta, ZSTD(1)),
+            open Float64,
+            high Float64,
+            low Float64,
+            close Float64
+        )
+        ENGINE = ReplacingMergeTree()
+        PARTITION BY toYYYYMM(time)
+        ORDER BY (symbol, timeframe_unit, timeframe_size, time);
+        """
+    )
+
+    # The rollup views read the old time column
+    for timeframe in TIMEFRAME_CONFIG:
+        await client.command(f"DROP VIEW IF EXISTS ohlc_db.ohlc_{timeframe.size}{timeframe.unit.value}_mv")
+
+    # Missing if a previous attempt failed right after dropping it
+    if time_type is None or not await _row_count(client, 'ohlc_table'):
+        # Nothing to keep, e.g. a fresh install, so no ohlc_table_v1 is left behind
+        await client.command("DROP TABLE IF EXISTS ohlc_db.ohlc_table")
+        await client.command("RENAME TABLE ohlc_db.ohlc_table_v2 TO ohlc_db.ohlc_table")
+        logger.info("Created ohlc_table with the optimized schema")
+        return
+
+    # Copying again after a failed attempt is harmless, the duplicates collapse
+    await client.command(
+        """
+        INSERT INTO ohlc_db.ohlc_table_v2
+        SELECT symbol, timeframe_size, timeframe_unit, toDateTime(time), open, high, low, close
+        FROM ohlc_db.ohlc_table
+        """
+    )
+    # The old table is kept as ohlc_table_v1 until dropped by hand
+    await client.command(
+        "RENAME TABLE ohlc_db.ohlc_table TO ohlc_db.ohlc_table_v1, ohlc_db.ohlc_table_v2 TO ohlc_db.ohlc_table"
+    )
+    logger.info("Moved ohlc_table to the optimized schema, the previous table is kept as ohlc_table_v1")
+
+
+async def _cascade_rollups(client) -> None:
+    """Replace the per-timeframe rollup tables, each fed by its own view on ohlc_table, with cascading tiers"""
+    for timeframe in TIMEFRAME_CONFIG:
+        name = f"ohlc_{timeframe.size}{timeframe.unit.value}"
+        await client.command(f"DROP VIEW IF EXISTS ohlc_db.{name}_mv")
+        await client.command(f"DROP TABLE IF EXISTS ohlc_db.{name}")
+    await create_rollups(client)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'create ohlc_table', _create_ohlc_table),
+    Migration(2, 'optimize ohlc_table schema', _optimize_ohlc_table),
+    Migration(3, 'cascading rollup tiers', _cascade_rollups),
+]
+
+
+async def run_migrations(client, migrations: List[Migration] = MIGRATIONS) -> None:
+    await client.command(
+        """
+        CREATE TABLE IF NOT EXISTS ohlc_db.schema_migrations
+        (
+            version UInt32,
+            name String,
+            applied_at DateTime DEFAULT now()
+        )
+        ENGINE = ReplacingMergeTree()
+        ORDER BY version;
+        """
+    )
+    result = await client.query('SELECT version FROM ohlc_db.schema_migrations')
+    applied = {row[0] for row in result.result_rows}
+
+    for migration in migrations:
+        if migration.version in applied:
+            continue
+        logger.info(f"Applying schema migration {migration.version}: {migration.name}")
+        await migration.apply(client)
+        await client.insert(
+            'ohlc_db.schema_migrations',
+            [[migration.version, migration.name]],
+            column_names=['version', 'name']
+        )
@@ -2,6 +2,7 @@ from datetime import datetime, timezone
 from typing import Annotated
 from uuid import UUID
 
+import msgspec
 from pydantic import BaseModel, BeforeValidator, Field
 
 # from src.utils import timestamp_to_datetime
@@ -21,8 +22,15 @@ class Trade(BaseModel):
     side: str
 
 
+class TradeTick(msgspec.Struct):
+    """Lean trade carrying only what the aggregator needs, timestamp in UTC ms"""
+    symbol: str
+    price: Annotated[float, msgspec.Meta(gt=0)]
+    timestamp: int
+
+
 class OHLC(BaseModel):
-    time: Annotated[int, BeforeValidator(lambda v: int(v.timestamp()))]
+    time: Annotated[int, BeforeValidator(lambda v: v if isinstance(v, int) else int(v.timestamp()))]
     open: float
     high: float
     low: float
@@ -1,37 +1,159 @@
 import asyncio
 import logging
-from typing import Any, List
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple
 
 from pulsar import Message
 
-from src.models import Trade
+from src.models import OHLC, Trade, TradeTick
 from src.aggregator import OHLCAggregator
+from src.decoding import decode_trade
+from src.forming import FormingCandleStream
+from src.metrics import (
+    CANDLES_EMITTED, PUBLISH_TIMEOUTS, STAGE_AGGREGATE, STAGE_DECODE, STAGE_PUBLISH, TRADE_TO_PUBLISH,
+    LogSampler
+)
+from src.time_window import TimeWindow
+from src.utils import epoch_millis, epoch_seconds
+from src.window_closer import WindowCloser
 
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+
+# Candles of one symbol, in the order they are published
+CandleGroup = Tuple[str, List[Tuple[TimeWindow, OHLC]]]
 
 
 class OHLCMessageProcessor:
-    def __init__(self, aggregator: OHLCAggregator, publishers: List[Any]):
+    def __init__(
+        self,
+        aggregator: OHLCAggregator,
+        publishers: List[Any],
+        decode: Callable[[bytes], Trade | TradeTick] = decode_trade,
+        forming_stream: FormingCandleStream | None = None,
+        window_closer: WindowCloser | None = None,
+        publish_timeout_s: float | None = None
+    ):
         self.aggregator = aggregator
         self.publishers = publishers
+        self.decode = decode
+        self.forming_stream = forming_stream
+        self.window_closer = window_closer
+        self.publish_timeout_s = publish_timeout_s
+        # Per timeframe series of CANDLES_EMITTED, resolved on first use
+        self._timeframe_counters: Dict[TimeWindow, Any] = {}
+        self._error_log_sampler = LogSampler()
+        self._timeout_log_sampler = LogSampler()
 
     async def process_message(self, message: Message) -> None:
         try:
-            trade = Trade.model_validate_json(message.data())
+            started = time.perf_counter()
+            trade = self.decode(message.data())
+            decoded = time.perf_counter()
             ohlc_data = self.aggregator.add_trade(trade)
+            aggregated = time.perf_counter()
+            if self.forming_stream is not None:
+                self.forming_stream.touch((trade.symbol,))
+            if self.window_closer is not None:
+                self.window_closer.touch(trade.symbol, epoch_seconds(trade.timestamp))
+                ohlc_data = [
+                    (timeframe, ohlc) for timeframe, ohlc in ohlc_data
+                    if not self.window_closer.already_closed(trade.symbol, timeframe, ohlc)
+                ]
 
-            for timeframe, ohlc in ohlc_data:
-                await asyncio.gather(
-                    *(
-                        publisher.publish(trade.symbol, timeframe, ohlc)
-                        for publisher in self.publishers
-                    )
-                )
+            if ohlc_data:
+                event_time_ms = epoch_millis(trade.timestamp)
+                await self.publish_groups([(trade.symbol, ohlc_data)], event_time_ms)
+                TRADE_TO_PUBLISH.observe(time.time() - event_time_ms / 1000)
+
+            STAGE_DECODE.observe(decoded - started)
+            STAGE_AGGREGATE.observe(aggregated - decoded)
+            STAGE_PUBLISH.observe(time.perf_counter() - aggregated)
+        except Exception as e:
+            if self._error_log_sampler():
+                logger.exception(f"Error processing message ({self._error_log_sampler.count} errors so far): {e}")
+            raise
+
+    async def process_messages(self, messages: List[Message]) -> None:
+        try:
+            started = time.perf_counter()
+            trades = [self.decode(message.data()) for message in messages]
+            decoded = time.perf_counter()
+            ohlc_data = self.aggregator.add_trades(trades)
+            aggregated = time.perf_counter()
+            if self.forming_stream is not None:
+                self.forming_stream.touch(trade.symbol for trade in trades)
+            if self.window_closer is not None:
+                for trade in trades:
+                    self.window_closer.touch(trade.symbol, epoch_seconds(trade.timestamp))
+                ohlc_data = [
+                    (symbol, timeframe, ohlc) for symbol, timeframe, ohlc in ohlc_data
+                    if not self.window_closer.already_closed(symbol, timeframe, ohlc)
+                ]
+
+            if ohlc_data:
+                # Candles are not tied to their closing trade here, the newest
+                # trade of the batch gives a lower bound of their lag
+                event_time_ms = epoch_millis(trades[-1].timestamp)
+                groups: Dict[str, List[Tuple[TimeWindow, OHLC]]] = {}
+                for symbol, timeframe, ohlc in ohlc_data:
+                    groups.setdefault(symbol, []).append((timeframe, ohlc))
+                await self.publish_groups(list(groups.items()), event_time_ms)
+                TRADE_TO_PUBLISH.observe(time.time() - event_time_ms / 1000)
+
+            STAGE_DECODE.observe(decoded - started)
+            STAGE_AGGREGATE.observe(aggregated - decoded)
+            STAGE_PUBLISH.observe(time.perf_counter() - aggregated)
         except Exception as e:
-            logger.exception(f"Error processing message: {e}")
+            if self._error_log_sampler():
+                logger.exception(f"Error processing batch of {len(messages)} messages ({self._error_log_sampler.count} errors so far): {e}")
             raise
+
+    async def publish_candles(self, symbol: str, candles: List[Tuple[TimeWindow, OHLC]], event_time_ms: int) -> None:
+        await self.publish_groups([(symbol, candles)], event_time_ms)
+
+    async def publish_groups(self, groups: Sequence[CandleGroup], event_time_ms: int) -> None:
+        """Publish candles to every sink at once.
+
+        Only lossy sinks (the Websocket topic, whose candles the chart can
+        reload from ClickHouse) are given up on after publish_timeout_s; their
+        timeouts are counted in PUBLISH_TIMEOUTS. ClickHouse is deliberately
+        unbounded: its write buffer retries, and once full it blocks this loop
+        (counted in CLICKHOUSE_BACKPRESSURE_WAITS) rather than dropping
+        candles. Any error propagates so the message is not acknowledged or
+        checkpointed. Each sink serializes the candles in its own format,
+        column rows for ClickHouse and JSON for the topic.
+        """
+        for _, candles in groups:
+            for timeframe, _ in candles:
+                counter = self._timeframe_counters.get(timeframe)
+                if counter is None:
+                    counter = self._timeframe_counters[timeframe] = CANDLES_EMITTED.labels(f'{timeframe.size}-{timeframe.unit.value}')
+                counter.inc()
+
+        await asyncio.gather(
+            *(self._publish_to(publisher, groups, event_time_ms) for publisher in self.publishers)
+        )
+
+    async def _publish_to(self, publisher: Any, groups: Sequence[CandleGroup], event_time_ms: int) -> None:
+        async def publish_all():
+            for symbol, candles in groups:
+                await publisher.publish_many(symbol, candles, event_time_ms=event_time_ms)
+
+        if not getattr(publisher, 'lossy', False) or self.publish_timeout_s is None:
+            await publish_all()
+            return
+
+        try:
+            await asyncio.wait_for(publish_all(), self.publish_timeout_s)
+        except asyncio.TimeoutError:
+            name = getattr(publisher, 'name', type(publisher).__name__)
+            PUBLISH_TIMEOUTS.labels(name).inc()
+            if self._timeout_log_sampler():
+                logger.warning(
+                    f"Publishing {sum(len(candles) for _, candles in groups)} candles to {name} timed out after "
+                    f"{self.publish_timeout_s}s ({self._timeout_log_sampler.count} timeouts so far)"
+                )
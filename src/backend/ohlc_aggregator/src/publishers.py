@@ -1,56 +1,183 @@
 import asyncio
 from json import dumps
 import logging
-from typing import List
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
 
-from pulsar import Producer
+from pulsar import Producer, Result
 
+from src.metrics import LogSampler
 from src.models import OHLC
 from src.time_window import TimeWindow
+from src.topics import TopicProducers
+from src.write_buffer import OHLC_COLUMN_NAMES, ClickhouseWriteBuffer
 
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 class WebsocketPublisher():
-    def __init__(self, websocket_producer: Producer, timeframes: List[TimeWindow]):
+    name = 'websocket'
+    # Live updates only, the candles are also written to ClickHouse
+    lossy = True
+
+    def __init__(
+        self,
+        websocket_producer: Producer | None,
+        timeframes: List[TimeWindow],
+        max_in_flight: int = 1000,
+        topic_producers: TopicProducers | None = None
+    ):
         self.producer = websocket_producer
+        self.topic_producers = topic_producers
         self.timeframes = timeframes
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._pending: Set[asyncio.Future] = set()
+        self._headers: Dict[Tuple[str, TimeWindow, bool], Tuple[str, Dict[str, str], Producer]] = {}
+        self._error_log_sampler = LogSampler()
+
+    async def publish(
+        self,
+        symbol: str,
+        timeframe: TimeWindow,
+        ohlc: OHLC,
+        partial: bool = False,
+        event_time_ms: int | None = None
+    ) -> None:
+        """Publish a closed candle, or with partial=True an update of a still forming one.
+
+        event_time_ms is the timestamp of the trade that produced the candle,
+        the gateway measures end-to-end lag from it.
+        """
+        await self.publish_many(symbol, [(timeframe, ohlc)], partial, event_time_ms)
+
+    async def publish_many(
+        self,
+        symbol: str,
+        candles: Sequence[Tuple[TimeWindow, OHLC]],
+        partial: bool = False,
+        event_time_ms: int | None = None
+    ) -> None:
+        """Publish candles of one symbol in order, each serialized once and handed to the producer without waiting"""
+        loop = asyncio.get_running_loop()
+        for timeframe, ohlc in candles:
+            if timeframe not in self.timeframes:
+                continue
+            header = self._headers.get((symbol, timeframe, partial))
+            if header is None:
+                header = await self._header(symbol, timeframe, partial)
+            prefix, properties, producer = header
 
-    async def publish(self, symbol: str, timeframe: TimeWindow, ohlc: OHLC) -> None:
-        if timeframe in self.timeframes:
-            message = {
-                'symbol': symbol,
-                'timeframe': {'size': timeframe.size, 'unit': timeframe.unit.value},
-                'ohlc': ohlc.model_dump()
-            }
-            await asyncio.to_thread(
-                self.producer.send,
-                dumps(message).encode('utf-8')
-            )
+            await self._in_flight.acquire()
+            future = loop.create_future()
+            self._pending.add(future)
+            future.add_done_callback(self._on_sent)
+            try:
+                producer.send_async(
+                    self._encode(prefix, ohlc),
+                    lambda result, _, future=future: loop.call_soon_threadsafe(self._resolve, future, result),
+                    properties=properties,
+                    event_timestamp=event_time_ms
+                )
+            except Exception as e:
+                # Failed without queueing the send, _on_sent releases the permit
+                # and logs it like a failed send
+                future.set_exception(e)
             # logger.debug(f"Published OHLC for {symbol} {timeframe.size} {timeframe.unit.value} to Websocket")
 
+    async def flush(self) -> None:
+        if self._pending:
+            await asyncio.wait(self._pending)
+
+    async def forget(self, symbols: Iterable[str]) -> None:
+        """Drop the cached headers of evicted symbols and close their per-symbol producers"""
+        symbols = set(symbols)
+        for key in [key for key in self._headers if key[0] in symbols]:
+            del self._headers[key]
+        if self.topic_producers is not None:
+            await self.topic_producers.forget(symbols)
+
+    async def _header(self, symbol: str, timeframe: TimeWindow, partial: bool) -> Tuple[str, Dict[str, str], Producer]:
+        """JSON prefix, routing properties and producer for a symbol/timeframe"""
+        producer = self.producer
+        if self.topic_producers is not None:
+            producer = await self.topic_producers.get(symbol, timeframe)
+        header = {'symbol': symbol, 'timeframe': {'size': timeframe.size, 'unit': timeframe.unit.value}}
+        # Lets the gateway route a candle without decoding its payload
+        properties = {'symbol': symbol, 'size': str(timeframe.size), 'unit': timeframe.unit.value}
+        if partial:
+            header['partial'] = True
+            properties['partial'] = '1'
+        prefix = dumps(header)
+        cached = self._headers[(symbol, timeframe, partial)] = (f'{prefix[:-1]}, "ohlc": ', properties, producer)
+        return cached
+
+    @staticmethod
+    def _encode(prefix: str, ohlc: OHLC) -> bytes:
+        """Serialize to the same JSON as dumps() with the symbol/timeframe part cached"""
+        return (
+            f'{prefix}{{"time": {ohlc.time}, "open": {ohlc.open!r}, "high": {ohlc.high!r}, '
+            f'"low": {ohlc.low!r}, "close": {ohlc.close!r}}}}}'
+        ).encode('utf-8')
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Result) -> None:
+        if not future.done():
+            future.set_result(result)
+
+    def _on_sent(self, future: asyncio.Future) -> None:
+        self._pending.discard(future)
+        self._in_flight.release()
+        error = future.exception()
+        if error is not None:
+            if self._error_log_sampler():
+                logger.error(f"Failed to publish OHLC to Websocket topic: {error!r} ({self._error_log_sampler.count} failures so far)")
+            return
+        result = future.result()
+        if result != Result.Ok and self._error_log_sampler():
+            logger.error(f"Failed to publish OHLC to Websocket topic: {result} ({self._error_log_sampler.count} failures so far)")
+
 
 class ClickhousePublisher():
-    def __init__(self, clickhouse_client, timeframes: List[TimeWindow]):
+    name = 'clickhouse'
+    lossy = False
+
+    def __init__(
+        self,
+        clickhouse_client,
+        timeframes: List[TimeWindow],
+        write_buffer: ClickhouseWriteBuffer | None = None
+    ):
         self.client = clickhouse_client
         self.timeframes = timeframes
+        self.write_buffer = write_buffer
+
+    async def publish(self, symbol: str, timeframe: TimeWindow, ohlc: OHLC, event_time_ms: int | None = None) -> None:
+        await self.publish_many(symbol, [(timeframe, ohlc)], event_time_ms)
+
+    async def publish_many(
+        self,
+        symbol: str,
+        candles: Sequence[Tuple[TimeWindow, OHLC]],
+        event_time_ms: int | None = None
+    ) -> None:
+        """Write candles of one symbol as a single buffer add or insert"""
+        rows = [
+            (symbol, timeframe.size, timeframe.unit.value, ohlc.time, ohlc.open, ohlc.high, ohlc.low, ohlc.close)
+            for timeframe, ohlc in candles
+            if timeframe in self.timeframes
+        ]
+        if not rows:
+            return
+        if self.write_buffer is not None:
+            await self.write_buffer.add_many(rows)
+            return
 
-    async def publish(self, symbol: str, timeframe: TimeWindow, ohlc: OHLC) -> None:
-        if timeframe in self.timeframes:
-            data = {
-                'symbol': symbol,
-                'timeframe_size': timeframe.size,
-                'timeframe_unit': timeframe.unit.value,
-                **ohlc.model_dump()
-            }
-            await self.client.insert(
-                table='ohlc_db.ohlc_table',
-                data=[list(data.values())],
-                column_names=list(data.keys())
-            )
-            # logger.debug(f"Published OHLC for {symbol} {timeframe.size} {timeframe.unit.value} to ClickHouse")
+        await self.client.insert(
+            table='ohlc_db.ohlc_table',
+            data=rows,
+            column_names=OHLC_COLUMN_NAMES
+        )
+        # logger.debug(f"Published {len(rows)} OHLC for {symbol} to ClickHouse")
@@ -0,0 +1,182 @@
+"""Cascading candle rollups: 1-second candles feed 1m, 1m feeds 1h, 1h feeds 1d.
+
+Each tier is an AggregatingMergeTree table filled by a materialized view on
+the tier below, so an insert into ohlc_table only triggers the 1m view and
+each coarser tier sees one merged row per bucket. The chart reads candles
+from the coarsest tier whose buckets line up with the timeframe windows and
+whose retention still covers the range (frontend/chart/src/server/rollups.ts).
+It reads the retention back from the TTLs apply_retention sets, so only the
+tier tables here must stay in step with it.
+"""
+import logging
+import time
+from typing import Dict, List, NamedTuple
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class RollupTier(NamedTuple):
+    name: str
+    seconds: int
+    table: str
+    # Expression truncating the bucket time of the tier below to this tier
+    truncate: str
+    partition_by: str
+
+
+# 1s candles are the rows of ohlc_table itself
+SECOND_TIER = RollupTier('1s', 1, 'ohlc_db.ohlc_table', '', '')
+ROLLUP_TIERS: List[RollupTier] = [
+    RollupTier('1m', 60, 'ohlc_db.ohlc_rollup_1m', "toStartOfMinute(bucket, 'UTC')", 'toYYYYMM(time)'),
+    RollupTier('1h', 3600, 'ohlc_db.ohlc_rollup_1h', "toStartOfHour(bucket, 'UTC')", 'toYear(time)'),
+    RollupTier('1d', 86400, 'ohlc_db.ohlc_rollup_1d', "toDateTime(toStartOfDay(bucket, 'UTC'), 'UTC')", 'tuple()'),
+]
+TIERS = [SECOND_TIER, *ROLLUP_TIERS]
+
+_SECOND_CANDLES = "timeframe_size = 1 AND timeframe_unit = 'second'"
+
+
+def _source_select(tier: RollupTier, where: str = '') -> str:
+    """SELECT producing the rows of tier from the tier below it, or from its rows matching where"""
+    if tier is ROLLUP_TIERS[0]:
+        # Views only see the inserted block, a rebuild reads the deduplicated candles
+        source = f"{SECOND_TIER.table} FINAL WHERE {_SECOND_CANDLES} AND {where}" if where else f"{SECOND_TIER.table} WHERE {_SECOND_CANDLES}"
+        # Reading the time through another name keeps argMin/argMax on the
+        # candle time rather than the bucket alias
+        return f"""
+            SELECT
+                symbol,
+                {tier.truncate} AS time,
+                argMinState(open, bucket) AS open,
+                maxState(high) AS high,
+                minState(low) AS low,
+                argMaxState(close, bucket) AS close
+            FROM
+            (
+                SELECT symbol, toDateTime(time, 'UTC') AS bucket, open, high, low, close
+                FROM {source}
+            )
+            GROUP BY symbol, time
+            """
+    below = TIERS[TIERS.index(tier) - 1]
+    return f"""
+            SELECT
+                symbol,
+                {tier.truncate} AS time,
+                argMinMergeState(open) AS open,
+                maxMergeState(high) AS high,
+                minMergeState(low) AS low,
+                argMaxMergeState(close) AS close
+            FROM
+            (
+                SELECT symbol, time AS bucket, open, high, low, close
+                FROM {below.table}
+                {f"WHERE {where}" if where else ""}
+            )
+            GROUP BY symbol, time
+            """
+
+
+async def create_rollups(client) -> None:
+    """Create the tier tables, fill them from the existing 1s candles and attach the views.
+
+    The views are created last, so the backfill does not cascade through
+    them. Running this again after a failure re-inserts rows that are already
+    there, which the min/max/argMin/argMax states absorb.
+    """
+    for tier in ROLLUP_TIERS:
+        await client.command(
+            f"""
+            CREATE TABLE IF NOT EXISTS {tier.table}
+            (
+                symbol LowCardinality(String),
+                time DateTime('UTC') CODEC(DoubleDelta, ZSTD(1)),
+                open AggregateFunction(argMin, Float64, DateTime('UTC')),
+                high AggregateFunction(max, Float64),
+                low AggregateFunction(min, Float64),
+                close AggregateFunction(argMax, Float64, DateTime('UTC'))
+            )
+            ENGINE = AggregatingMergeTree()
+            PARTITION BY {tier.partition_by}
+            ORDER BY (symbol, time);
+            """
+        )
+
+    for tier in ROLLUP_TIERS:
+        await client.command(f"INSERT INTO {tier.table} {_source_select(tier)}")
+        logger.info(f"Filled rollup tier {tier.name}")
+
+    for tier in ROLLUP_TIERS:
+        await client.command(
+            f"CREATE MATERIALIZED VIEW IF NOT EXISTS {tier.table}_mv TO {tier.table} AS {_source_select(tier)}"
+        )
+
+
+async def apply_retention(client, retention_days: Dict[str, int]) -> None:
+    """Set the TTL of every tier to its retention in days, 0 keeps the tier forever.
+
+    Only tiers whose TTL differs are altered, since changing a TTL rewrites
+    the table parts.
+    """
+    for tier in TIERS:
+        days = retention_days.get(tier.name, 0)
+        database, table = tier.table.split('.')
+        result = await client.query(
+            'SELECT engine_full FROM system.tables WHERE database = {database:String} AND name = {table:String}',
+            parameters={'database': database, 'table': table}
+        )
+        engine = result.result_rows[0][0] if result.result_rows else ''
+        has_ttl = ' TTL ' in f' {engine} '
+
+        if days <= 0:
+            if has_ttl:
+                await client.command(f"ALTER TABLE {tier.table} REMOVE TTL")
+                logger.info(f"Removed retention of rollup tier {tier.name}")
+            continue
+        if has_ttl and f'toIntervalDay({days})' in engine:
+            continue
+
+        ttl = f"time + INTERVAL {days} DAY"
+        if tier is SECOND_TIER:
+            # ohlc_table also holds every other timeframe, only 1s candles expire
+            ttl += f" WHERE {_SECOND_CANDLES}"
+        await client.command(f"ALTER TABLE {tier.table} MODIFY TTL {ttl}")
+        logger.info(f"Set retention of rollup tier {tier.name} to {days} days")
+
+
+async def rebuild_rollups(client, symbols: List[str], start: int, end: int, retention_days: Dict[str, int]) -> None:
+    """Recompute the tier buckets of symbols overlapping [start, end) (epoch seconds) from the 1s candles.
+
+    The views only ever add to a bucket, so after 1-second candles are
+    rewritten, e.g. by a corrected backfill, highs and lows of the replaced
+    rows stay in the tiers until the buckets are rebuilt. Buckets whose 1s
+    candles already expired are left alone, rebuilding them would empty them.
+    """
+    days = retention_days.get(SECOND_TIER.name, 0)
+    if days > 0:
+        cutoff = int(time.time()) - days * 86400
+        if start < cutoff:
+            logger.warning(f"1s candles before {cutoff} have expired, their rollups are not rebuilt")
+            start = cutoff
+    if not symbols or start >= end:
+        return
+
+    # Each insert also cascades into the next tier through its view, which
+    # is deleted and rebuilt right after, coarsest last
+    for tier in ROLLUP_TIERS:
+        # Whole buckets of this tier, each is rebuilt from every source row in it
+        first = start // tier.seconds * tier.seconds
+        last = -(-end // tier.seconds) * tier.seconds
+        where = 'symbol IN {symbols:Array(String)} AND time >= toDateTime({start:UInt32}) AND time < toDateTime({end:UInt32})'
+        parameters = {'symbols': symbols, 'start': first, 'end': last}
+        await client.command(
+            f"ALTER TABLE {tier.table} DELETE WHERE {where}",
+            parameters=parameters,
+            settings={'mutations_sync': 2}
+        )
+        await client.command(f"INSERT INTO {tier.table} {_source_select(tier, where)}", parameters=parameters)
+        logger.info(f"Rebuilt rollup tier {tier.name} from {first} to {last} for {len(symbols)} symbols")
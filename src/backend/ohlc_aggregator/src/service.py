@@ -1,12 +1,23 @@
 import asyncio
 import logging
+import time
+from typing import List
 
-from pulsar import Client, Consumer, ConsumerType, Message, Producer
+from pulsar import Client, Consumer, ConsumerBatchReceivePolicy, ConsumerKeySharedPolicy, ConsumerType, Message, Producer
 
 from src.aggregator import OHLCAggregator
+from src.cascading_aggregator import CascadingOHLCAggregator
+from src.checkpoint import Checkpointer, encode_snapshot
+from src.columnar_aggregator import ColumnarOHLCAggregator
+from src.decoding import TRADE_DECODERS
+from src.forming import FormingCandleStream
+from src.metrics import CONSUMER_BACKLOG, CONSUMER_LAG, MESSAGES_FAILED, MESSAGES_RECEIVED, RECEIVE_TO_ACK, SYMBOLS_EVICTED
 from src.processing import OHLCMessageProcessor
 from src.publishers import ClickhousePublisher, WebsocketPublisher
 from src.timeframes import TIMEFRAME_CONFIG
+from src.topics import TopicProducers
+from src.window_closer import WindowCloser
+from src.write_buffer import ClickhouseWriteBuffer
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -15,6 +26,19 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+AGGREGATOR_ENGINES = {
+    'python': OHLCAggregator,
+    'columnar': ColumnarOHLCAggregator,
+    'cascading': CascadingOHLCAggregator,
+}
+# Engines only faster than 'python' on batches, their add_trade pays numpy's per-call overhead
+BATCH_ONLY_ENGINES = {'columnar'}
+
+BATCH_MAX_BYTES = 10 * 1024 * 1024
+BACKLOG_POLL_INTERVAL_S = 5.0
+EVICTION_INTERVAL_S = 60.0
+OHLC_TABLE = 'ohlc_db.ohlc_table'
+
 
 class OHLCMessageService:
     def __init__(
@@ -24,68 +48,316 @@ class OHLCMessageService:
         input_topic: str,
         output_topic: str,
         subscription_name: str,
-        consumer_type: ConsumerType
+        consumer_type: ConsumerType,
+        key_shared_policy: ConsumerKeySharedPolicy | None = None,
+        aggregator_engine: str = 'python',
+        trade_decoder: str = 'pydantic',
+        batch_receive_enabled: bool = False,
+        batch_max_messages: int = 1000,
+        batch_max_latency_ms: int = 50,
+        batch_ack_mode: str = 'cumulative',
+        write_buffer_options: dict | None = None,
+        producer_options: dict | None = None,
+        producer_max_in_flight: int = 1000,
+        publish_timeout_s: float | None = None,
+        output_topic_mode: str = 'single',
+        forming_candle_interval_ms: int | None = None,
+        window_allowed_lateness_ms: int | None = None,
+        max_symbol_idle_s: float | None = None,
+        max_state_bytes: int | None = None,
+        checkpointer: Checkpointer | None = None
     ) -> None:
+        if aggregator_engine in BATCH_ONLY_ENGINES and not batch_receive_enabled:
+            raise ValueError(f"The {aggregator_engine} aggregator engine requires batch receive to be enabled")
         self.pulsar_client = pulsar_client
         self.clickhouse_client = clickhouse_client
         self.input_topic = input_topic
         self.output_topic = output_topic
         self.subscription_name = subscription_name
         self.consumer_type = consumer_type
+        self.key_shared_policy = key_shared_policy
+        self.aggregator_engine = aggregator_engine
+        self.trade_decoder = trade_decoder
+        self.batch_receive_enabled = batch_receive_enabled
+        self.batch_max_messages = batch_max_messages
+        self.batch_max_latency_ms = batch_max_latency_ms
+        self.batch_ack_mode = batch_ack_mode
+        self.write_buffer_options = write_buffer_options
+        self.producer_options = producer_options or {}
+        self.producer_max_in_flight = producer_max_in_flight
+        self.publish_timeout_s = publish_timeout_s
+        self.output_topic_mode = output_topic_mode
+        self.forming_candle_interval_ms = forming_candle_interval_ms
+        self.window_allowed_lateness_ms = window_allowed_lateness_ms
+        self.max_symbol_idle_s = max_symbol_idle_s
+        self.max_state_bytes = max_state_bytes
+        self.checkpointer = checkpointer
         self.consumer: Consumer | None = None
         self.producer: Producer | None = None
+        self.topic_producers: TopicProducers | None = None
         self.processor: OHLCMessageProcessor | None = None
+        self.write_buffer: ClickhouseWriteBuffer | None = None
+        self.websocket_publisher: WebsocketPublisher | None = None
+        self.forming_stream: FormingCandleStream | None = None
+        self.window_closer: WindowCloser | None = None
+        self.processed_messages = 0
+        self._last_message_id = None
+        self._restored_message_id = None
         self._task: asyncio.Task | None = None
+        self._backlog_task: asyncio.Task | None = None
+        self._eviction_task: asyncio.Task | None = None
         self._is_running = False
 
     async def __aenter__(self):
+        batch_receive_policy = None
+        if self.batch_receive_enabled:
+            batch_receive_policy = ConsumerBatchReceivePolicy(
+                self.batch_max_messages,
+                BATCH_MAX_BYTES,
+                self.batch_max_latency_ms
+            )
+
         self.consumer = await asyncio.to_thread(
             self.pulsar_client.subscribe,
             self.input_topic,
             self.subscription_name,
-            self.consumer_type
+            self.consumer_type,
+            batch_receive_policy=batch_receive_policy,
+            key_shared_policy=self.key_shared_policy
         )
 
-        self.producer = await asyncio.to_thread(
-            self.pulsar_client.create_producer,
-            self.output_topic
+        producer_options = {
+            'max_pending_messages': self.producer_max_in_flight,
+            'block_if_queue_full': True,
+            **self.producer_options
+        }
+        if self.output_topic_mode == 'single':
+            self.producer = await asyncio.to_thread(
+                self.pulsar_client.create_producer,
+                self.output_topic,
+                **producer_options
+            )
+        else:
+            self.topic_producers = TopicProducers(
+                self.pulsar_client,
+                self.output_topic,
+                self.output_topic_mode,
+                **producer_options
+            )
+
+        if self.write_buffer_options is not None:
+            self.write_buffer = ClickhouseWriteBuffer(
+                self.clickhouse_client,
+                OHLC_TABLE,
+                **self.write_buffer_options
+            )
+            self.write_buffer.start()
+
+        self.websocket_publisher = WebsocketPublisher(
+            self.producer,
+            TIMEFRAME_CONFIG,
+            self.producer_max_in_flight,
+            self.topic_producers
         )
 
+        aggregator = AGGREGATOR_ENGINES[self.aggregator_engine](timeframes=TIMEFRAME_CONFIG, smooth_gaps=False)
+        if self.forming_candle_interval_ms is not None:
+            self.forming_stream = FormingCandleStream(aggregator, self.websocket_publisher, self.forming_candle_interval_ms)
+
         self.processor = OHLCMessageProcessor(
-            OHLCAggregator(timeframes=TIMEFRAME_CONFIG, smooth_gaps=False),
+            aggregator,
             [
-                WebsocketPublisher(self.producer, TIMEFRAME_CONFIG),
-                ClickhousePublisher(self.clickhouse_client, TIMEFRAME_CONFIG)
-            ]
+                self.websocket_publisher,
+                ClickhousePublisher(self.clickhouse_client, TIMEFRAME_CONFIG, self.write_buffer)
+            ],
+            TRADE_DECODERS[self.trade_decoder],
+            self.forming_stream,
+            publish_timeout_s=self.publish_timeout_s
         )
+        if self.window_allowed_lateness_ms is not None:
+            self.window_closer = WindowCloser(aggregator, self.processor.publish_candles, self.window_allowed_lateness_ms)
+            self.processor.window_closer = self.window_closer
+
+        if self.checkpointer is not None:
+            await self._restore_checkpoint()
+
+        if self.forming_stream is not None:
+            self.forming_stream.start()
+        if self.window_closer is not None:
+            self.window_closer.start()
 
         self._is_running = True
         self._task = asyncio.create_task(self._message_loop())
+        self._backlog_task = asyncio.create_task(self._backlog_loop())
+        if self.max_symbol_idle_s is not None or self.max_state_bytes is not None:
+            self._eviction_task = asyncio.create_task(self._eviction_loop())
         return self
 
     async def __aexit__(self, *exc):
         logger.debug("Shutting down service...")
         self._is_running = False
+        if self._backlog_task is not None:
+            self._backlog_task.cancel()
+        if self._eviction_task is not None:
+            self._eviction_task.cancel()
         if self._task is not None:
             await self._task
+        if self.forming_stream is not None:
+            await self.forming_stream.close()
+        if self.window_closer is not None:
+            await self.window_closer.close()
+        if self.write_buffer is not None:
+            logger.debug("Flushing ClickHouse write buffer...")
+            await self.write_buffer.close()
+        if self.websocket_publisher is not None:
+            logger.debug("Waiting for in-flight Websocket messages...")
+            await self.websocket_publisher.flush()
+        if self.checkpointer is not None:
+            logger.debug("Writing final aggregator snapshot...")
+            await self._checkpoint(force=True)
         if self.consumer is not None:
             logger.debug("Closing consumer...")
             await asyncio.to_thread(self.consumer.close)
         if self.producer is not None:
             logger.debug("Closing producer...")
             await asyncio.to_thread(self.producer.close)
+        if self.topic_producers is not None:
+            logger.debug("Closing per-symbol producers...")
+            await self.topic_producers.close()
 
     async def _message_loop(self):
+        process_next = self._process_next_batch if self.batch_receive_enabled else self._process_next_message
         while self._is_running:
-            await self._process_next_message()
+            await process_next()
+            if self.checkpointer is not None:
+                try:
+                    await self._checkpoint()
+                except Exception as e:
+                    logger.error(f"Error writing aggregator snapshot: {e}", exc_info=True)
 
     async def _process_next_message(self):
         message: Message | None = None
         try:
             message = await asyncio.to_thread(self.consumer.receive)
-            await self.processor.process_message(message)
+            received = time.perf_counter()
+            MESSAGES_RECEIVED.inc()
+            CONSUMER_LAG.set(time.time() - message.publish_timestamp() / 1000)
+            if not self._is_replayed(message):
+                await self.processor.process_message(message)
             await asyncio.to_thread(self.consumer.acknowledge, message)
+            RECEIVE_TO_ACK.observe(time.perf_counter() - received)
+            self.processed_messages += 1
+            self._last_message_id = message.message_id()
         except Exception as e:
             logger.error(f"Error processing message: {e}", exc_info=True)
             if message is not None:
+                MESSAGES_FAILED.inc()
                 await asyncio.to_thread(self.consumer.negative_acknowledge, message)
+
+    async def _process_next_batch(self):
+        messages: List[Message] = []
+        try:
+            messages = await asyncio.to_thread(self.consumer.batch_receive)
+            if not messages:
+                return
+            received = time.perf_counter()
+            MESSAGES_RECEIVED.inc(len(messages))
+            CONSUMER_LAG.set(time.time() - messages[-1].publish_timestamp() / 1000)
+            await self.processor.process_messages([m for m in messages if not self._is_replayed(m)])
+            if self.batch_ack_mode == 'cumulative':
+                await asyncio.to_thread(self.consumer.acknowledge_cumulative, messages[-1])
+            else:
+                await asyncio.to_thread(self._acknowledge_all, messages)
+            RECEIVE_TO_ACK.observe(time.perf_counter() - received)
+            self.processed_messages += len(messages)
+            self._last_message_id = messages[-1].message_id()
+        except Exception as e:
+            logger.error(f"Error processing batch: {e}", exc_info=True)
+            if messages:
+                MESSAGES_FAILED.inc(len(messages))
+                await asyncio.to_thread(self._negative_acknowledge_all, messages)
+
+    async def _backlog_loop(self):
+        """Estimate the consumer backlog from the topic's last message ID"""
+        while True:
+            await asyncio.sleep(BACKLOG_POLL_INTERVAL_S)
+            try:
+                last = await asyncio.to_thread(self.consumer.get_last_message_id)
+            except Exception as e:
+                logger.warning(f"Could not get last message ID: {e}")
+                continue
+            current = self._last_message_id
+            if current is None:
+                CONSUMER_BACKLOG.set(float('nan'))
+            elif current.ledger_id() == last.ledger_id():
+                # Entries are only comparable within a ledger, batched entries count once
+                CONSUMER_BACKLOG.set(max(last.entry_id() - current.entry_id(), 0))
+            elif current.ledger_id() > last.ledger_id():
+                CONSUMER_BACKLOG.set(0)
+            else:
+                CONSUMER_BACKLOG.set(float('nan'))
+
+    async def _eviction_loop(self):
+        aggregator = self.processor.aggregator
+        while True:
+            await asyncio.sleep(EVICTION_INTERVAL_S)
+            evicted = aggregator.evict_symbols(self.max_symbol_idle_s, self.max_state_bytes)
+            if not evicted:
+                continue
+            SYMBOLS_EVICTED.inc(len(evicted))
+            if self.window_closer is not None:
+                self.window_closer.forget(evicted)
+            if self.forming_stream is not None:
+                self.forming_stream.forget(evicted)
+            await self.websocket_publisher.forget(evicted)
+            logger.info(f"Evicted window state of {len(evicted)} symbols, {aggregator.symbol_count} left")
+
+    def _is_replayed(self, message: Message) -> bool:
+        """Whether the message is already covered by the restored snapshot"""
+        if self._restored_message_id is None:
+            return False
+        if message.message_id() <= self._restored_message_id:
+            return True
+        self._restored_message_id = None
+        return False
+
+    async def _restore_checkpoint(self) -> None:
+        snapshot = await asyncio.to_thread(self.checkpointer.load, TIMEFRAME_CONFIG)
+        if snapshot is None:
+            logger.info("No aggregator snapshot found, starting with empty windows")
+            return
+
+        message_id, windows, closed = snapshot
+        self.processor.aggregator.import_windows(windows)
+        if self.window_closer is not None:
+            self.window_closer.import_closed(closed)
+        await asyncio.to_thread(self.consumer.seek, message_id)
+        self._restored_message_id = message_id
+        self._last_message_id = message_id
+        logger.info(f"Restored windows for {len(windows)} symbols, resuming after message {message_id}")
+
+    async def _checkpoint(self, force: bool = False) -> None:
+        if self._last_message_id is None or not (force or self.checkpointer.is_due()):
+            return
+
+        # Everything emitted up to the snapshot must be durable before the
+        # snapshot claims to cover it
+        if self.write_buffer is not None:
+            await self.write_buffer.flush()
+        await self.websocket_publisher.flush()
+
+        data = encode_snapshot(
+            self._last_message_id,
+            TIMEFRAME_CONFIG,
+            self.processor.aggregator.export_windows(),
+            self.window_closer.export_closed() if self.window_closer is not None else None
+        )
+        await asyncio.to_thread(self.checkpointer.save, data)
+
+    def _acknowledge_all(self, messages: List[Message]) -> None:
+        for message in messages:
+            self.consumer.acknowledge(message)
+
+    def _negative_acknowledge_all(self, messages: List[Message]) -> None:
+        for message in messages:
+            self.consumer.negative_acknowledge(message)
@@ -0,0 +1,90 @@
+import logging
+import multiprocessing
+from multiprocessing.sharedctypes import SynchronizedArray
+import signal
+import time
+from typing import Callable, List, Tuple
+
+from pulsar import ConsumerKeySharedPolicy, KeySharedMode
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Pulsar hashes message keys into this many Key_Shared slots
+KEY_HASH_RANGE = 65536
+
+
+def shard_hash_ranges(shard_count: int) -> List[Tuple[int, int]]:
+    """Split the Key_Shared hash space into shard_count inclusive ranges"""
+    return [
+        (shard * KEY_HASH_RANGE // shard_count, (shard + 1) * KEY_HASH_RANGE // shard_count - 1)
+        for shard in range(shard_count)
+    ]
+
+
+def shard_key_shared_policy(shard: int, shard_count: int) -> ConsumerKeySharedPolicy:
+    """Pin a worker to its own slice of symbol hashes so each symbol has exactly one aggregator"""
+    return ConsumerKeySharedPolicy(
+        key_shared_mode=KeySharedMode.Sticky,
+        sticky_ranges=[shard_hash_ranges(shard_count)[shard]]
+    )
+
+
+def run_sharded(
+    shard_count: int,
+    worker: Callable[[int, SynchronizedArray], None],
+    report_interval_s: float = 10.0
+) -> int:
+    """Run one worker process per shard until SIGTERM/SIGINT or a worker dies.
+
+    Workers publish their processed message count into a shared array; the
+    parent logs per-shard throughput every report_interval_s.
+    """
+    context = multiprocessing.get_context('spawn')
+    counters = context.Array('Q', shard_count, lock=False)
+    processes = [
+        context.Process(target=worker, args=(shard, counters), name=f'ohlc-shard-{shard}')
+        for shard in range(shard_count)
+    ]
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, stop)
+
+    for process in processes:
+        process.start()
+    logger.info(f"Started {shard_count} aggregator shards")
+
+    previous = [0] * shard_count
+    last_report = time.monotonic()
+    exit_code = 0
+    while not stopping:
+        time.sleep(0.5)
+        if any(not process.is_alive() for process in processes):
+            logger.error("An aggregator shard exited unexpectedly, stopping all shards")
+            exit_code = 1
+            break
+
+        now = time.monotonic()
+        if now - last_report >= report_interval_s:
+            current = list(counters)
+            for shard in range(shard_count):
+                rate = (current[shard] - previous[shard]) / (now - last_report)
+                logger.info(f"Shard {shard}: {current[shard]} messages processed ({rate:.1f} msg/s)")
+            previous, last_report = current, now
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+    logger.info("All aggregator shards stopped")
+    return exit_code
@@ -0,0 +1,42 @@
+import sys
+from typing import Dict, List, Protocol
+
+
+class _Evictable(Protocol):
+    last_trade: int
+
+
+def state_size(obj) -> int:
+    """Rough deep size of a slotted state record, its lists and arrays"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, list):
+        return size + sum(state_size(item) for item in obj)
+    for name in getattr(type(obj), '__slots__', ()):
+        value = getattr(obj, name, None)
+        if value is not None:
+            size += state_size(value)
+    return size
+
+
+def evict(
+    states: Dict[str, _Evictable],
+    newest_trade: int,
+    symbol_bytes: int,
+    max_idle_s: float | None,
+    max_bytes: int | None
+) -> List[str]:
+    """Evict from states in place, see OHLCAggregator.evict_symbols"""
+    evicted = []
+    if max_idle_s is not None:
+        cutoff = newest_trade - max_idle_s
+        evicted = [symbol for symbol, state in states.items() if state.last_trade < cutoff]
+        for symbol in evicted:
+            del states[symbol]
+
+    if max_bytes is not None and len(states) * symbol_bytes > max_bytes:
+        excess = len(states) - max_bytes // symbol_bytes
+        least_recent = sorted(states, key=lambda symbol: states[symbol].last_trade)[:excess]
+        for symbol in least_recent:
+            del states[symbol]
+        evicted.extend(least_recent)
+    return evicted
@@ -1,6 +1,8 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from enum import Enum
+from functools import lru_cache
 import logging
+from typing import Tuple
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,10 +21,56 @@ class TimeUnit(Enum):
     YEAR = "year"
 
 
+UNIT_SECONDS = {
+    TimeUnit.SECOND: 1,
+    TimeUnit.MINUTE: 60,
+    TimeUnit.HOUR: 3600,
+    TimeUnit.DAY: 86400,
+    TimeUnit.WEEK: 604800,
+}
+
+# (period the window is truncated within, alignment step, epoch offset) in
+# seconds, mirroring get_window_start: seconds and minutes are truncated within
+# the hour, hours within the day, days and weeks only use the size for the end.
+FIXED_LAYOUT = {
+    TimeUnit.SECOND: lambda size: (3600, size, 0),
+    TimeUnit.MINUTE: lambda size: (3600, size * 60, 0),
+    TimeUnit.HOUR: lambda size: (86400, size * 3600, 0),
+    TimeUnit.DAY: lambda size: (86400, 86400, 0),
+    # 1970-01-01 was a Thursday, shift by three days to align on Mondays
+    TimeUnit.WEEK: lambda size: (604800, 604800, 3 * 86400),
+}
+
+
+def _epoch(year: int, month: int) -> int:
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+
+
+@lru_cache(maxsize=4096)
+def _calendar_bounds(unit: TimeUnit, size: int, year: int, month: int) -> Tuple[int, int, int, int]:
+    """(first, last + 1, window start, window end) for the calendar period containing year/month"""
+    if unit == TimeUnit.MONTH:
+        first = _epoch(year, month)
+        following = _epoch(year + month // 12, month % 12 + 1)
+        end = _epoch(year + (month - 1 + size) // 12, (month - 1 + size) % 12 + 1)
+    else:
+        first = _epoch(year, 1)
+        following = _epoch(year + 1, 1)
+        end = _epoch(year + size, 1)
+    return first, following, first, end
+
+
 class TimeWindow:
     def __init__(self, size: int, unit: TimeUnit):
         self.size = size
         self.unit = unit
+        self._cached_bounds: Tuple[int, int, int, int] = (0, 0, 0, 0)
+        if unit in FIXED_LAYOUT:
+            self._layout = FIXED_LAYOUT[unit](size)
+            self._length = size * UNIT_SECONDS[unit]
+        else:
+            self._layout = None
+            self._length = None
 
     def __eq__(self, other):
         if isinstance(other, TimeWindow):
@@ -46,7 +94,8 @@ class TimeWindow:
         elif self.unit == TimeUnit.DAY:
             return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
         elif self.unit == TimeUnit.WEEK:
-            return timestamp - timedelta(days=timestamp.weekday())
+            day_start = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+            return day_start - timedelta(days=timestamp.weekday())
         elif self.unit == TimeUnit.MONTH:
             return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         elif self.unit == TimeUnit.YEAR:
@@ -81,3 +130,29 @@ class TimeWindow:
             raise ValueError(f"Unknown time unit: {self.unit}")
 
         return current_time >= window_end
+
+    def get_window_bounds(self, timestamp: int) -> Tuple[int, int]:
+        """Window start and end for a UTC epoch-seconds timestamp.
+
+        Same windows as get_window_start/is_window_complete. The bounds of the
+        last lookup are cached, so consecutive timestamps in the same window
+        cost a single range comparison.
+        """
+        first, following, start, end = self._cached_bounds
+        if first <= timestamp < following:
+            return start, end
+
+        if self._layout is not None:
+            period, step, offset = self._layout
+            in_period = (timestamp + offset) % period
+            start = timestamp - in_period % step
+            following = min(start + step, timestamp - in_period + period)
+            bounds = (start, following, start, start + self._length)
+        elif self.unit in (TimeUnit.MONTH, TimeUnit.YEAR):
+            moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+            bounds = _calendar_bounds(self.unit, self.size, moment.year, moment.month)
+        else:
+            raise ValueError(f"Unknown time unit: {self.unit}")
+
+        self._cached_bounds = bounds
+        return bounds[2], bounds[3]
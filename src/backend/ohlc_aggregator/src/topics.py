@@ -0,0 +1,74 @@
+import asyncio
+import re
+from typing import Dict, Iterable, Set
+
+from pulsar import Client, Producer
+
+from src.time_window import TimeWindow
+
+# 'single': every candle goes to the output topic itself
+# 'symbol': one topic per symbol, e.g. ohlc-trades-BTCUSDT
+# 'timeframe': one topic per symbol and timeframe, e.g. ohlc-trades-BTCUSDT-5-minute
+TOPIC_MODES = ('single', 'symbol', 'timeframe')
+
+_INVALID_TOPIC_CHARS = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def topic_name(base_topic: str, mode: str, symbol: str, timeframe: TimeWindow) -> str:
+    """Topic a candle is published to, the trade_data_ws gateway derives the same names"""
+    if mode == 'single':
+        return base_topic
+    topic = f'{base_topic}-{_INVALID_TOPIC_CHARS.sub("_", symbol)}'
+    if mode == 'timeframe':
+        topic = f'{topic}-{timeframe.size}-{timeframe.unit.value}'
+    return topic
+
+
+class TopicProducers:
+    """Lazily created producers for the per-symbol output topics"""
+
+    def __init__(self, pulsar_client: Client, base_topic: str, mode: str, **producer_options):
+        if mode not in TOPIC_MODES:
+            raise ValueError(f"Unknown output topic mode: {mode}")
+        self.pulsar_client = pulsar_client
+        self.base_topic = base_topic
+        self.mode = mode
+        self.producer_options = producer_options
+        self._producers: Dict[str, asyncio.Task] = {}
+        # Topics each symbol has producers for, to close them when it is evicted
+        self._symbol_topics: Dict[str, Set[str]] = {}
+
+    async def get(self, symbol: str, timeframe: TimeWindow) -> Producer:
+        topic = topic_name(self.base_topic, self.mode, symbol, timeframe)
+        task = self._producers.get(topic)
+        if task is None or (task.done() and task.exception() is not None):
+            task = self._producers[topic] = asyncio.create_task(asyncio.to_thread(
+                self.pulsar_client.create_producer,
+                topic,
+                **self.producer_options
+            ))
+            self._symbol_topics.setdefault(symbol, set()).add(topic)
+        return await task
+
+    async def forget(self, symbols: Iterable[str]) -> None:
+        """Close the producers of evicted symbols, a later candle of one opens them again"""
+        tasks = []
+        for symbol in symbols:
+            for topic in self._symbol_topics.pop(symbol, ()):
+                task = self._producers.pop(topic, None)
+                if task is not None:
+                    tasks.append(task)
+        await self._close_all(tasks)
+
+    async def close(self) -> None:
+        tasks = list(self._producers.values())
+        self._producers.clear()
+        self._symbol_topics.clear()
+        await self._close_all(tasks)
+
+    @staticmethod
+    async def _close_all(tasks: Iterable[asyncio.Task]) -> None:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for producer in results:
+            if isinstance(producer, Producer):
+                await asyncio.to_thread(producer.close)
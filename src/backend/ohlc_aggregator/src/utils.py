@@ -4,3 +4,17 @@ from datetime import datetime, timezone
 def timestamp_to_datetime(v: int) -> datetime:
     """Convert the UTC Unix timestamp (ms) to a datetime object"""
     return datetime.fromtimestamp(v / 1000, tz=timezone.utc)
+
+
+def epoch_seconds(v: datetime | int) -> int:
+    """Convert a datetime or UTC Unix timestamp (ms) to whole epoch seconds"""
+    if isinstance(v, datetime):
+        return int(v.timestamp())
+    return v // 1000
+
+
+def epoch_millis(v: datetime | int) -> int:
+    """Convert a datetime or UTC Unix timestamp (ms) to epoch milliseconds"""
+    if isinstance(v, datetime):
+        return int(v.timestamp() * 1000)
+    return v
@@ -0,0 +1,153 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+
+from src.aggregator import OHLCAggregator
+from src.checkpoint import ClosedWindows
+from src.models import OHLC
+from src.time_window import TimeWindow
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# How often the heap is checked for due symbols, bounds how late a candle can be on top of the lateness
+TICK_S = 0.1
+
+
+class WindowCloser:
+    """Emits candles when their window ends instead of on the symbol's next trade.
+
+    Every symbol with open windows has one entry in a heap of next-close
+    times, so a tick only looks at the symbols that are due. A window is
+    emitted once the watermark passes its end plus allowed_lateness_ms;
+    trades for it arriving later are dropped from the candle, and the
+    aggregator emitting the same window on the next trade is suppressed
+    through already_closed.
+
+    The watermark is the newest trade time seen, advanced by the wall clock
+    since it was seen. Live, that is the wall clock; while catching up on a
+    backlog it follows the trades, so windows are not closed early.
+    """
+
+    def __init__(
+        self,
+        aggregator: OHLCAggregator,
+        publish: Callable[[str, List[Tuple[TimeWindow, OHLC]], int], Awaitable[None]],
+        allowed_lateness_ms: int = 2000
+    ):
+        self.aggregator = aggregator
+        self.publish = publish
+        self.lateness_s = allowed_lateness_ms / 1000
+        self._first_timeframe = min(aggregator.timeframes, key=lambda timeframe: timeframe.get_window_bounds(0)[1])
+        self._heap: List[Tuple[float, str]] = []
+        # Next close time per scheduled symbol, heap entries not matching it are stale
+        self._deadlines: Dict[str, float] = {}
+        # Start of the last window emitted by the timer per symbol/timeframe
+        self._closed: ClosedWindows = {}
+        self._event_time: int | None = None
+        self._event_seen_at = 0.0
+        self._task: asyncio.Task | None = None
+
+    def touch(self, symbol: str, timestamp: int) -> None:
+        """Schedule symbol after a trade at timestamp (epoch seconds) unless it is due sooner already"""
+        if self._event_time is None or timestamp > self._event_time:
+            self._event_time = timestamp
+            self._event_seen_at = time.time()
+        # The shortest timeframe closes first, the exact windows are worked out when it is due
+        _, end = self._first_timeframe.get_window_bounds(timestamp)
+        close_at = end + self.lateness_s
+        deadline = self._deadlines.get(symbol)
+        if deadline is None or close_at < deadline:
+            self._deadlines[symbol] = close_at
+            heapq.heappush(self._heap, (close_at, symbol))
+
+    def already_closed(self, symbol: str, timeframe: TimeWindow, ohlc: OHLC) -> bool:
+        closed = self._closed.get((symbol, timeframe))
+        return closed is not None and ohlc.time <= closed
+
+    def export_closed(self) -> ClosedWindows:
+        return dict(self._closed)
+
+    def import_closed(self, closed: ClosedWindows) -> None:
+        """Restore the windows already emitted, so they are not emitted again after a restart"""
+        self._closed.update(closed)
+
+    def forget(self, symbols: Iterable[str]) -> None:
+        """Drop what is kept for evicted symbols, their heap entries go stale"""
+        symbols = set(symbols)
+        for symbol in symbols:
+            self._deadlines.pop(symbol, None)
+        for key in [key for key in self._closed if key[0] in symbols]:
+            del self._closed[key]
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._tick_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def watermark(self, now: float | None = None) -> float | None:
+        if self._event_time is None:
+            return None
+        now = time.time() if now is None else now
+        return self._event_time + max(now - self._event_seen_at, 0.0)
+
+    async def close_due(self, now: float | None = None) -> int:
+        """Emit every window that is due at wall-clock time now (epoch seconds), returning how many"""
+        watermark = self.watermark(now)
+        if watermark is None:
+            return 0
+        # Candles per symbol and window end, published together
+        due: Dict[Tuple[str, int], List[Tuple[TimeWindow, OHLC]]] = {}
+        count = 0
+        while self._heap and self._heap[0][0] <= watermark:
+            deadline, symbol = heapq.heappop(self._heap)
+            if self._deadlines.get(symbol) != deadline:
+                continue
+            next_close = None
+            # Only the due windows are turned into candles
+            for index, bounds in enumerate(self.aggregator.window_bounds(symbol)):
+                if bounds is None:
+                    continue
+                start, end = bounds
+                timeframe = self.aggregator.timeframes[index]
+                closed = self._closed.get((symbol, timeframe))
+                if closed is not None and start <= closed:
+                    continue
+                close_at = end + self.lateness_s
+                if close_at <= watermark:
+                    # Marked before publishing, a trade processed meanwhile must not emit it again
+                    self._closed[(symbol, timeframe)] = start
+                    due.setdefault((symbol, end), []).append((timeframe, self.aggregator.get_window(symbol, index)))
+                    count += 1
+                elif next_close is None or close_at < next_close:
+                    next_close = close_at
+            if next_close is None:
+                del self._deadlines[symbol]
+            else:
+                self._deadlines[symbol] = next_close
+                heapq.heappush(self._heap, (next_close, symbol))
+
+        for (symbol, end), candles in due.items():
+            # The window end stands in for the trade time the lag is measured from
+            await self.publish(symbol, candles, end * 1000)
+        return count
+
+    async def _tick_loop(self) -> None:
+        while True:
+            await asyncio.sleep(TICK_S)
+            try:
+                await self.close_due()
+            except Exception as e:
+                logger.error(f"Error closing due windows: {e}", exc_info=True)
@@ -0,0 +1,246 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+import time
+from typing import List, Sequence, Tuple
+
+from clickhouse_connect.driver.exceptions import DatabaseError, OperationalError
+
+from src.metrics import (
+    CLICKHOUSE_BACKPRESSURE_WAITS, CLICKHOUSE_FLUSH_SECONDS, CLICKHOUSE_FLUSHES_FAILED, CLICKHOUSE_ROWS_DROPPED,
+    CLICKHOUSE_ROWS_WRITTEN
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+OHLC_COLUMN_NAMES = [
+    'symbol',
+    'timeframe_size',
+    'timeframe_unit',
+    'time',
+    'open',
+    'high',
+    'low',
+    'close',
+]
+
+# Rough wire size of the fixed-width columns (UInt32, DateTime, 4x Float64)
+_FIXED_ROW_BYTES = 4 + 4 + 4 * 8
+_RETRY_DELAY_S = 1.0
+# Consecutive rejections of the pending rows before they are split to isolate the bad ones
+_MAX_REJECTIONS = 5
+
+
+def _is_rejection(error: Exception) -> bool:
+    """Whether the insert failed on the rows themselves rather than on reaching ClickHouse"""
+    if isinstance(error, OperationalError):
+        return False
+    # Server-side errors, or values the driver could not serialize
+    return isinstance(error, (DatabaseError, TypeError, ValueError))
+
+
+@dataclass
+class WriteBufferMetrics:
+    buffered_rows: int = 0
+    buffered_bytes: int = 0
+    flushes: int = 0
+    failed_flushes: int = 0
+    flushed_rows: int = 0
+    dropped_rows: int = 0
+    last_flush_latency_s: float = 0.0
+    max_flush_latency_s: float = 0.0
+    backpressure_waits: int = 0
+
+
+class ClickhouseWriteBuffer:
+    """Write-behind buffer sending candles to ClickHouse as columnar inserts.
+
+    Rows are flushed once max_rows or max_bytes is reached or the oldest row
+    is older than max_age_ms. add() blocks while capacity_rows are pending so
+    the message loop slows down instead of growing memory when ClickHouse lags.
+
+    Failed inserts are retried, indefinitely while ClickHouse cannot be
+    reached. Rows ClickHouse keeps rejecting (schema or type errors) would
+    otherwise block the buffer for good: after _MAX_REJECTIONS in a row the
+    pending rows are inserted in halves, down to single rows, and the rows
+    still rejected are logged and dropped.
+    """
+
+    def __init__(
+        self,
+        clickhouse_client,
+        table: str,
+        max_rows: int = 10_000,
+        max_bytes: int = 4 * 1024 * 1024,
+        max_age_ms: int = 1000,
+        capacity_rows: int = 100_000,
+        column_names: Sequence[str] = OHLC_COLUMN_NAMES
+    ) -> None:
+        self.client = clickhouse_client
+        self.table = table
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_ms / 1000
+        self.capacity_rows = max(capacity_rows, max_rows)
+        self.column_names = list(column_names)
+        self.metrics = WriteBufferMetrics()
+        self._columns: List[list] = [[] for _ in self.column_names]
+        self._oldest: float | None = None
+        self._changed = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._rejections = 0
+        self._task: asyncio.Task | None = None
+        self._is_running = False
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def start(self) -> None:
+        self._is_running = True
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def add(self, row: Tuple) -> None:
+        await self.add_many([row])
+
+    async def add_many(self, rows: Sequence[Tuple]) -> None:
+        """Append rows under a single lock acquisition, waiting for capacity first if it is used up"""
+        async with self._changed:
+            if self.metrics.buffered_rows >= self.capacity_rows:
+                self.metrics.backpressure_waits += 1
+                CLICKHOUSE_BACKPRESSURE_WAITS.inc()
+                await self._changed.wait_for(lambda: self.metrics.buffered_rows < self.capacity_rows)
+
+            for row in rows:
+                for column, value in zip(self._columns, row):
+                    column.append(value)
+                self.metrics.buffered_bytes += _FIXED_ROW_BYTES + len(row[0]) + len(row[2])
+            self.metrics.buffered_rows += len(rows)
+
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._changed.notify_all()
+            elif self._is_full():
+                self._changed.notify_all()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            async with self._changed:
+                if not self.metrics.buffered_rows:
+                    return
+                columns, rows, size = self._columns, self.metrics.buffered_rows, self.metrics.buffered_bytes
+                self._columns = [[] for _ in self.column_names]
+                self._oldest = None
+
+            started = time.perf_counter()
+            try:
+                if self._rejections >= _MAX_REJECTIONS:
+                    dropped = await self._insert_splitting(columns, rows)
+                else:
+                    dropped = 0
+                    await self._insert(columns)
+            except Exception as e:
+                self.metrics.failed_flushes += 1
+                CLICKHOUSE_FLUSHES_FAILED.inc()
+                self._rejections = self._rejections + 1 if _is_rejection(e) else 0
+                async with self._changed:
+                    # Put the rows back in front of anything added meanwhile
+                    self._columns = [old + new for old, new in zip(columns, self._columns)]
+                    self._oldest = time.monotonic()
+                raise
+
+            latency = time.perf_counter() - started
+            self._rejections = 0
+            CLICKHOUSE_FLUSH_SECONDS.observe(latency)
+            CLICKHOUSE_ROWS_WRITTEN.inc(rows - dropped)
+            async with self._changed:
+                self.metrics.buffered_rows -= rows
+                self.metrics.buffered_bytes -= size
+                self.metrics.flushes += 1
+                self.metrics.flushed_rows += rows - dropped
+                self.metrics.dropped_rows += dropped
+                self.metrics.last_flush_latency_s = latency
+                self.metrics.max_flush_latency_s = max(self.metrics.max_flush_latency_s, latency)
+                self._changed.notify_all()
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Flushed {rows} rows to {self.table} in {latency * 1000:.1f} ms")
+
+    async def _insert(self, columns: List[list]) -> None:
+        await self.client.insert(
+            table=self.table,
+            data=columns,
+            column_names=self.column_names,
+            column_oriented=True
+        )
+
+    async def _insert_splitting(self, columns: List[list], rows: int) -> int:
+        """Insert columns in halves until the rejected rows are isolated, returns the number of rows dropped.
+
+        Any other error propagates and the whole batch is retried, so halves
+        already written are written again; ohlc_table replaces duplicate rows.
+        """
+        try:
+            await self._insert(columns)
+            return 0
+        except Exception as e:
+            if not _is_rejection(e):
+                raise
+            if rows == 1:
+                row = tuple(column[0] for column in columns)
+                logger.error(f"Dropping row {row} rejected by {self.table}: {e}")
+                CLICKHOUSE_ROWS_DROPPED.inc()
+                return 1
+
+        half = rows // 2
+        dropped = await self._insert_splitting([column[:half] for column in columns], half)
+        return dropped + await self._insert_splitting([column[half:] for column in columns], rows - half)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            async with self._changed:
+                self._is_running = False
+                self._changed.notify_all()
+            await self._task
+            self._task = None
+
+        await self.flush()
+
+    def _is_full(self) -> bool:
+        return self.metrics.buffered_rows >= self.max_rows or self.metrics.buffered_bytes >= self.max_bytes
+
+    def _time_until_due(self) -> float | None:
+        if self._oldest is None:
+            return None
+        return max(0.0, self.max_age_s - (time.monotonic() - self._oldest))
+
+    def _is_due(self) -> bool:
+        return self._is_full() or self._time_until_due() == 0.0
+
+    async def _flush_loop(self):
+        while self._is_running:
+            async with self._changed:
+                if not self._is_due():
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), self._time_until_due())
+                    except asyncio.TimeoutError:
+                        pass
+                is_due = self._is_due()
+
+            if not self._is_running:
+                break
+            if not is_due:
+                continue
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing {self.metrics.buffered_rows} rows to {self.table}: {e}", exc_info=True)
+                await asyncio.sleep(_RETRY_DELAY_S)
@@ -0,0 +1,28 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from benchmarks.differential import SCENARIOS, compare
+from benchmarks.synthetic import StreamConfig, make_payloads
+from src.decoding import decode_trade_tick
+from src.utils import epoch_seconds
+
+TRADES = 2_000
+
+
+def _trades(scenario: str) -> list:
+    config = StreamConfig(trades=TRADES, seed=42, **SCENARIOS[scenario])
+    return [decode_trade_tick(payload) for payload in make_payloads(config)]
+
+
+@pytest.mark.parametrize('scenario', ['sparse', 'sparse-out-of-order'])
+def test_sparse_streams_cross_a_year(scenario):
+    years = {datetime.fromtimestamp(epoch_seconds(trade.timestamp), timezone.utc).year for trade in _trades(scenario)}
+    assert len(years) > 1
+
+
+@pytest.mark.parametrize('smooth_gaps', [False, True])
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_engines_match_reference(scenario, smooth_gaps):
+    trades = _trades(scenario)
+    assert compare(scenario, trades, smooth_gaps, split=len(trades) // 2) == []
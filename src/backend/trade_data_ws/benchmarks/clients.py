@@ -0,0 +1,270 @@
+"""Simulated WebSocket clients of the load test."""
+import asyncio
+from dataclasses import dataclass, field
+from json import dumps, loads
+import math
+from multiprocessing.synchronize import Event
+import random
+import struct
+import time
+from typing import Dict, List, Tuple
+
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import ConnectionClosed
+
+from benchmarks.feed import raise_fd_limit
+from src.core.protocol import FLAG_CLOSE, FLAG_FULL, PROTOCOL_BINARY, PROTOCOL_JSON
+
+# Client protocol names: the original one-subscription protocol and the two v2 subprotocols
+PROTOCOLS = {'v1': None, 'json': PROTOCOL_JSON, 'binary': PROTOCOL_BINARY}
+
+_FLAGS = struct.Struct('<B')
+_CLOSE = struct.Struct('<d')
+
+
+class LatencyHistogram:
+    """Log-bucketed latencies with 1% resolution from 10 µs to ~100 s, mergeable across processes"""
+
+    MIN_S = 1e-5
+    RATIO = 1.01
+    BUCKETS = 1620
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+        self.max = 0.0
+        self._log_ratio = math.log(self.RATIO)
+
+    def add(self, seconds: float) -> None:
+        if seconds <= self.MIN_S:
+            index = 0
+        else:
+            index = min(int(math.log(seconds / self.MIN_S) / self._log_ratio), self.BUCKETS - 1)
+        self.counts[index] += 1
+        self.total += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p: float) -> float | None:
+        """Upper bound of the bucket holding the p-th latency, in seconds"""
+        if not self.total:
+            return None
+        rank = p * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.MIN_S * self.RATIO ** (index + 1), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float | None]:
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 3)
+        return {
+            'count': self.total,
+            'p50_ms': ms(self.percentile(0.50)),
+            'p90_ms': ms(self.percentile(0.90)),
+            'p99_ms': ms(self.percentile(0.99)),
+            'p999_ms': ms(self.percentile(0.999)),
+            'max_ms': ms(self.max if self.total else None),
+        }
+
+
+@dataclass
+class ClientProfile:
+    """What the simulated clients subscribe to and how often they change it"""
+    symbols: List[str] = field(default_factory=list)
+    # Relative popularity of each symbol, uniform if empty
+    symbol_weights: List[float] = field(default_factory=list)
+    timeframes: List[Tuple[int, str]] = field(default_factory=list)
+    # Protocol per client, assigned round-robin
+    protocols: List[str] = field(default_factory=lambda: ['binary'])
+    # Subscriptions per v2 client, v1 clients always hold one
+    subscriptions: int = 1
+    partial_ratio: float = 0.0
+    # Resubscriptions per second per client, each replaces one subscription
+    churn_per_s: float = 0.0
+    compression: bool = True
+
+
+@dataclass
+class ClientStats:
+    connected: int = 0
+    failed: int = 0
+    disconnected: int = 0
+    messages: int = 0
+    bytes: int = 0
+    resubscriptions: int = 0
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+    # Time from sending a v2 subscribe to its acknowledgement
+    subscribe_latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+
+class SimulatedClient:
+    def __init__(self, url: str, protocol: str, profile: ClientProfile, stats: ClientStats, rng: random.Random):
+        self.url = url
+        self.protocol = protocol
+        self.profile = profile
+        self.stats = stats
+        self.rng = rng
+        self.websocket: ClientConnection | None = None
+        self.subscriptions: Dict[int, dict] = {}
+        self._next_id = 0
+        self._sent_at: Dict[int, float] = {}
+
+    def _draw(self) -> dict:
+        profile = self.profile
+        symbol = self.rng.choices(profile.symbols, profile.symbol_weights or None)[0]
+        size, unit = self.rng.choice(profile.timeframes)
+        subscription = {'symbol': symbol, 'timeframe': {'size': size, 'unit': unit}}
+        if self.rng.random() < profile.partial_ratio:
+            subscription['partial'] = True
+        return subscription
+
+    async def _subscribe(self) -> None:
+        if self.protocol == 'v1':
+            await self.websocket.send(dumps(self._draw()))
+            return
+        held = {(s['symbol'], s['timeframe']['size'], s['timeframe']['unit']) for s in self.subscriptions.values()}
+        for _ in range(10):
+            subscription = self._draw()
+            # The gateway refuses a second subscription to the same stream
+            if (subscription['symbol'], subscription['timeframe']['size'], subscription['timeframe']['unit']) not in held:
+                break
+        else:
+            return
+        self._next_id += 1
+        self.subscriptions[self._next_id] = subscription
+        self._sent_at[self._next_id] = time.perf_counter()
+        await self.websocket.send(dumps({'op': 'subscribe', 'id': self._next_id, **subscription}))
+
+    async def _resubscribe(self) -> None:
+        if self.protocol != 'v1' and self.subscriptions:
+            subscription_id = self.rng.choice(list(self.subscriptions))
+            del self.subscriptions[subscription_id]
+            await self.websocket.send(dumps({'op': 'unsubscribe', 'id': subscription_id}))
+        await self._subscribe()
+        self.stats.resubscriptions += 1
+
+    def _on_message(self, message: str | bytes, received_at: float) -> None:
+        stats = self.stats
+        stats.messages += 1
+        stats.bytes += len(message)
+        if isinstance(message, bytes):
+            flags = _FLAGS.unpack_from(message)[0]
+            if flags & (FLAG_FULL | FLAG_CLOSE):
+                # The close is the last price of both full and delta frames
+                stats.latency.add(received_at - _CLOSE.unpack_from(message, len(message) - 8)[0])
+            return
+
+        data = loads(message)
+        if self.protocol == 'v1':
+            stats.latency.add(received_at - data['ohlc']['close'])
+        elif 'c' in data:
+            stats.latency.add(received_at - data['c'])
+        elif data.get('op') == 'subscribed':
+            sent_at = self._sent_at.pop(data['id'], None)
+            if sent_at is not None:
+                stats.subscribe_latency.add(time.perf_counter() - sent_at)
+
+    async def run(self, connected: asyncio.Semaphore, stop: asyncio.Event) -> None:
+        subprotocol = PROTOCOLS[self.protocol]
+        try:
+            async with connected:
+                self.websocket = await connect(
+                    self.url,
+                    subprotocols=[subprotocol] if subprotocol else None,
+                    compression='deflate' if self.profile.compression else None,
+                    open_timeout=30,
+                    ping_interval=None
+                )
+        except (OSError, asyncio.TimeoutError) as e:
+            self.stats.failed += 1
+            if self.stats.failed == 1:
+                print(f'Client failed to connect: {e!r}')
+            return
+
+        self.stats.connected += 1
+        churn = None
+        try:
+            for _ in range(1 if self.protocol == 'v1' else self.profile.subscriptions):
+                await self._subscribe()
+            if self.profile.churn_per_s > 0:
+                churn = asyncio.create_task(self._churn_loop())
+            receiver = asyncio.create_task(self._receive_loop())
+            await asyncio.wait([receiver, asyncio.create_task(stop.wait())], return_when=asyncio.FIRST_COMPLETED)
+            receiver.cancel()
+        except ConnectionClosed:
+            self.stats.disconnected += 1
+        finally:
+            if churn is not None:
+                churn.cancel()
+            await self.websocket.close()
+
+    async def _receive_loop(self) -> None:
+        try:
+            async for message in self.websocket:
+                self._on_message(message, time.time())
+        except ConnectionClosed:
+            pass
+        self.stats.disconnected += 1
+
+    async def _churn_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.profile.churn_per_s))
+            try:
+                await self._resubscribe()
+            except ConnectionClosed:
+                return
+
+
+def run_clients(
+    url: str,
+    first: int,
+    count: int,
+    profile: ClientProfile,
+    connect_concurrency: int,
+    seed: int,
+    connected: Event,
+    measure: Event,
+    stop: Event,
+    results
+) -> None:
+    """Process target: run clients first..first + count, put their stats for the measured period on results"""
+    raise_fd_limit()
+    results.put(asyncio.run(_run_clients(url, first, count, profile, connect_concurrency, seed, connected, measure, stop)))
+
+
+async def _run_clients(url, first, count, profile, connect_concurrency, seed, connected, measure, stop) -> ClientStats:
+    stats = ClientStats()
+    stopping = asyncio.Event()
+    semaphore = asyncio.Semaphore(connect_concurrency)
+    clients = [
+        SimulatedClient(url, profile.protocols[index % len(profile.protocols)], profile, stats, random.Random(seed + index))
+        for index in range(first, first + count)
+    ]
+    tasks = [asyncio.create_task(client.run(semaphore, stopping)) for client in clients]
+
+    while stats.connected + stats.failed < count:
+        await asyncio.sleep(0.1)
+    connected.set()
+
+    await asyncio.to_thread(measure.wait)
+    # Only what happens during the measured period counts
+    connected_clients, failed = stats.connected, stats.failed
+    stats = ClientStats(connected=connected_clients, failed=failed)
+    for client in clients:
+        client.stats = stats
+
+    await asyncio.to_thread(stop.wait)
+    stopping.set()
+    result = stats
+    for client in clients:
+        client.stats = ClientStats()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return result
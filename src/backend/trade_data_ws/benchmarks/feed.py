@@ -0,0 +1,141 @@
+"""The gateway process of the load test, fed by generated candles instead of Pulsar."""
+import asyncio
+from dataclasses import dataclass, field
+import logging
+from multiprocessing.synchronize import Event
+import resource
+import time
+from typing import List, Tuple
+
+from websockets.asyncio.server import serve
+
+from src.core import CandleCache, ConnectionManager, RouteKey, select_subprotocol
+from src.handlers.websocket_handler import websocket_handler
+
+# Window lengths for the candle times, months and years only need to be roughly right
+_UNIT_SECONDS = {
+    'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800, 'month': 2592000, 'year': 31536000,
+}
+
+
+@dataclass
+class FeedConfig:
+    symbols: List[str] = field(default_factory=list)
+    timeframes: List[Tuple[int, str]] = field(default_factory=list)
+    # Candles per second across all routes
+    rate: float = 1000.0
+    # Also publish forming candles for every route
+    partial: bool = False
+    tick_s: float = 0.01
+
+
+def feed_route_keys(config: FeedConfig) -> List[RouteKey]:
+    """Every route the feed publishes to, 1-second candles included since v1 clients always need them"""
+    timeframes = list(dict.fromkeys([(1, 'second'), *config.timeframes]))
+    return [
+        (symbol, size, unit, partial)
+        for symbol in config.symbols
+        for size, unit in timeframes
+        for partial in ((False, True) if config.partial else (False,))
+    ]
+
+
+class SyntheticCandleFeed:
+    """Stand-in for PulsarWebSocketForwarder broadcasting generated candles at a fixed rate.
+
+    Candles are serialized like the aggregator does, round-robin over the
+    routes. The close is the wall-clock publish time, so clients can measure
+    publish-to-receive latency from any frame of any protocol, including v2
+    deltas, which carry only the close while open/high/low stay put.
+    """
+
+    def __init__(self, connection_manager: ConnectionManager, config: FeedConfig):
+        self.connection_manager = connection_manager
+        self.config = config
+        self.published = 0
+        self._routes = []
+        for key in feed_route_keys(config):
+            symbol, size, unit, partial = key
+            prefix = f'{{"symbol": "{symbol}", "timeframe": {{"size": {size}, "unit": "{unit}"}}'
+            if partial:
+                prefix += ', "partial": true'
+            self._routes.append((key, size * _UNIT_SECONDS[unit], prefix + ', "ohlc": '))
+        self._task: asyncio.Task | None = None
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._publish_loop())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _publish_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        budget = 0.0
+        position = 0
+        while True:
+            await asyncio.sleep(self.config.tick_s)
+            now = loop.time()
+            budget += (now - last) * self.config.rate
+            last = now
+
+            count = int(budget)
+            budget -= count
+            for _ in range(count):
+                key, length, prefix = self._routes[position]
+                position = (position + 1) % len(self._routes)
+                # Stamped per message, the closed and forming candle of a route share a v2 subscription
+                published_at = time.time()
+                start = int(published_at) // length * length
+                message = f'{prefix}{{"time": {start}, "open": 1.0, "high": 2.0, "low": 0.5, "close": {published_at!r}}}}}'
+                self.connection_manager.broadcast(message, key)
+            self.published += count
+
+
+def raise_fd_limit() -> None:
+    """Allow as many sockets as the hard limit permits"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def run_gateway(host: str, port: int, feed: FeedConfig, max_lag: int, cache_size: int, ready: Event, measure: Event, stop: Event, results) -> None:
+    """Process target: serve the gateway until stop is set, then put its stats on results"""
+    raise_fd_limit()
+    # Every connection and subscription is logged at INFO
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(_serve_gateway(host, port, feed, max_lag, cache_size, ready, measure, stop, results))
+
+
+async def _serve_gateway(host, port, feed_config, max_lag, cache_size, ready, measure, stop, results) -> None:
+    candle_cache = CandleCache(cache_size) if cache_size > 0 else None
+    connection_manager = ConnectionManager(max_lag, candle_cache)
+    async with serve(
+        lambda ws: websocket_handler(ws, connection_manager),
+        host,
+        port,
+        select_subprotocol=select_subprotocol,
+        backlog=4096
+    ):
+        async with SyntheticCandleFeed(connection_manager, feed_config) as feed:
+            ready.set()
+            await asyncio.to_thread(measure.wait)
+            baseline, published = connection_manager.stats(), feed.published
+            started = time.monotonic()
+            await asyncio.to_thread(stop.wait)
+            elapsed = time.monotonic() - started
+            stats = connection_manager.stats()
+            results.put({
+                'seconds': elapsed,
+                'published': feed.published - published,
+                'clients': stats.clients,
+                'sent': stats.sent - baseline.sent,
+                'conflated': stats.dropped - baseline.dropped,
+                'slow_disconnects': stats.slow_disconnects - baseline.slow_disconnects,
+                'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            })
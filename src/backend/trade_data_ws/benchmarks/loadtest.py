@@ -0,0 +1,238 @@
+"""Load test of the WebSocket gateway on a single machine.
+
+Starts the gateway in its own process with a synthetic candle feed in place
+of Pulsar, then opens --clients WebSocket connections spread over
+--client-processes processes. Clients subscribe to symbols and timeframes
+drawn from the configured distribution and optionally resubscribe at
+--churn. After --warmup-s, everything is measured for --duration-s:
+publish-to-receive latency percentiles, messages/s on both ends, and the
+gateway's resident memory. No external services are needed.
+
+Run from the service root:
+
+    python -m benchmarks.loadtest --clients 2000 --symbols 50 --rate 2000 --protocol binary --protocol v1 --churn 0.05
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from benchmarks.clients import PROTOCOLS, ClientProfile, ClientStats, run_clients
+from benchmarks.feed import FeedConfig, feed_route_keys, run_gateway
+
+# How often the gateway's memory is sampled while measuring
+RSS_SAMPLE_INTERVAL_S = 0.5
+
+
+def parse_timeframe(value: str) -> Tuple[int, str]:
+    """'5m' style timeframe as (size, unit)"""
+    units = {'s': 'second', 'm': 'minute', 'h': 'hour', 'd': 'day', 'w': 'week', 'M': 'month', 'y': 'year'}
+    if len(value) < 2 or value[-1] not in units or not value[:-1].isdigit():
+        raise argparse.ArgumentTypeError(f"Invalid timeframe {value!r}, expected e.g. 1s, 5m, 4h, 1d")
+    return int(value[:-1]), units[value[-1]]
+
+
+def symbol_weights(count: int, distribution: str, zipf_s: float) -> List[float]:
+    if distribution == 'uniform':
+        return []
+    # A few symbols draw most of the subscriptions, like real markets
+    return [1 / (rank ** zipf_s) for rank in range(1, count + 1)]
+
+
+def rss_kb(pid: int) -> int | None:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_for(events, timeout_s: float, processes) -> bool:
+    deadline = time.monotonic() + timeout_s
+    while not all(event.is_set() for event in events):
+        if time.monotonic() >= deadline or any(not process.is_alive() for process in processes):
+            return False
+        time.sleep(0.1)
+    return True
+
+
+def run(args) -> Dict[str, dict]:
+    symbols = [f'SYM{i:04d}USDT' for i in range(args.symbols)]
+    feed = FeedConfig(symbols=symbols, timeframes=args.timeframe, rate=args.rate, partial=args.partial_ratio > 0)
+    profile = ClientProfile(
+        symbols=symbols,
+        symbol_weights=symbol_weights(args.symbols, args.distribution, args.zipf_s),
+        timeframes=args.timeframe,
+        protocols=args.protocol,
+        subscriptions=args.subscriptions,
+        partial_ratio=args.partial_ratio,
+        churn_per_s=args.churn,
+        compression=not args.no_compression
+    )
+
+    context = multiprocessing.get_context('spawn')
+    gateway_ready, measure, stop = context.Event(), context.Event(), context.Event()
+    gateway_results, client_results = context.Queue(), context.Queue()
+    gateway = context.Process(
+        target=run_gateway,
+        args=(args.host, args.port, feed, args.max_lag, args.cache_size, gateway_ready, measure, stop, gateway_results),
+        name='loadtest-gateway'
+    )
+    gateway.start()
+    processes = [gateway]
+    try:
+        if not wait_for([gateway_ready], 30, processes):
+            raise RuntimeError("Gateway did not start")
+        rss_idle = rss_kb(gateway.pid)
+
+        client_processes = max(1, min(args.client_processes, args.clients))
+        connected = []
+        started_connecting = time.monotonic()
+        for index in range(client_processes):
+            first = args.clients * index // client_processes
+            count = args.clients * (index + 1) // client_processes - first
+            event = context.Event()
+            connected.append(event)
+            process = context.Process(
+                target=run_clients,
+                args=(
+                    f'ws://{args.host}:{args.port}', first, count, profile,
+                    args.connect_concurrency, args.seed, event, measure, stop, client_results
+                ),
+                name=f'loadtest-clients-{index}'
+            )
+            process.start()
+            processes.append(process)
+        if not wait_for(connected, args.connect_timeout_s, processes):
+            raise RuntimeError("Clients did not finish connecting")
+        connect_seconds = time.monotonic() - started_connecting
+        print(f'{args.clients} clients connecting took {connect_seconds:.1f}s, warming up for {args.warmup_s}s', file=sys.stderr)
+        time.sleep(args.warmup_s)
+        rss_connected = rss_kb(gateway.pid)
+
+        measure.set()
+        rss_samples = []
+        deadline = time.monotonic() + args.duration_s
+        while time.monotonic() < deadline:
+            time.sleep(RSS_SAMPLE_INTERVAL_S)
+            sample = rss_kb(gateway.pid)
+            if sample is not None:
+                rss_samples.append(sample)
+        stop.set()
+
+        server = gateway_results.get(timeout=60)
+        clients = ClientStats()
+        for _ in range(client_processes):
+            stats: ClientStats = client_results.get(timeout=60)
+            for name in ('connected', 'failed', 'disconnected', 'messages', 'bytes', 'resubscriptions'):
+                setattr(clients, name, getattr(clients, name) + getattr(stats, name))
+            clients.latency.merge(stats.latency)
+            clients.subscribe_latency.merge(stats.subscribe_latency)
+    finally:
+        measure.set()
+        stop.set()
+        for process in processes:
+            process.join(30)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    seconds = server['seconds']
+    connected_clients = max(clients.connected, 1)
+    return {
+        'clients': {
+            'connected': clients.connected,
+            'failed': clients.failed,
+            'disconnected': clients.disconnected,
+            'connect_seconds': round(connect_seconds, 2),
+            'messages': clients.messages,
+            'messages_per_s': round(clients.messages / seconds, 1),
+            'bytes_per_s': round(clients.bytes / seconds, 1),
+            'resubscriptions_per_s': round(clients.resubscriptions / seconds, 1),
+            'latency': clients.latency.summary(),
+            'subscribe_latency': clients.subscribe_latency.summary(),
+        },
+        'gateway': {
+            'routes': len(feed_route_keys(feed)),
+            'published_per_s': round(server['published'] / seconds, 1),
+            'sent_per_s': round(server['sent'] / seconds, 1),
+            'conflated_per_s': round(server['conflated'] / seconds, 1),
+            'slow_disconnects': server['slow_disconnects'],
+            'rss_idle_mb': round(rss_idle / 1024, 1) if rss_idle else None,
+            'rss_connected_mb': round(rss_connected / 1024, 1) if rss_connected else None,
+            'rss_peak_mb': round(max(rss_samples) / 1024, 1) if rss_samples else None,
+            'max_rss_mb': round(server['max_rss_kb'] / 1024, 1),
+            'rss_per_client_kb': round((rss_connected - rss_idle) / connected_clients, 1) if rss_idle and rss_connected else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--client-processes', type=int, default=max(1, (multiprocessing.cpu_count() - 1) // 2),
+                        help='processes the clients are spread over')
+    parser.add_argument('--connect-concurrency', type=int, default=100, help='handshakes in flight per client process')
+    parser.add_argument('--symbols', type=int, default=50)
+    parser.add_argument('--timeframe', type=parse_timeframe, action='append',
+                        help='timeframe clients subscribe to, e.g. 1m (repeatable, default 1s 1m 5m 1h)')
+    parser.add_argument('--distribution', choices=['uniform', 'zipf'], default='zipf', help='symbol popularity')
+    parser.add_argument('--zipf-s', type=float, default=1.1)
+    parser.add_argument('--protocol', choices=sorted(PROTOCOLS), action='append',
+                        help='client protocol, clients alternate when repeated (default binary)')
+    parser.add_argument('--subscriptions', type=int, default=3, help='subscriptions per v2 client')
+    parser.add_argument('--partial-ratio', type=float, default=0.0, help='share of subscriptions to forming candles')
+    parser.add_argument('--churn', type=float, default=0.0, help='resubscriptions per second per client')
+    parser.add_argument('--rate', type=float, default=1000.0, help='candles per second published by the feed')
+    parser.add_argument('--no-compression', action='store_true', help='connect without permessage-deflate')
+    parser.add_argument('--max-lag', type=int, default=1000, help='CLIENT_MAX_LAG of the gateway')
+    parser.add_argument('--cache-size', type=int, default=500, help='CANDLE_CACHE_SIZE of the gateway')
+    parser.add_argument('--warmup-s', type=float, default=5.0)
+    parser.add_argument('--duration-s', type=float, default=30.0)
+    parser.add_argument('--connect-timeout-s', type=float, default=300.0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18765)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+    args.timeframe = args.timeframe or [(1, 'second'), (1, 'minute'), (5, 'minute'), (1, 'hour')]
+    args.protocol = args.protocol or ['binary']
+
+    results = run(args)
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': multiprocessing.cpu_count(),
+            'args': {name: value for name, value in vars(args).items() if name != 'output'},
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,20 @@
-from src.core.connection_manager import ConnectionManager, Subscription
+from src.core.candle_cache import CandleCache
+from src.core.connection_manager import ConnectionManager, OutboundStats, Subscription
+from src.core.outbound import ClientQueue
+from src.core.protocol import SUBPROTOCOLS, StreamEncoder, select_subprotocol
+from src.core.routing import RouteKey, RouteListener, parse_route_key, route_key_from_properties
 
-__all__ = ['ConnectionManager', 'Subscription']
+__all__ = [
+    'CandleCache',
+    'ClientQueue',
+    'ConnectionManager',
+    'OutboundStats',
+    'Subscription',
+    'RouteKey',
+    'RouteListener',
+    'parse_route_key',
+    'route_key_from_properties',
+    'select_subprotocol',
+    'StreamEncoder',
+    'SUBPROTOCOLS',
+]
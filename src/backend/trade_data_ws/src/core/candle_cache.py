@@ -0,0 +1,94 @@
+from array import array
+from collections import OrderedDict
+from typing import List, Tuple
+
+from websockets.typing import Data
+
+from src.core.protocol import decode_candle
+from src.core.routing import RouteKey
+
+# (symbol, timeframe size, timeframe unit)
+CandleKey = Tuple[str, int, str]
+CandleRow = Tuple[int, float, float, float, float]
+
+
+class CandleRing:
+    """Fixed size ring of the most recent closed candles of one symbol/timeframe"""
+
+    __slots__ = ('capacity', 'times', 'opens', 'highs', 'lows', 'closes', 'head', 'count')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = array('q', bytes(8 * capacity))
+        self.opens = array('d', bytes(8 * capacity))
+        self.highs = array('d', bytes(8 * capacity))
+        self.lows = array('d', bytes(8 * capacity))
+        self.closes = array('d', bytes(8 * capacity))
+        # Slot the next candle is written to
+        self.head = 0
+        self.count = 0
+
+    def append(self, time: int, open: float, high: float, low: float, close: float) -> None:
+        last = (self.head - 1) % self.capacity
+        if self.count and self.times[last] == time:
+            # A repeated window replaces the stored one
+            slot = last
+        elif self.count and self.times[last] > time:
+            return
+        else:
+            slot = self.head
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+        self.times[slot] = time
+        self.opens[slot] = open
+        self.highs[slot] = high
+        self.lows[slot] = low
+        self.closes[slot] = close
+
+    def last(self, n: int) -> List[CandleRow]:
+        """Up to n most recent candles, oldest first"""
+        n = min(n, self.count)
+        slots = [(self.head - n + i) % self.capacity for i in range(n)]
+        return [(self.times[i], self.opens[i], self.highs[i], self.lows[i], self.closes[i]) for i in slots]
+
+
+class CandleCache:
+    """Recent closed candles per symbol/timeframe, for clients that load history from the gateway.
+
+    Holds at most max_keys rings of capacity candles each; when full, the
+    symbol/timeframe least recently written or read is evicted. Decoding every
+    forwarded candle is too costly for the gateway, so only symbol/timeframes
+    that are subscribed to or were asked for history are cached: the first
+    history request of a key starts its ring and gets nothing back.
+    """
+
+    def __init__(self, capacity: int = 500, max_keys: int = 10_000):
+        self.capacity = capacity
+        self.max_keys = max_keys
+        # Least recently used first
+        self._rings: OrderedDict[CandleKey, CandleRing] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def __contains__(self, key: CandleKey) -> bool:
+        return key in self._rings
+
+    def _track(self, key: CandleKey) -> CandleRing:
+        ring = self._rings.get(key)
+        if ring is None:
+            if len(self._rings) >= self.max_keys:
+                self._rings.popitem(last=False)
+            ring = self._rings[key] = CandleRing(self.capacity)
+        else:
+            self._rings.move_to_end(key)
+        return ring
+
+    def add(self, key: RouteKey, message: Data) -> None:
+        ring = self._track(key[:3])
+        candle = decode_candle(message)
+        ring.append(candle.time, candle.open, candle.high, candle.low, candle.close)
+
+    def last(self, key: CandleKey, n: int) -> List[CandleRow]:
+        """Up to n most recent candles of key, oldest first; starts caching key if it was not"""
+        return self._track(key).last(n)
@@ -1,13 +1,15 @@
-from asyncio import Lock
-from collections import defaultdict
+from asyncio import get_running_loop, Lock, sleep
 from dataclasses import dataclass
-from json import loads
 import logging
-from typing import DefaultDict, Set, Tuple
+from typing import Callable, Dict, FrozenSet, List, Tuple
 
-from websockets.asyncio.server import broadcast as ws_broadcast, ServerConnection
+from websockets.asyncio.server import ServerConnection
 from websockets.typing import Data
 
+from src.core.candle_cache import CandleCache
+from src.core.outbound import ClientQueue
+from src.core.routing import RouteKey, RouteListener, parse_route_key
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -19,6 +21,7 @@ logger = logging.getLogger(__name__)
 class Subscription:
     symbol: str
     timeframe: Tuple[int, str]
+    partial: bool
 
     def __init__(self, data: dict):
         symbol = data.get("symbol")
@@ -35,74 +38,188 @@ class Subscription:
         if not isinstance(unit, str):
             raise ValueError("Invalid timeframe: 'unit' must be a string")
 
+        partial = data.get("partial", False)
+        if not isinstance(partial, bool):
+            raise ValueError("Invalid partial: must be a boolean")
+
         object.__setattr__(self, 'symbol', symbol)
         object.__setattr__(self, 'timeframe', (size, unit))
+        object.__setattr__(self, 'partial', partial)
+
+    @property
+    def key(self) -> RouteKey:
+        return self.symbol, self.timeframe[0], self.timeframe[1], False
+
+    @property
+    def stream_keys(self) -> Tuple[RouteKey, ...]:
+        """Routes of a v2 protocol subscription, which never needs the 1-second fan-out"""
+        if self.partial:
+            return self.key, (self.symbol, self.timeframe[0], self.timeframe[1], True)
+        return (self.key,)
+
+    @property
+    def route_keys(self) -> Tuple[RouteKey, ...]:
+        """Every route the subscriber needs: closed candles plus the forming candle source"""
+        if self.partial:
+            return self.key, (self.symbol, self.timeframe[0], self.timeframe[1], True)
+        if self.requires_one_second_updates():
+            return self.key, self.as_one_second_subscription().key
+        return (self.key,)
 
     def requires_one_second_updates(self) -> bool:
-        return self.timeframe != (1, "second")
+        # Clients receiving partial updates get their forming candle directly
+        return not self.partial and self.timeframe != (1, "second")
 
     def as_one_second_subscription(self):
         return Subscription({"symbol": self.symbol, "timeframe": {"size": 1, "unit": "second"}})
 
 
+@dataclass
+class OutboundStats:
+    clients: int = 0
+    queued: int = 0
+    sent: int = 0
+    dropped: int = 0
+    slow_disconnects: int = 0
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Set[ServerConnection] = set()
-        self.subscriptions: DefaultDict[Subscription, Set[ServerConnection]] = defaultdict(set)
+    def __init__(self, max_lag: int = 1000, candle_cache: CandleCache | None = None):
+        self.max_lag = max_lag
+        self.candle_cache = candle_cache
+        self.active_connections: Dict[ServerConnection, ClientQueue] = {}
+        # Copy-on-write: subscriber sets are never mutated in place, so
+        # broadcast can read them without taking the lock
+        self.routes: Dict[RouteKey, FrozenSet[ClientQueue]] = {}
         self.lock = Lock()
-
-    async def connect(self, websocket: ServerConnection) -> None:
+        self._route_listeners: List[RouteListener] = []
+        # Last message seen per subscribed route, the snapshot for new v2
+        # subscriptions; dropped along with the route's last subscriber
+        self.latest: Dict[RouteKey, Data] = {}
+        # Counters of connections that are already gone
+        self._closed_stats = OutboundStats()
+
+    def add_route_listener(self, listener: RouteListener) -> None:
+        self._route_listeners.append(listener)
+        for key in self.routes:
+            listener(key, True)
+
+    def stats(self) -> OutboundStats:
+        stats = OutboundStats(
+            clients=len(self.active_connections),
+            sent=self._closed_stats.sent,
+            dropped=self._closed_stats.dropped,
+            slow_disconnects=self._closed_stats.slow_disconnects
+        )
+        # Copied first, metrics scrapes call this from another thread
+        for client in list(self.active_connections.values()):
+            stats.queued += client.depth
+            stats.sent += client.sent
+            stats.dropped += client.dropped
+        return stats
+
+    async def drain(self, timeout_s: float) -> bool:
+        """Wait until every client's queue is flushed, returns False on timeout"""
+        loop = get_running_loop()
+        deadline = loop.time() + timeout_s
+        while any(client.depth for client in self.active_connections.values()):
+            if loop.time() >= deadline:
+                return False
+            await sleep(0.05)
+        return True
+
+    async def connect(self, websocket: ServerConnection, encode: Callable[[RouteKey, Data], Data | None] | None = None) -> None:
         async with self.lock:
-            self.active_connections.add(websocket)
+            self.active_connections[websocket] = ClientQueue(websocket, self.max_lag, encode)
 
         client_info = f'{websocket.remote_address[0]}:{websocket.remote_address[1]}'
         logger.info(f'New connection: {client_info}')
 
     async def disconnect(self, websocket: ServerConnection) -> None:
         async with self.lock:
-            self.active_connections.discard(websocket)
+            client = self.active_connections.pop(websocket, None)
+
+        if client is not None:
+            await client.close()
+            self._closed_stats.sent += client.sent
+            self._closed_stats.dropped += client.dropped
+            self._closed_stats.slow_disconnects += client.too_slow
 
         client_info = f'{websocket.remote_address[0]}:{websocket.remote_address[1]}'
         logger.info(f'Removed connection: {client_info}')
 
-    async def subscribe(self, websocket: ServerConnection, subscription: Subscription):
+    def _add_route(self, key: RouteKey, client: ClientQueue) -> None:
+        clients = self.routes.get(key)
+        if clients is None:
+            self.routes[key] = frozenset((client,))
+            for listener in self._route_listeners:
+                listener(key, True)
+        else:
+            self.routes[key] = clients | {client}
+
+    def _remove_route(self, key: RouteKey, client: ClientQueue) -> None:
+        clients = self.routes.get(key)
+        if clients is None or client not in clients:
+            return
+        remaining = clients - {client}
+        if remaining:
+            self.routes[key] = remaining
+        else:
+            del self.routes[key]
+            self.latest.pop(key, None)
+            for listener in self._route_listeners:
+                listener(key, False)
+
+    async def subscribe(
+        self,
+        websocket: ServerConnection,
+        subscription: Subscription,
+        keys: Tuple[RouteKey, ...] | None = None,
+        snapshot: bool = False
+    ):
         async with self.lock:
-            self.subscriptions[subscription].add(websocket)
-
-            if subscription.requires_one_second_updates():
-                one_second_subscription = subscription.as_one_second_subscription()
-                if websocket not in self.subscriptions[one_second_subscription]:
-                    self.subscriptions[one_second_subscription].add(websocket)
+            client = self.active_connections[websocket]
+            for key in keys or subscription.route_keys:
+                self._add_route(key, client)
+                if snapshot and key in self.latest:
+                    client.put(key, self.latest[key])
 
         client_info = f'{websocket.remote_address[0]}:{websocket.remote_address[1]}'
         logger.info(f'{client_info} subscribed to {subscription}')
 
-    async def unsubscribe(self, websocket: ServerConnection, subscription: Subscription, new_subscription: Subscription = None):
+    async def unsubscribe(
+        self,
+        websocket: ServerConnection,
+        subscription: Subscription,
+        new_subscription: Subscription = None,
+        keys: Tuple[RouteKey, ...] | None = None
+    ):
         async with self.lock:
-            if subscription in self.subscriptions:
-                self.subscriptions[subscription].discard(websocket)
-                if not self.subscriptions[subscription]:
-                    del self.subscriptions[subscription]
-
-            if new_subscription is None or not new_subscription.requires_one_second_updates():
-                one_second_subscription = subscription.as_one_second_subscription()
-                if one_second_subscription in self.subscriptions:
-                    self.subscriptions[one_second_subscription].discard(websocket)
-                    if not self.subscriptions[one_second_subscription]:
-                        del self.subscriptions[one_second_subscription]
+            client = self.active_connections.get(websocket)
+            if client is None:
+                return
+            # Routes the new subscription also needs stay in place, so the client
+            # does not miss updates and the route is not torn down in between
+            kept = new_subscription.route_keys if new_subscription is not None else ()
+            for key in keys or subscription.route_keys:
+                if key not in kept:
+                    self._remove_route(key, client)
 
         client_info = f'{websocket.remote_address[0]}:{websocket.remote_address[1]}'
         logger.info(f'{client_info} unsubscribed from {subscription}')
 
-    async def broadcast(self, message: Data) -> None:
-        message_dict = loads(message)
-        subscription = Subscription(message_dict)
-
-        if subscription in self.subscriptions:
-            async with self.lock:
-                clients = self.subscriptions[subscription]
-                ws_broadcast(clients, message)
-
-            logger.info(f'Broadcasted {subscription} to {len(self.subscriptions[subscription])} client(s)')
-        # else:
-        #     logger.warning(f'No subscriptions found for {subscription}. Skipping broadcast.')
+    def broadcast(self, message: Data, key: RouteKey | None = None) -> int:
+        """Queue message for every subscriber of its route, returns the number of recipients"""
+        if key is None:
+            key = parse_route_key(message)
+        clients = self.routes.get(key)
+        # Decoded for the cache only when the key is subscribed to (v2 clients
+        # share that decode) or its history was asked for
+        if self.candle_cache is not None and not key[3] and (clients or key[:3] in self.candle_cache):
+            self.candle_cache.add(key, message)
+        if not clients:
+            return 0
+        self.latest[key] = message
+        for client in clients:
+            client.put(key, message)
+        return len(clients)
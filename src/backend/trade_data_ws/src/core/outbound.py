@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from typing import Callable, Dict
+
+from websockets.asyncio.server import ServerConnection
+from websockets.exceptions import ConnectionClosed
+from websockets.typing import Data
+
+from src.core.routing import RouteKey
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# "Try Again Later", sent to clients that cannot keep up
+SLOW_CLIENT_CLOSE_CODE = 1013
+# Sent when writing to a client fails for any other reason
+INTERNAL_ERROR_CLOSE_CODE = 1011
+# A stalled client cannot read the close frame either, so don't wait long for the handshake
+CLIENT_CLOSE_TIMEOUT_S = 1.0
+
+
+class ClientQueue:
+    """Conflating outbound queue of a single websocket client.
+
+    Holds at most one pending message per route key; a newer candle for the
+    same key replaces the queued one, since only the latest update matters.
+    A writer task drains the queue as fast as the socket accepts data. A
+    client that receives more than max_lag messages while a single write is
+    still in progress is disconnected.
+    """
+
+    def __init__(
+        self,
+        websocket: ServerConnection,
+        max_lag: int = 1000,
+        encode: Callable[[RouteKey, Data], Data | None] | None = None
+    ):
+        self.websocket = websocket
+        self.max_lag = max_lag
+        # Converts a queued candle into this client's wire format, None skips it
+        self.encode = encode
+        self.pending: Dict[RouteKey, Data] = {}
+        self.sent = 0
+        self.dropped = 0
+        self.lag = 0
+        self.closing = False
+        self.too_slow = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._drain())
+
+    @property
+    def depth(self) -> int:
+        return len(self.pending)
+
+    def put(self, key: RouteKey, message: Data) -> None:
+        if self.closing:
+            return
+        if key in self.pending:
+            self.dropped += 1
+        self.pending[key] = message
+        self.lag += 1
+        if self.lag > self.max_lag:
+            self._disconnect()
+            return
+        self._wakeup.set()
+
+    async def close(self) -> None:
+        self.closing = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.dropped += len(self.pending)
+        self.pending.clear()
+
+    async def _drain(self) -> None:
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.pending:
+                    key = next(iter(self.pending))
+                    message = self.pending.pop(key)
+                    if self.encode is not None:
+                        message = self.encode(key, message)
+                        if message is None:
+                            continue
+                    await self.websocket.send(message)
+                    self.sent += 1
+                    self.lag = 0
+        except ConnectionClosed:
+            self.closing = True
+        except Exception as e:
+            # Encoding or writing failed, the client would otherwise stay connected without updates
+            self.closing = True
+            logger.error(f'Error writing to client {self._client_info()}, disconnecting it: {e}', exc_info=True)
+            self.dropped += len(self.pending)
+            self.pending.clear()
+            await self._close(INTERNAL_ERROR_CLOSE_CODE, 'Internal error')
+
+    def _client_info(self) -> str:
+        return f'{self.websocket.remote_address[0]}:{self.websocket.remote_address[1]}'
+
+    def _disconnect(self) -> None:
+        self.closing = True
+        self.too_slow = True
+        logger.warning(f'Disconnecting slow client {self._client_info()}: {self.lag} messages behind')
+        self.dropped += len(self.pending)
+        self.pending.clear()
+        asyncio.create_task(self._close(SLOW_CLIENT_CLOSE_CODE, 'Client too slow'))
+
+    async def _close(self, code: int, reason: str) -> None:
+        try:
+            await asyncio.wait_for(self.websocket.close(code, reason), CLIENT_CLOSE_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            self.websocket.transport.abort()
@@ -0,0 +1,139 @@
+"""Version 2 of the gateway protocol.
+
+Clients opt in per connection by offering one of SUBPROTOCOLS in the
+WebSocket handshake; connections without a subprotocol keep the original
+one-subscription JSON protocol.
+
+Control messages are JSON text in both directions:
+
+    -> {"op": "subscribe", "id": 1, "symbol": "BTCUSDT", "timeframe": {"size": 5, "unit": "minute"}, "partial": true}
+    -> {"op": "unsubscribe", "id": 1}
+    -> {"op": "history", "id": 2, "symbol": "BTCUSDT", "timeframe": {"size": 5, "unit": "minute"}, "limit": 100}
+    <- {"op": "subscribed", "id": 1}
+    <- {"op": "unsubscribed", "id": 1}
+    <- {"op": "history", "id": 2, "start": 1700000000, "candles": [[time, open, high, low, close], ...]}
+    <- {"op": "error", "id": 1, "error": "..."}
+
+The client picks the id, which tags every candle frame of that
+subscription. The first frame of a subscription is a full snapshot of the
+latest known candle. Later frames carry only the prices that changed while
+the candle time stays the same, and a full candle once a new window starts.
+History replies carry the most recent closed candles the gateway has
+cached, oldest first, and do not create a subscription. The gateway only
+caches a symbol/timeframe while it is subscribed to or after its history was
+first asked for, so that first request gets no candles and a null start.
+
+ohlc.v2.json candle frames are text:
+
+    {"s": 1, "t": 1700000000, "o": 1.0, "h": 2.0, "l": 0.5, "c": 1.5, "p": 1}   full
+    {"s": 1, "h": 2.5, "c": 2.4, "p": 1}                                         delta
+
+"p" is present while the candle is still forming (partial subscriptions only).
+
+ohlc.v2.binary candle frames are binary, little-endian: a header of
+flags (u8) and subscription id (u32), then for a full frame the time
+(i64) and open, high, low, close (f64), or for a delta one f64 per set
+bit of open, high, low, close, in that order.
+"""
+from functools import lru_cache
+from json import dumps, loads
+import struct
+from typing import Dict, NamedTuple, Tuple
+
+from websockets.asyncio.server import ServerConnection
+from websockets.typing import Data
+
+from src.core.routing import RouteKey
+
+PROTOCOL_BINARY = 'ohlc.v2.binary'
+PROTOCOL_JSON = 'ohlc.v2.json'
+SUBPROTOCOLS = [PROTOCOL_BINARY, PROTOCOL_JSON]
+
+FLAG_PARTIAL = 0x01
+FLAG_FULL = 0x02
+FLAG_OPEN = 0x04
+FLAG_HIGH = 0x08
+FLAG_LOW = 0x10
+FLAG_CLOSE = 0x20
+
+_HEADER = struct.Struct('<BI')
+_FULL = struct.Struct('<BIqdddd')
+_PRICE = struct.Struct('<d')
+_PRICE_FIELDS = ((FLAG_OPEN, 'o'), (FLAG_HIGH, 'h'), (FLAG_LOW, 'l'), (FLAG_CLOSE, 'c'))
+
+
+class Candle(NamedTuple):
+    time: int
+    open: float
+    high: float
+    low: float
+    close: float
+    partial: bool
+
+
+def select_subprotocol(connection: ServerConnection, subprotocols) -> str | None:
+    """Pick a v2 subprotocol if offered, otherwise continue with the original protocol"""
+    for subprotocol in SUBPROTOCOLS:
+        if subprotocol in subprotocols:
+            return subprotocol
+    return None
+
+
+@lru_cache(maxsize=4096)
+def decode_candle(message: str) -> Candle:
+    # Every v2 client receiving a message shares one decode
+    data = loads(message)
+    ohlc = data['ohlc']
+    return Candle(ohlc['time'], ohlc['open'], ohlc['high'], ohlc['low'], ohlc['close'], data.get('partial', False))
+
+
+class StreamEncoder:
+    """Encodes the candles of one v2 connection as snapshot and delta frames"""
+
+    def __init__(self, binary: bool):
+        self.binary = binary
+        self.ids: Dict[RouteKey, int] = {}
+        self._last: Dict[int, Candle] = {}
+
+    def add(self, subscription_id: int, keys: Tuple[RouteKey, ...]) -> None:
+        for key in keys:
+            self.ids[key] = subscription_id
+
+    def remove(self, subscription_id: int, keys: Tuple[RouteKey, ...]) -> None:
+        for key in keys:
+            if self.ids.get(key) == subscription_id:
+                del self.ids[key]
+        self._last.pop(subscription_id, None)
+
+    def encode(self, key: RouteKey, message: Data) -> Data | None:
+        subscription_id = self.ids.get(key)
+        if subscription_id is None:
+            return None
+        candle = decode_candle(message)
+        last = self._last.get(subscription_id)
+        if last == candle:
+            return None
+        self._last[subscription_id] = candle
+
+        flags = FLAG_PARTIAL if candle.partial else 0
+        if last is None or last.time != candle.time:
+            flags |= FLAG_FULL
+            if self.binary:
+                return _FULL.pack(flags, subscription_id, candle.time, candle.open, candle.high, candle.low, candle.close)
+            frame = {'s': subscription_id, 't': candle.time, 'o': candle.open, 'h': candle.high, 'l': candle.low, 'c': candle.close}
+        else:
+            changed = [
+                (flag, name, value)
+                for (flag, name), value, previous in zip(_PRICE_FIELDS, candle[1:5], last[1:5])
+                if value != previous
+            ]
+            for flag, _, _ in changed:
+                flags |= flag
+            if self.binary:
+                return _HEADER.pack(flags, subscription_id) + b''.join(_PRICE.pack(value) for _, _, value in changed)
+            frame = {'s': subscription_id}
+            frame.update((name, value) for _, name, value in changed)
+
+        if candle.partial:
+            frame['p'] = 1
+        return dumps(frame, separators=(',', ':'))
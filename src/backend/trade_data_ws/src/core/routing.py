@@ -0,0 +1,28 @@
+from json import loads
+import re
+from typing import Callable, Dict, Tuple
+
+# (symbol, timeframe size, timeframe unit, whether the candle is still forming)
+RouteKey = Tuple[str, int, str, bool]
+# Called with (key, True) when a key gets its first subscriber and (key, False) when it loses its last
+RouteListener = Callable[[RouteKey, bool], None]
+
+# The aggregator always serializes the symbol and timeframe first, so the
+# routing key can be read from the head of the payload without decoding it.
+_HEADER = re.compile(r'\{"symbol": "([^"\\]+)", "timeframe": \{"size": (\d+), "unit": "([a-z]+)"\}(, "partial": true)?')
+
+
+def route_key_from_properties(properties: Dict[str, str]) -> RouteKey | None:
+    try:
+        return properties['symbol'], int(properties['size']), properties['unit'], 'partial' in properties
+    except (KeyError, ValueError):
+        return None
+
+
+def parse_route_key(message: str) -> RouteKey:
+    match = _HEADER.match(message)
+    if match is not None:
+        return match.group(1), int(match.group(2)), match.group(3), match.group(4) is not None
+
+    data = loads(message)
+    return data['symbol'], data['timeframe']['size'], data['timeframe']['unit'], data.get('partial', False)
@@ -1,11 +1,13 @@
-from json import loads
+from json import dumps, loads
 import logging
+from typing import Dict
 
 from websockets.asyncio.server import ServerConnection
 from websockets.exceptions import ConnectionClosed
 # from websockets.protocol import State
 
-from src.core import ConnectionManager, Subscription
+from src.core import ConnectionManager, StreamEncoder, Subscription
+from src.core.protocol import PROTOCOL_BINARY
 
 logging.basicConfig(
     level=logging.INFO,
@@ -18,6 +20,10 @@ async def websocket_handler(
     websocket: ServerConnection,
     connection_manager: ConnectionManager
 ) -> None:
+    if websocket.subprotocol is not None:
+        await stream_handler(websocket, connection_manager)
+        return
+
     client_info = f'{websocket.remote_address[0]}:{websocket.remote_address[1]}'
 
     await connection_manager.connect(websocket)
@@ -45,3 +51,68 @@ async def websocket_handler(
         if current_subscription:
             await connection_manager.unsubscribe(websocket, current_subscription)
         await connection_manager.disconnect(websocket)
+
+
+async def stream_handler(
+    websocket: ServerConnection,
+    connection_manager: ConnectionManager
+) -> None:
+    """Version 2 protocol: any number of subscriptions, each identified by a client chosen id"""
+    client_info = f'{websocket.remote_address[0]}:{websocket.remote_address[1]}'
+
+    encoder = StreamEncoder(binary=websocket.subprotocol == PROTOCOL_BINARY)
+    await connection_manager.connect(websocket, encoder.encode)
+    subscriptions: Dict[int, Subscription] = {}
+
+    try:
+        while True:
+            data = loads(await websocket.recv())
+            op, subscription_id = data.get('op'), data.get('id')
+            try:
+                if not isinstance(subscription_id, int) or not 0 <= subscription_id < 2 ** 32:
+                    raise ValueError("Invalid id: must be an unsigned 32-bit integer")
+
+                if op == 'subscribe':
+                    if subscription_id in subscriptions:
+                        raise ValueError("Subscription id already in use")
+                    subscription = Subscription(data)
+                    if any(key in encoder.ids for key in subscription.stream_keys):
+                        raise ValueError(f"Already subscribed to {subscription.symbol} {subscription.timeframe}")
+                    subscriptions[subscription_id] = subscription
+                    encoder.add(subscription_id, subscription.stream_keys)
+                    await websocket.send(dumps({'op': 'subscribed', 'id': subscription_id}))
+                    await connection_manager.subscribe(websocket, subscription, subscription.stream_keys, snapshot=True)
+
+                elif op == 'history':
+                    if connection_manager.candle_cache is None:
+                        raise ValueError("History is not available")
+                    limit = data.get('limit')
+                    if not isinstance(limit, int) or not 0 < limit <= connection_manager.candle_cache.capacity:
+                        raise ValueError(f"Invalid limit: must be an integer between 1 and {connection_manager.candle_cache.capacity}")
+                    subscription = Subscription(data)
+                    candles = connection_manager.candle_cache.last(subscription.key[:3], limit)
+                    # Clients load what is older than start from elsewhere, None if nothing is cached
+                    start = candles[0][0] if candles else None
+                    await websocket.send(dumps({'op': 'history', 'id': subscription_id, 'start': start, 'candles': candles}))
+
+                elif op == 'unsubscribe':
+                    subscription = subscriptions.pop(subscription_id, None)
+                    if subscription is None:
+                        raise ValueError("Unknown subscription id")
+                    await connection_manager.unsubscribe(websocket, subscription, keys=subscription.stream_keys)
+                    encoder.remove(subscription_id, subscription.stream_keys)
+                    await websocket.send(dumps({'op': 'unsubscribed', 'id': subscription_id}))
+
+                else:
+                    raise ValueError(f"Unknown op: {op}")
+            except ValueError as e:
+                await websocket.send(dumps({'op': 'error', 'id': subscription_id, 'error': str(e)}))
+
+    except ConnectionClosed:
+        logger.info(f'Connection closed: {client_info}')
+    except Exception as e:
+        logger.info(f'Error in WebSocket connection: {e}')
+    finally:
+        for subscription in subscriptions.values():
+            await connection_manager.unsubscribe(websocket, subscription, keys=subscription.stream_keys)
+        await connection_manager.disconnect(websocket)
@@ -1,3 +1,4 @@
+from src.integrations.pulsar_topic_forwarder import PulsarTopicForwarder
 from src.integrations.pulsar_ws_forwarder import PulsarWebSocketForwarder
 
-__all__ = ['PulsarWebSocketForwarder']
+__all__ = ['PulsarTopicForwarder', 'PulsarWebSocketForwarder']
@@ -0,0 +1,144 @@
+import asyncio
+from collections import Counter
+import logging
+import re
+import time
+from typing import Dict
+
+from pulsar import Client, Message, MessageId, Reader
+
+from src.core import ConnectionManager, RouteKey, route_key_from_properties
+from src.metrics import LogSampler, observe_broadcast
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+TOPIC_MODES = ('symbol', 'timeframe')
+
+_INVALID_TOPIC_CHARS = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def topic_name(base_topic: str, mode: str, key: RouteKey) -> str:
+    """Same naming as the ohlc_aggregator per-symbol output topics"""
+    symbol, size, unit, _ = key
+    topic = f'{base_topic}-{_INVALID_TOPIC_CHARS.sub("_", symbol)}'
+    if mode == 'timeframe':
+        topic = f'{topic}-{size}-{unit}'
+    return topic
+
+
+class PulsarTopicForwarder:
+    """Forwards candles from per-symbol topics, reading only the topics someone is subscribed to.
+
+    A reader is opened when a topic gets its first subscribed key and closed
+    once it has had none for grace_period_s, so a client switching timeframes
+    or reconnecting does not tear the reader down and recreate it. Readers
+    start at the latest message and keep no subscription backlog behind.
+    """
+
+    def __init__(
+        self,
+        pulsar_client: Client,
+        connection_manager: ConnectionManager,
+        base_topic: str,
+        mode: str,
+        grace_period_s: float = 30.0
+    ) -> None:
+        if mode not in TOPIC_MODES:
+            raise ValueError(f"Unknown topic mode: {mode}")
+        self.pulsar_client = pulsar_client
+        self.connection_manager = connection_manager
+        self.base_topic = base_topic
+        self.mode = mode
+        self.grace_period_s = grace_period_s
+        self._demand: Counter[str] = Counter()
+        self._readers: Dict[str, asyncio.Task] = {}
+        self._teardowns: Dict[str, asyncio.TimerHandle] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._is_running = False
+        self._error_log_sampler = LogSampler()
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._is_running = True
+        self.connection_manager.add_route_listener(self._on_route_change)
+        return self
+
+    async def __aexit__(self, *exc):
+        # Clients still subscribing while the gateway drains must not reopen readers
+        self._is_running = False
+        for handle in self._teardowns.values():
+            handle.cancel()
+        self._teardowns.clear()
+        await asyncio.gather(*(self._close(topic) for topic in list(self._readers)))
+
+    def _on_route_change(self, key: RouteKey, active: bool) -> None:
+        if not self._is_running:
+            return
+        topic = topic_name(self.base_topic, self.mode, key)
+        if active:
+            self._demand[topic] += 1
+            handle = self._teardowns.pop(topic, None)
+            if handle is not None:
+                handle.cancel()
+            if topic not in self._readers:
+                self._readers[topic] = asyncio.create_task(self._open(topic))
+        else:
+            self._demand[topic] -= 1
+            if self._demand[topic] <= 0:
+                del self._demand[topic]
+                self._teardowns[topic] = self._loop.call_later(self.grace_period_s, self._schedule_close, topic)
+
+    async def _open(self, topic: str) -> Reader | None:
+        try:
+            reader = await asyncio.to_thread(
+                self.pulsar_client.create_reader,
+                topic,
+                MessageId.latest,
+                reader_listener=self._on_message
+            )
+        except Exception as e:
+            # Forget the topic so the next subscriber retries
+            logger.error(f"Error opening reader for {topic}: {e}", exc_info=True)
+            if self._readers.get(topic) is asyncio.current_task():
+                del self._readers[topic]
+            return None
+        logger.info(f"Opened reader for {topic}")
+        return reader
+
+    def _schedule_close(self, topic: str) -> None:
+        self._teardowns.pop(topic, None)
+        if topic not in self._demand:
+            asyncio.create_task(self._close(topic))
+
+    async def _close(self, topic: str) -> None:
+        task = self._readers.pop(topic, None)
+        if task is None:
+            return
+        try:
+            reader = await task
+            if reader is None:
+                return
+            await asyncio.to_thread(reader.close)
+            logger.info(f"Closed reader for {topic}")
+        except Exception as e:
+            logger.error(f"Error closing reader for {topic}: {e}", exc_info=True)
+
+    def _on_message(self, _, message: Message) -> None:
+        # Runs on a Pulsar listener thread
+        self._loop.call_soon_threadsafe(self._forward, message)
+
+    def _forward(self, message: Message) -> None:
+        try:
+            started = time.perf_counter()
+            recipients = self.connection_manager.broadcast(
+                message.data().decode("utf-8"),
+                route_key_from_properties(message.properties())
+            )
+            observe_broadcast(message, recipients, started)
+        except Exception as e:
+            if self._error_log_sampler():
+                logger.error(f"Error forwarding message ({self._error_log_sampler.count} errors so far): {e}", exc_info=True)
@@ -1,9 +1,11 @@
 import asyncio
 import logging
+import time
 
-from pulsar import Client, Message, Consumer, ConsumerType
+from pulsar import Client, Message, MessageId, Consumer, ConsumerType, Reader, Timeout
 
-from src.core import ConnectionManager
+from src.core import ConnectionManager, route_key_from_properties
+from src.metrics import RECEIVE_TO_ACK, LogSampler, observe_broadcast
 
 logging.basicConfig(
     level=logging.INFO,
@@ -11,32 +13,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Blocking receives wake up this often to notice the forwarder is stopping
+_RECEIVE_TIMEOUT_MS = 500
+
 
 class PulsarWebSocketForwarder:
+    """Forwards every candle of topic to the connection manager.
+
+    With a subscription name the topic is consumed through that subscription
+    and acknowledged. Without one it is read from the latest message on,
+    leaving no durable subscription behind, for gateway workers that each
+    need the full stream and have nothing to catch up on after a restart.
+    """
+
     def __init__(
         self,
         pulsar_client: Client,
         connection_manager: ConnectionManager,
         topic: str,
-        subscription_name: str,
-        consumer_type: ConsumerType
+        subscription_name: str | None = None,
+        consumer_type: ConsumerType = ConsumerType.Shared
     ) -> None:
         self.pulsar_client = pulsar_client
         self.connection_manager = connection_manager
         self.topic = topic
         self.subscription_name = subscription_name
         self.consumer_type = consumer_type
-        self.consumer: Consumer | None = None
+        self.consumer: Consumer | Reader | None = None
         self._task: asyncio.Task | None = None
         self._is_running = False
+        self._error_log_sampler = LogSampler()
 
     async def __aenter__(self):
-        self.consumer = await asyncio.to_thread(
-            self.pulsar_client.subscribe,
-            self.topic,
-            self.subscription_name,
-            self.consumer_type
-        )
+        if self.subscription_name is None:
+            self.consumer = await asyncio.to_thread(self.pulsar_client.create_reader, self.topic, MessageId.latest)
+        else:
+            self.consumer = await asyncio.to_thread(
+                self.pulsar_client.subscribe,
+                self.topic,
+                self.subscription_name,
+                self.consumer_type
+            )
         self._is_running = True
         self._task = asyncio.create_task(self._message_loop())
         return self
@@ -55,12 +72,22 @@ class PulsarWebSocketForwarder:
     async def _process_next_message(self):
         message_raw: Message | None = None
         try:
-            message_raw = await asyncio.to_thread(self.consumer.receive)
+            if self.subscription_name is None:
+                message_raw = await asyncio.to_thread(self.consumer.read_next, _RECEIVE_TIMEOUT_MS)
+            else:
+                message_raw = await asyncio.to_thread(self.consumer.receive, _RECEIVE_TIMEOUT_MS)
+            started = time.perf_counter()
             message_str: str = message_raw.data().decode("utf-8")
             # logger.info(f'Received message: {message_str}')
-            await self.connection_manager.broadcast(message_str)
-            await asyncio.to_thread(self.consumer.acknowledge, message_raw)
+            recipients = self.connection_manager.broadcast(message_str, route_key_from_properties(message_raw.properties()))
+            observe_broadcast(message_raw, recipients, started)
+            if self.subscription_name is not None:
+                await asyncio.to_thread(self.consumer.acknowledge, message_raw)
+                RECEIVE_TO_ACK.observe(time.perf_counter() - started)
+        except Timeout:
+            pass
         except Exception as e:
-            logger.error(f"Error processing message: {e}", exc_info=True)
-            if message_raw is not None:
+            if self._error_log_sampler():
+                logger.error(f"Error processing message ({self._error_log_sampler.count} errors so far): {e}", exc_info=True)
+            if message_raw is not None and self.subscription_name is not None:
                 await asyncio.to_thread(self.consumer.negative_acknowledge, message_raw)
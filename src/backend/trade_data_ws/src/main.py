@@ -1,14 +1,18 @@
 import asyncio
 import logging
+from multiprocessing.sharedctypes import SynchronizedArray
 from os import getenv
 from signal import SIGINT, SIGTERM
+import sys
 
 from pulsar import ConsumerType, Client
 from websockets.asyncio.server import serve
 
-from src.core import ConnectionManager
-from src.integrations import PulsarWebSocketForwarder
+from src.core import CandleCache, ConnectionManager, select_subprotocol
+from src.integrations import PulsarTopicForwarder, PulsarWebSocketForwarder
 from src.handlers.websocket_handler import websocket_handler
+from src.metrics import CallbackCounter, Gauge, start_metrics_server
+from src.workers import STATS_FIELDS, run_workers
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,42 +23,140 @@ logger = logging.getLogger(__name__)
 PULSAR_SERVICE_URL = getenv('PULSAR_SERVICE_URL', 'pulsar://pulsar:6650')
 INPUT_TOPIC = getenv('INPUT_TOPIC', 'persistent://public/default/ohlc-trades')
 SUBSCRIPTION_NAME = getenv('SUBSCRIPTION_NAME', 'trade-data-ws-consumer')
+# single, or symbol/timeframe to read the per-symbol topics of the aggregator on demand
+TOPIC_MODE = getenv('TOPIC_MODE', 'single')
+TOPIC_IDLE_GRACE_S = float(getenv('TOPIC_IDLE_GRACE_S', '30'))
+# Clients that get this many updates while one write is still pending are disconnected
+CLIENT_MAX_LAG = int(getenv('CLIENT_MAX_LAG', '1000'))
+STATS_INTERVAL_S = float(getenv('STATS_INTERVAL_S', '60'))
+# Closed candles kept per symbol/timeframe for history requests, 0 disables the cache
+CANDLE_CACHE_SIZE = int(getenv('CANDLE_CACHE_SIZE', '500'))
+CANDLE_CACHE_MAX_KEYS = int(getenv('CANDLE_CACHE_MAX_KEYS', '10000'))
+# Processes accepting connections on the same port (SO_REUSEPORT), each reading the whole stream
+WORKERS = int(getenv('WORKERS', '1'))
+# Time given to flush queued messages to clients on SIGTERM before they are disconnected
+DRAIN_TIMEOUT_S = float(getenv('DRAIN_TIMEOUT_S', '5'))
+METRICS_ENABLED = getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Worker n serves its metrics on METRICS_PORT + n
+METRICS_PORT = int(getenv('METRICS_PORT', '9101'))
 
 
-async def main():
-    connection_manager = ConnectionManager()
+def create_forwarder(pulsar_client: Client, connection_manager: ConnectionManager, worker: int | None):
+    if TOPIC_MODE == 'single':
+        if worker is None:
+            return PulsarWebSocketForwarder(
+                pulsar_client,
+                connection_manager,
+                INPUT_TOPIC,
+                SUBSCRIPTION_NAME,
+                ConsumerType.Shared
+            )
+        # Every worker has different clients, so each needs the full stream; it
+        # reads from the latest candle on rather than keeping a durable
+        # subscription per worker, which would pile up a backlog (and replay
+        # it later) whenever WORKERS is lowered
+        return PulsarWebSocketForwarder(pulsar_client, connection_manager, INPUT_TOPIC)
+    return PulsarTopicForwarder(
+        pulsar_client,
+        connection_manager,
+        INPUT_TOPIC,
+        TOPIC_MODE,
+        TOPIC_IDLE_GRACE_S
+    )
+
+
+async def report_stats(connection_manager: ConnectionManager, worker: int | None, counters: SynchronizedArray | None):
+    if counters is not None:
+        # The parent process logs the stats of all workers
+        offset = worker * len(STATS_FIELDS)
+        while True:
+            stats = connection_manager.stats()
+            for i, field in enumerate(STATS_FIELDS):
+                counters[offset + i] = getattr(stats, field)
+            await asyncio.sleep(1)
+
+    while True:
+        await asyncio.sleep(STATS_INTERVAL_S)
+        stats = connection_manager.stats()
+        logger.info(
+            f'{stats.clients} clients, {stats.queued} queued, {stats.sent} sent, '
+            f'{stats.dropped} conflated, {stats.slow_disconnects} slow clients disconnected'
+        )
+
+
+def register_connection_metrics(connection_manager: ConnectionManager) -> None:
+    Gauge(
+        'trade_data_ws_clients', 'Connected WebSocket clients'
+    ).set_function(lambda: connection_manager.stats().clients)
+    Gauge(
+        'trade_data_ws_queued_messages', 'Messages queued for clients and not yet written'
+    ).set_function(lambda: connection_manager.stats().queued)
+    CallbackCounter(
+        'trade_data_ws_messages_sent_total', 'Messages written to clients',
+        callback=lambda: connection_manager.stats().sent)
+    CallbackCounter(
+        'trade_data_ws_messages_conflated_total', 'Queued messages replaced by a newer one before being written',
+        callback=lambda: connection_manager.stats().dropped)
+    CallbackCounter(
+        'trade_data_ws_slow_disconnects_total', 'Clients disconnected for falling too far behind',
+        callback=lambda: connection_manager.stats().slow_disconnects)
+
+
+async def main(worker: int | None = None, counters: SynchronizedArray | None = None):
+    candle_cache = CandleCache(CANDLE_CACHE_SIZE, CANDLE_CACHE_MAX_KEYS) if CANDLE_CACHE_SIZE > 0 else None
+    connection_manager = ConnectionManager(CLIENT_MAX_LAG, candle_cache)
     pulsar_client = Client(PULSAR_SERVICE_URL)
+    stop_metrics_server = None
+    if METRICS_ENABLED:
+        register_connection_metrics(connection_manager)
+        stop_metrics_server = start_metrics_server(METRICS_PORT + (worker or 0))
 
+    websocket_server = None
     try:
-        async with PulsarWebSocketForwarder(
-            pulsar_client,
-            connection_manager,
-            INPUT_TOPIC,
-            SUBSCRIPTION_NAME,
-            ConsumerType.Shared
-        ):
-            websocket_server = await serve(
-                lambda ws: websocket_handler(ws, connection_manager),
-                '0.0.0.0',
-                8765
-            )
+        try:
+            async with create_forwarder(pulsar_client, connection_manager, worker):
+                websocket_server = await serve(
+                    lambda ws: websocket_handler(ws, connection_manager),
+                    '0.0.0.0',
+                    8765,
+                    select_subprotocol=select_subprotocol,
+                    reuse_port=worker is not None
+                )
 
-            shutdown_event = asyncio.Event()
-            loop = asyncio.get_running_loop()
-            for sig in (SIGTERM, SIGINT):
-                loop.add_signal_handler(sig, shutdown_event.set)
+                shutdown_event = asyncio.Event()
+                loop = asyncio.get_running_loop()
+                for sig in (SIGTERM, SIGINT):
+                    loop.add_signal_handler(sig, shutdown_event.set)
 
-            try:
-                await shutdown_event.wait()
-            finally:
+                reporter = asyncio.create_task(report_stats(connection_manager, worker, counters))
+                try:
+                    await shutdown_event.wait()
+                finally:
+                    reporter.cancel()
+                    # Stop accepting connections so new clients land on another worker
+                    websocket_server.server.close()
+        finally:
+            # The forwarder is stopped first, so nothing is queued for clients while they drain
+            if websocket_server is not None:
+                logger.info('Draining WebSocket clients...')
+                if not await connection_manager.drain(DRAIN_TIMEOUT_S):
+                    logger.warning(f'Clients not drained after {DRAIN_TIMEOUT_S}s, closing anyway')
                 logger.info('Closing WebSocket server...')
                 websocket_server.close()
                 await websocket_server.wait_closed()
                 logger.info('WebSocket server closed')
     finally:
+        if stop_metrics_server is not None:
+            stop_metrics_server()
         await asyncio.to_thread(pulsar_client.close)
         logger.info('Pulsar client closed')
 
 
+def run_worker(worker: int, counters: SynchronizedArray):
+    asyncio.run(main(worker, counters))
+
+
 if __name__ == '__main__':
+    if WORKERS > 1:
+        sys.exit(run_workers(WORKERS, run_worker, STATS_INTERVAL_S))
     asyncio.run(main())
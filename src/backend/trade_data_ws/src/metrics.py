@@ -0,0 +1,82 @@
+"""Prometheus metrics of the service, served by prometheus_client.
+
+Updating a metric on the per-message path is a single locked addition.
+Callback gauges and counters are only evaluated when the endpoint is
+scraped, from its own thread.
+"""
+import logging
+import time
+from typing import Callable, Iterator
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.registry import Collector
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+LAG_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class CallbackCounter(Collector):
+    """A counter read from callback at scrape time, for totals the service already keeps"""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float], registry: CollectorRegistry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        registry.register(self)
+
+    def collect(self) -> Iterator[CounterMetricFamily]:
+        yield CounterMetricFamily(self.name, self.documentation, value=self.callback())
+
+
+def start_metrics_server(port: int, host: str = '0.0.0.0') -> Callable[[], None]:
+    """Serve the default registry at :port/metrics from a background thread, returns its shutdown function"""
+    server, _ = start_http_server(port, host)
+    logger.info(f"Serving metrics on :{port}/metrics")
+    return server.shutdown
+
+
+class LogSampler:
+    """Lets every n-th occurrence of a hot-path log message through"""
+
+    def __init__(self, every: int = 1000):
+        self.every = every
+        self.count = 0
+
+    def __call__(self) -> bool:
+        self.count += 1
+        return self.count % self.every == 1 or self.every == 1
+
+
+MESSAGES_RECEIVED = Counter(
+    'trade_data_ws_messages_received_total', 'Candle messages received from Pulsar')
+RECEIVE_TO_ACK = Histogram(
+    'trade_data_ws_receive_to_ack_seconds', 'Time from receiving a message to acknowledging it', buckets=LATENCY_BUCKETS)
+BROADCAST_SECONDS = Histogram(
+    'trade_data_ws_broadcast_seconds', 'Time to route a message and queue it for its subscribers', buckets=LATENCY_BUCKETS)
+BROADCAST_FANOUT = Histogram(
+    'trade_data_ws_broadcast_fanout', 'Clients a message was queued for', buckets=FANOUT_BUCKETS)
+TRADE_TO_BROADCAST = Histogram(
+    'trade_data_ws_trade_to_broadcast_seconds', 'Time from the trade that closed a candle to queueing it for clients', buckets=LAG_BUCKETS)
+CONSUMER_LAG = Gauge(
+    'trade_data_ws_consumer_lag_seconds', 'Age of the last received message at receive time')
+
+
+def observe_broadcast(message, recipients: int, started: float) -> None:
+    """Record the metrics of one forwarded Pulsar message"""
+    now = time.perf_counter()
+    MESSAGES_RECEIVED.inc()
+    BROADCAST_SECONDS.observe(now - started)
+    BROADCAST_FANOUT.observe(recipients)
+    wall_clock = time.time()
+    CONSUMER_LAG.set(wall_clock - message.publish_timestamp() / 1000)
+    event_time_ms = message.event_timestamp()
+    if event_time_ms:
+        TRADE_TO_BROADCAST.observe(wall_clock - event_time_ms / 1000)
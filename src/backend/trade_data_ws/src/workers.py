@@ -0,0 +1,78 @@
+import logging
+import multiprocessing
+from multiprocessing.sharedctypes import SynchronizedArray
+import signal
+import time
+from typing import Callable
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Per worker slots in the shared stats array, in this order
+STATS_FIELDS = ('clients', 'queued', 'sent', 'dropped', 'slow_disconnects')
+
+# How long workers get to drain their clients before they are killed
+SHUTDOWN_GRACE_S = 30.0
+
+
+def run_workers(
+    worker_count: int,
+    worker: Callable[[int, SynchronizedArray], None],
+    report_interval_s: float = 60.0
+) -> int:
+    """Run worker_count gateway processes sharing the listening port until SIGTERM/SIGINT or a worker dies.
+
+    SIGTERM is forwarded to the workers so each one can drain its own
+    connections. Workers publish their connection stats into a shared array
+    that the parent logs every report_interval_s.
+    """
+    context = multiprocessing.get_context('spawn')
+    stats = context.Array('Q', worker_count * len(STATS_FIELDS), lock=False)
+    processes = [
+        context.Process(target=worker, args=(index, stats), name=f'trade-data-ws-{index}')
+        for index in range(worker_count)
+    ]
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, stop)
+
+    for process in processes:
+        process.start()
+    logger.info(f"Started {worker_count} gateway workers")
+
+    last_report = time.monotonic()
+    exit_code = 0
+    while not stopping:
+        time.sleep(0.5)
+        if any(not process.is_alive() for process in processes):
+            logger.error("A gateway worker exited unexpectedly, stopping all workers")
+            exit_code = 1
+            break
+
+        now = time.monotonic()
+        if now - last_report >= report_interval_s:
+            for index in range(worker_count):
+                values = stats[index * len(STATS_FIELDS):(index + 1) * len(STATS_FIELDS)]
+                logger.info(f"Worker {index}: " + ', '.join(f'{value} {field}' for field, value in zip(STATS_FIELDS, values)))
+            last_report = now
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + SHUTDOWN_GRACE_S
+    for process in processes:
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            process.kill()
+            process.join()
+    logger.info("All gateway workers stopped")
+    return exit_code
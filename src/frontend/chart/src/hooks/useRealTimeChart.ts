@@ -10,6 +10,7 @@ import {
 } from '~/shared/types';
 import { normalizeToSeconds } from '~/shared/utils';
 import { WebSocketService } from '~/services/WebSocketService';
+import { fetchGatewayHistory } from '~/services/gatewayHistory';
 import { CANDLESTICK_CONFIG, CHART_CONFIG } from '~/components/Chart/constants';
 import { CandlestickManager } from "~/managers/CandlestickManager";
 import { useNavigate, useSearch } from '@tanstack/react-router';
@@ -42,11 +43,17 @@ export function useRealTimeChart({ wsUrl }: { wsUrl: string }) {
 
     const { data: historicalData } = useSuspenseQuery({
         queryKey: ["ohlc", symbol, timeframe.size, timeframe.unit],
-        queryFn: () => fetchChartData({
-            symbol,
-            timeframeSize: timeframe.size,
-            timeframeUnit: timeframe.unit,
-        }),
+        queryFn: async () => {
+            // Recent candles come from the gateway's cache, ClickHouse only fills in what is older
+            const cached = await fetchGatewayHistory(wsUrl, symbol, timeframe);
+            const older = await fetchChartData({
+                symbol,
+                timeframeSize: timeframe.size,
+                timeframeUnit: timeframe.unit,
+                end: cached?.start ?? undefined,
+            });
+            return cached ? [...older, ...cached.candles] : older;
+        },
     });
 
     const manager = useMemo(() => {
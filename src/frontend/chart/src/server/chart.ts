@@ -1,29 +1,23 @@
 import { createServerFn } from '@tanstack/react-start'
 import { client } from './db'
+import { loadRetention, rangeQuery, windowStart } from './rollups'
 import { ohlcParamsSchema, CandlestickData, OHLCParams } from '~/shared/types'
 
 async function fetchOHLC(params: OHLCParams): Promise<CandlestickData[]> {
-  const { symbol, timeframeSize, timeframeUnit } = ohlcParamsSchema.parse(params)
+  const { symbol, timeframeSize, timeframeUnit, end: before } = ohlcParamsSchema.parse(params)
+  const timeframe = { size: timeframeSize, unit: timeframeUnit }
+  // Closed windows only, the forming one is fetched separately
+  const currentStart = windowStart(timeframe, Math.floor(Date.now() / 1000))
+  const end = before === undefined ? currentStart : Math.min(before, currentStart)
 
   try {
+    const retention = await loadRetention(client)
     const resultSet = await client.query({
-      query: `
-              SELECT
-                toUnixTimestamp(fromUnixTimestamp(time)) as time,
-                open,
-                high,
-                low,
-                close
-              FROM ohlc_db.ohlc_table
-              WHERE symbol = {symbol:String}
-                AND timeframe_size = {size:UInt32}
-                AND timeframe_unit = {unit:String}
-              ORDER BY time ASC
-            `,
+      query: rangeQuery(timeframe, 0, retention),
       query_params: {
         symbol,
-        size: timeframeSize,
-        unit: timeframeUnit
+        start: 0,
+        end
       },
       format: 'JSONEachRow',
     })
@@ -80,12 +74,12 @@ async function fetchFormingCandleOHL(params: OHLCParams): Promise<FormingCandleO
             close,
             ROW_NUMBER() OVER (ORDER BY time ASC) as rn_asc,
             ROW_NUMBER() OVER (ORDER BY time DESC) as rn_desc
-          FROM ohlc_db.ohlc_table
+          FROM ohlc_db.ohlc_table FINAL
           WHERE symbol = {symbol:String}
             AND timeframe_size = 1
             AND timeframe_unit = 'second'
-            AND time >= {start:UInt32}
-            AND time < {end:UInt32}
+            AND time >= toDateTime({start:UInt32})
+            AND time < toDateTime({end:UInt32})
         )
         SELECT
           any(open) FILTER (WHERE rn_asc = 1) as first_open,
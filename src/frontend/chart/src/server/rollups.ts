@@ -0,0 +1,140 @@
+import type { ClickHouseClient } from '@clickhouse/client'
+import { Timeframe, TimeUnit } from '~/shared/types'
+
+// Candle tiers written by the aggregator (see ohlc_aggregator/src/rollups.py):
+// 1s candles are rows of ohlc_table, 1m/1h/1d are AggregatingMergeTree rollups
+interface RollupTier {
+  name: '1s' | '1m' | '1h' | '1d'
+  seconds: number
+  table: string
+}
+
+const SECOND_TIER: RollupTier = { name: '1s', seconds: 1, table: 'ohlc_db.ohlc_table' }
+const TIERS: RollupTier[] = [
+  SECOND_TIER,
+  { name: '1m', seconds: 60, table: 'ohlc_db.ohlc_rollup_1m' },
+  { name: '1h', seconds: 3600, table: 'ohlc_db.ohlc_rollup_1h' },
+  { name: '1d', seconds: 86400, table: 'ohlc_db.ohlc_rollup_1d' },
+]
+
+const SECOND_CANDLES = "timeframe_size = 1 AND timeframe_unit = 'second'"
+
+type Retention = Record<RollupTier['name'], number>
+
+// TTLs are read from the tables the aggregator sets them on, and refreshed this often
+const RETENTION_TTL_MS = 5 * 60 * 1000
+let retentionCache: { loadedAt: number; days: Retention } | null = null
+
+/**
+ * Days kept per tier, 0 keeps the tier forever. Read from the TTL
+ * apply_retention of the aggregator sets on each table, so the chart never
+ * needs its own copy of the RETENTION_*_DAYS settings.
+ */
+export async function loadRetention(client: ClickHouseClient): Promise<Retention> {
+  if (retentionCache && Date.now() - retentionCache.loadedAt < RETENTION_TTL_MS) {
+    return retentionCache.days
+  }
+  let rows: { full_name: string; engine_full: string }[]
+  try {
+    const resultSet = await client.query({
+      query: `
+        SELECT concat(database, '.', name) AS full_name, engine_full
+        FROM system.tables
+        WHERE concat(database, '.', name) IN {tables:Array(String)}
+      `,
+      query_params: { tables: TIERS.map((tier) => tier.table) },
+      format: 'JSONEachRow',
+    })
+    rows = await resultSet.json<{ full_name: string; engine_full: string }>()
+  } catch (e) {
+    // Every tier is assumed complete, until the next call retries
+    console.error('ClickHouse Query Error (tier retention):', e)
+    rows = []
+  }
+  const days = {} as Retention
+  for (const tier of TIERS) {
+    const engine = rows.find((row) => row.full_name === tier.table)?.engine_full ?? ''
+    const ttl = / TTL .*?toIntervalDay\((\d+)\)/.exec(engine)
+    days[tier.name] = ttl ? Number(ttl[1]) : 0
+  }
+  if (rows.length) retentionCache = { loadedAt: Date.now(), days }
+  return days
+}
+
+// (period the window is truncated within, alignment step, epoch offset) in
+// seconds, as FIXED_LAYOUT of the aggregator's time_window.py
+const FIXED_LAYOUT: Partial<Record<TimeUnit, (size: number) => [number, number, number]>> = {
+  second: (size) => [3600, size, 0],
+  minute: (size) => [3600, size * 60, 0],
+  hour: (size) => [86400, size * 3600, 0],
+  day: () => [86400, 86400, 0],
+  // 1970-01-01 was a Thursday, shift by three days to align on Mondays
+  week: () => [604800, 604800, 3 * 86400],
+}
+
+/** Start of the window of tf containing ts (epoch seconds), as TimeWindow.get_window_bounds */
+export function windowStart(tf: Timeframe, ts: number): number {
+  const layout = FIXED_LAYOUT[tf.unit]
+  if (layout) {
+    const [period, step, offset] = layout(tf.size)
+    return ts - ((ts + offset) % period) % step
+  }
+  const moment = new Date(ts * 1000)
+  const month = tf.unit === 'month' ? moment.getUTCMonth() : 0
+  return Date.UTC(moment.getUTCFullYear(), month, 1) / 1000
+}
+
+/** Whether every window of tf starts on a bucket boundary of tier */
+function aligned(tf: Timeframe, tier: RollupTier): boolean {
+  const layout = FIXED_LAYOUT[tf.unit]
+  if (!layout) return tier.seconds <= 86400
+  const [period, step, offset] = layout(tf.size)
+  return period % tier.seconds === 0 && step % tier.seconds === 0 && offset % tier.seconds === 0
+}
+
+/** Coarsest tier that can answer tf candles from start (epoch seconds) on */
+function selectTier(tf: Timeframe, start: number, retention: Retention, now: number): RollupTier {
+  const usable = TIERS.filter((tier) => aligned(tf, tier))
+  for (const tier of [...usable].reverse()) {
+    const days = retention[tier.name]
+    if (days <= 0 || start >= now - days * 86400) return tier
+  }
+  // Nothing still holds the start of the range, the coarsest tier holds the most of it
+  return usable[usable.length - 1]
+}
+
+/** SQL for the epoch-seconds window start of time */
+function windowStartSql(tf: Timeframe): string {
+  if (tf.unit === 'month') return "toUnixTimestamp(toDateTime(toStartOfMonth(time, 'UTC'), 'UTC'))"
+  if (tf.unit === 'year') return "toUnixTimestamp(toDateTime(toStartOfYear(time, 'UTC'), 'UTC'))"
+  const [period, step, offset] = FIXED_LAYOUT[tf.unit]!(tf.size)
+  return `toUnixTimestamp(time) - (toUnixTimestamp(time) + ${offset}) % ${period} % ${step}`
+}
+
+/**
+ * Query for the tf candles of a symbol built from [start, end), epoch seconds.
+ * Windows cut by either end only cover their part of the range. Rows are
+ * time (window start), open, high, low, close, oldest first; the query takes
+ * the symbol, start and end query params. retention comes from loadRetention.
+ */
+export function rangeQuery(tf: Timeframe, start: number, retention: Retention, now: number = Date.now() / 1000): string {
+  const tier = selectTier(tf, start, retention, now)
+  const aggregates = tier === SECOND_TIER
+    ? 'argMin(open, time) AS o, max(high) AS h, min(low) AS l, argMax(close, time) AS c'
+    : 'argMinMerge(open) AS o, maxMerge(high) AS h, minMerge(low) AS l, argMaxMerge(close) AS c'
+  const source = tier === SECOND_TIER
+    ? `${tier.table} FINAL WHERE ${SECOND_CANDLES} AND symbol = {symbol:String}`
+    : `${tier.table} WHERE symbol = {symbol:String}`
+  return `
+    SELECT window AS time, o AS open, h AS high, l AS low, c AS close
+    FROM
+    (
+      SELECT ${windowStartSql(tf)} AS window, ${aggregates}
+      FROM ${source}
+        AND time >= toDateTime({start:UInt32})
+        AND time < toDateTime({end:UInt32})
+      GROUP BY window
+    )
+    ORDER BY time
+  `
+}
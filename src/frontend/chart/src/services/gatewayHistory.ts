@@ -0,0 +1,74 @@
+import { CandlestickData, Timeframe } from '~/shared/types';
+
+// Version 2 JSON subprotocol of the gateway, the only one that answers history requests
+const PROTOCOL_JSON = 'ohlc.v2.json';
+const HISTORY_TIMEOUT_MS = 3000;
+// At most the gateway's CANDLE_CACHE_SIZE
+export const HISTORY_LIMIT = 500;
+
+export interface GatewayHistory {
+    // Time of the oldest cached candle, older ones have to come from ClickHouse
+    start: number | null;
+    candles: CandlestickData[];
+}
+
+type HistoryRow = [number, number, number, number, number];
+
+/**
+ * Recent closed candles from the gateway's cache, over a short-lived connection.
+ * Resolves to null when the gateway cannot answer (no cache, not reachable,
+ * server-side render), callers then load everything from ClickHouse.
+ */
+export function fetchGatewayHistory(
+    wsUrl: string,
+    symbol: string,
+    timeframe: Timeframe,
+    limit: number = HISTORY_LIMIT
+): Promise<GatewayHistory | null> {
+    if (typeof window === 'undefined' || typeof WebSocket === 'undefined') {
+        return Promise.resolve(null);
+    }
+
+    return new Promise(resolve => {
+        let ws: WebSocket;
+        try {
+            ws = new WebSocket(wsUrl, PROTOCOL_JSON);
+        } catch (error) {
+            console.error('[GatewayHistory] Failed to connect', error);
+            resolve(null);
+            return;
+        }
+
+        const finish = (result: GatewayHistory | null) => {
+            clearTimeout(timer);
+            ws.onmessage = ws.onerror = null;
+            ws.close();
+            resolve(result);
+        };
+        const timer = setTimeout(() => finish(null), HISTORY_TIMEOUT_MS);
+
+        ws.onopen = () => {
+            ws.send(JSON.stringify({ op: 'history', id: 0, symbol, timeframe, limit }));
+        };
+        ws.onerror = () => finish(null);
+        ws.onmessage = (event) => {
+            const reply = JSON.parse(event.data);
+            if (reply.id !== 0) return;
+            if (reply.op !== 'history') {
+                console.error('[GatewayHistory] History request failed', reply.error);
+                finish(null);
+                return;
+            }
+            finish({
+                start: reply.start,
+                candles: (reply.candles as HistoryRow[]).map(([time, open, high, low, close]) => ({
+                    time: time as CandlestickData['time'],
+                    open,
+                    high,
+                    low,
+                    close,
+                })),
+            });
+        };
+    });
+}
@@ -13,6 +13,8 @@ export const ohlcParamsSchema = z.object({
     symbol: z.string(),
     timeframeSize: z.number(),
     timeframeUnit: z.enum(TIME_UNITS),
+    // Only candles of windows starting before this (epoch seconds), e.g. the gateway's cached ones start here
+    end: z.number().optional(),
 });
 
 export type Timeframe = z.infer<typeof timeframeSchema>;
@@ -29,6 +31,8 @@ export interface CandlestickData {
 export interface SymbolDataMessage {
     symbol: string;
     timeframe: Timeframe;
+    // Set on updates of a still forming candle, sent to subscriptions with `partial: true`
+    partial?: boolean;
     ohlc: CandlestickData;
 }
 